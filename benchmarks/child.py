@@ -0,0 +1,45 @@
+"""Runs one sync phase inside a benchmark subprocess and writes its measurements.
+
+Usage: python benchmarks/child.py files|database OUTPUT.json
+"""
+import json
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from metrics import METRICS  # noqa: E402
+
+
+def run(target: str) -> dict:
+    started = time.monotonic()
+    error = None
+    result = None
+    try:
+        result = main.sync_files() if target == 'files' else main.copy_database()
+    except Exception as e:
+        error = str(e)
+    wall = time.monotonic() - started
+    counters = dict(METRICS.counters)
+    nbytes = counters.get('ftp_bytes_downloaded' if target == 'files' else 'db_dump_bytes', 0)
+    return {
+        'wall_seconds': round(wall, 3),
+        'bytes': int(nbytes),
+        'bytes_per_second': round(nbytes / wall) if wall > 0 else None,
+        'files': int(counters.get('ftp_files_downloaded', 0)),
+        # ru_maxrss is KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'children_peak_rss_mb': round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        'result': result,
+        'error': error,
+        'counters': counters,
+    }
+
+
+if __name__ == '__main__':
+    out = run(sys.argv[1])
+    with open(sys.argv[2], 'w') as fh:
+        json.dump(out, fh, default=str)
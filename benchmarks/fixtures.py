@@ -0,0 +1,143 @@
+"""Local stand-ins for the remote FTP server used by the benchmarks.
+
+The FTP fixture needs the optional ``pyftpdlib`` package (pip install
+pyftpdlib); it is only imported when a file scenario runs.
+"""
+import os
+import random
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+# Fixed modify time for generated files, so repeated runs see identical trees
+TREE_MTIME = 1700000000
+
+TREE_SHAPES: Dict[str, Dict] = {
+    # many small files spread over a few directories
+    'small': {'dirs': 20, 'files_per_dir': 100, 'size': 4 * 1024},
+    # a handful of large files (--scale shrinks their size, not their number)
+    'huge': {'dirs': 1, 'files_per_dir': 4, 'size': 64 * 1024 * 1024, 'scale_size': True},
+    # deep binary tree with a few files per directory
+    'deep': {'depth': 8, 'branching': 2, 'files_per_dir': 3, 'size': 32 * 1024},
+    # mixed sizes: mostly small files plus some large ones
+    'mixed': {'dirs': 10, 'files_per_dir': 50, 'size': 16 * 1024, 'large': 4, 'large_size': 32 * 1024 * 1024},
+}
+
+
+def _write(path: str, size: int, block: bytes):
+    with open(path, 'wb') as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+    os.utime(path, (TREE_MTIME, TREE_MTIME))
+
+
+def build_tree(root: str, shape: str, scale: float = 1.0) -> Dict[str, int]:
+    """Create the ``shape`` tree under ``root`` (reused when already built). Returns file/byte counts."""
+    spec = TREE_SHAPES[shape]
+    # Kept next to the tree, not inside it, so it is not served
+    marker = root.rstrip(os.sep) + '.complete'
+    if os.path.exists(marker):
+        with open(marker) as fh:
+            files, nbytes = map(int, fh.read().split())
+        return {'files': files, 'bytes': nbytes}
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    rng = random.Random(shape)
+    block = rng.randbytes(1024 * 1024)
+    files = nbytes = 0
+
+    def fill(d: str, count: int, size: int, prefix: str = 'f'):
+        nonlocal files, nbytes
+        os.makedirs(d, exist_ok=True)
+        for i in range(count):
+            _write(os.path.join(d, f'{prefix}{i:05d}.bin'), size, block)
+            files += 1
+            nbytes += size
+
+    if spec.get('scale_size'):
+        per_dir, file_size = spec['files_per_dir'], max(1, int(spec['size'] * scale))
+    else:
+        per_dir, file_size = max(1, int(spec['files_per_dir'] * scale)), spec['size']
+    if 'depth' in spec:
+        def walk(d: str, depth: int):
+            fill(d, per_dir, file_size)
+            if depth < spec['depth']:
+                for b in range(spec['branching']):
+                    walk(os.path.join(d, f'd{b}'), depth + 1)
+        walk(root, 0)
+    else:
+        for i in range(spec['dirs']):
+            fill(os.path.join(root, f'dir{i:03d}'), per_dir, file_size)
+        if spec.get('large'):
+            fill(os.path.join(root, 'large'), spec['large'], int(spec['large_size'] * scale), 'big')
+    with open(marker, 'w') as fh:
+        fh.write(f'{files} {nbytes}')
+    return {'files': files, 'bytes': nbytes}
+
+
+class FTPFixture:
+    """pyftpdlib server on 127.0.0.1 serving ``root`` with optional impairments.
+
+    ``latency`` delays every control command reply (seconds), ``bandwidth``
+    caps each data connection (bytes/s) and ``max_connections`` makes the
+    server answer 421 beyond that many sessions. The limit is per client
+    address, which only counts control connections; pyftpdlib's ``max_cons``
+    also counts data channels and refuses those with 425 instead.
+    """
+
+    def __init__(self, root: str, latency: float = 0.0, bandwidth: int = 0,
+                 max_connections: int = 0, user: str = 'bench', password: str = 'bench'):
+        try:
+            from pyftpdlib.authorizers import DummyAuthorizer
+            from pyftpdlib.handlers import FTPHandler, ThrottledDTPHandler
+            from pyftpdlib.servers import ThreadedFTPServer
+        except ImportError:
+            raise RuntimeError('The FTP benchmark fixture needs pyftpdlib (pip install pyftpdlib)')
+        import logging
+        logging.getLogger('pyftpdlib').setLevel(logging.ERROR)
+
+        authorizer = DummyAuthorizer()
+        authorizer.add_user(user, password, root, perm='elr')
+
+        class Handler(FTPHandler):
+            def process_command(self, cmd, *args, **kwargs):
+                if latency:
+                    time.sleep(latency)
+                return super().process_command(cmd, *args, **kwargs)
+
+        Handler.authorizer = authorizer
+        Handler.banner = 'lotus-cp benchmark fixture'
+        if bandwidth:
+            class DTP(ThrottledDTPHandler):
+                write_limit = bandwidth
+            Handler.dtp_handler = DTP
+        self.server = ThreadedFTPServer(('127.0.0.1', 0), Handler)
+        if max_connections:
+            self.server.max_cons_per_ip = max_connections
+        self.port = self.server.address[1]
+        self.user = user
+        self.password = password
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'FTPFixture':
+        self._thread = threading.Thread(target=self.server.serve_forever, kwargs={'handle_exit': False}, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.close_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def env(self) -> Dict[str, str]:
+        return {
+            'REMOTE_FTP_HOST': '127.0.0.1',
+            'REMOTE_FTP_PORT': str(self.port),
+            'REMOTE_FTP_USER': self.user,
+            'REMOTE_FTP_PASSWORD': self.password,
+            'REMOTE_FTP_PASSIVE': 'true',
+            'REMOTE_FILES_PATH': '/',
+        }
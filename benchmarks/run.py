@@ -0,0 +1,235 @@
+"""Benchmark harness for the file sync and the database pipeline.
+
+File scenarios start a local pyftpdlib server (see fixtures.py) serving a
+generated tree and run ``sync_files()`` against it; database scenarios put the
+mysqldump/mysql stand-ins from ``shims/`` first on PATH and run
+``copy_database()``. Every run happens in a fresh subprocess with a clean
+LOCAL_FILES_PATH and SYNC_STATE_DIR, and records wall time, bytes, throughput
+and peak RSS. Results are written to benchmarks/results/ as JSON.
+
+Usage::
+
+    python benchmarks/run.py --list
+    python benchmarks/run.py [SCENARIO ...] [--repeat N] [--scale F] [--set KEY=VALUE ...]
+    python benchmarks/run.py --compare OLD.json NEW.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from typing import Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from fixtures import FTPFixture, build_tree  # noqa: E402
+from scenarios import SCENARIOS  # noqa: E402
+
+RESULTS_DIR = os.path.join(HERE, 'results')
+CACHE_DIR = os.path.join(HERE, '.cache')
+
+# Explicit defaults so a developer's .env does not leak into the measurements
+BASE_ENV = {
+    'FILTER_EXTENSIONS': '',
+    'FTP_RECURSIVE': 'true',
+    'FTP_RECENT_ONLY': 'false',
+    'FTP_ENGINE': 'threads',
+    'FTP_MAX_WORKERS': '4',
+    'FTP_MAX_WORKERS_LIMIT': '0',
+    'FTP_LIST_WORKERS': '4',
+    'FTP_MAX_DEPTH': '0',
+    'FTP_USE_MLSD': 'true',
+    'FTP_SKIP_UNCHANGED': 'true',
+    'FTP_MANIFEST': 'true',
+    'FTP_LISTING_CACHE': 'false',
+    'FTP_RESUME': 'true',
+    'FTP_SEGMENTED_MIN_MB': '0',
+    'FTP_BANDWIDTH_LIMIT_KBPS': '0',
+    'FTP_VERIFY': 'false',
+    'FTP_MIRROR': 'false',
+    'REMOTE_DB_HOST': 'bench', 'REMOTE_DB_PORT': '3306', 'REMOTE_DB_USER': 'bench',
+    'REMOTE_DB_PASSWORD': 'bench', 'REMOTE_DB_NAME': 'bench',
+    'LOCAL_DB_HOST': 'localhost', 'LOCAL_DB_PORT': '3306', 'LOCAL_DB_USER': 'bench',
+    'LOCAL_DB_PASSWORD': 'bench', 'LOCAL_DB_NAME': 'bench',
+    'DB_STREAM_RESTORE': 'false',
+    'DB_STREAM_ARCHIVE_DIR': '',
+    'DB_BULK_LOAD': 'false',
+    'DB_PARALLEL': 'false',
+    'DB_INCREMENTAL': 'false',
+    'DB_BINLOG': 'false',
+    'DB_ARCHIVE': 'false',
+    'SYNC_REPORT_DIR': '',
+    'SYNC_PROMETHEUS_TEXTFILE': '',
+}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_child(target: str, env: Dict[str, str], workdir: str) -> Dict:
+    out = os.path.join(workdir, 'child.json')
+    proc = subprocess.run([sys.executable, os.path.join(HERE, 'child.py'), target, out],
+                          cwd=workdir, env=env, capture_output=True, text=True)
+    if proc.returncode != 0 or not os.path.exists(out):
+        raise RuntimeError(f'benchmark child failed ({proc.returncode}):\n{proc.stderr[-2000:]}')
+    with open(out) as fh:
+        return json.load(fh)
+
+
+def run_scenario(name: str, scale: float, overrides: Dict[str, str]) -> Dict:
+    spec = SCENARIOS[name]
+    workdir = tempfile.mkdtemp(prefix=f'lotus-bench-{name}-')
+    try:
+        env = dict(os.environ, **BASE_ENV)
+        env.update({
+            'LOCAL_FILES_PATH': os.path.join(workdir, 'local'),
+            'SYNC_STATE_DIR': os.path.join(workdir, 'state'),
+            'PYTHONUNBUFFERED': '1',
+        })
+        env.update(spec.get('env', {}))
+        env.update(overrides)
+        if spec['target'] == 'database':
+            env['PATH'] = os.path.join(HERE, 'shims') + os.pathsep + env.get('PATH', '')
+            return run_child('database', env, workdir)
+
+        tree_root = os.path.join(CACHE_DIR, f"{spec['tree']}-x{scale:g}")
+        tree = build_tree(tree_root, spec['tree'], scale)
+        with FTPFixture(tree_root, latency=spec.get('latency', 0.0), bandwidth=spec.get('bandwidth', 0),
+                        max_connections=spec.get('max_connections', 0)) as ftp:
+            env.update(ftp.env())
+            if spec.get('warm'):
+                run_child('files', env, workdir)
+            result = run_child('files', env, workdir)
+        result['tree'] = tree
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def sample_error(sample: Dict) -> Optional[str]:
+    """The child's exception, or a note when the sync finished with failed files or listings."""
+    if sample['error']:
+        return sample['error']
+    result = sample.get('result')
+    if isinstance(result, dict) and (result.get('failed') or result.get('list_errors')):
+        return f"incomplete: {result.get('failed', 0)} failed, {result.get('list_errors', 0)} list errors"
+    return None
+
+
+def summarize(samples: List[Dict]) -> Dict:
+    walls = [s['wall_seconds'] for s in samples]
+    best = min(samples, key=lambda s: s['wall_seconds'])
+    return {
+        'wall_seconds': round(statistics.median(walls), 3),
+        'wall_seconds_min': min(walls),
+        'wall_seconds_max': max(walls),
+        'bytes_per_second': round(statistics.median(s['bytes_per_second'] or 0 for s in samples)),
+        'peak_rss_mb': max(s['peak_rss_mb'] for s in samples),
+        'children_peak_rss_mb': max(s['children_peak_rss_mb'] for s in samples),
+        'bytes': best['bytes'],
+        'files': best['files'],
+        'errors': [e for e in map(sample_error, samples) if e],
+        'samples': samples,
+    }
+
+
+def print_table(results: Dict[str, Dict]):
+    print(f"{'scenario':32} {'wall s':>9} {'MiB/s':>9} {'files':>7} {'RSS MiB':>8}")
+    for name, r in results.items():
+        # An incomplete run's throughput says nothing about the code under test
+        mibs = '-' if r['errors'] else f"{(r['bytes_per_second'] or 0) / (1024 * 1024):.1f}"
+        flag = '  ERROR' if r['errors'] else ''
+        print(f"{name:32} {r['wall_seconds']:9.3f} {mibs:>9} {r['files']:7d} {r['peak_rss_mb']:8.1f}{flag}")
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as fh:
+        old = json.load(fh)
+    with open(new_path) as fh:
+        new = json.load(fh)
+    print(f"old: {old_path} ({old.get('commit')}, {old.get('started_at')})")
+    print(f"new: {new_path} ({new.get('commit')}, {new.get('started_at')})")
+    print(f"{'scenario':32} {'old s':>9} {'new s':>9} {'change':>8} {'old RSS':>8} {'new RSS':>8}")
+    for name in sorted(set(old['scenarios']) | set(new['scenarios'])):
+        a = old['scenarios'].get(name)
+        b = new['scenarios'].get(name)
+        if a is None or b is None:
+            print(f"{name:32} {'-' if a is None else a['wall_seconds']:>9} {'-' if b is None else b['wall_seconds']:>9}")
+            continue
+        change = (b['wall_seconds'] - a['wall_seconds']) / a['wall_seconds'] * 100 if a['wall_seconds'] else 0.0
+        print(f"{name:32} {a['wall_seconds']:9.3f} {b['wall_seconds']:9.3f} {change:+7.1f}% "
+              f"{a['peak_rss_mb']:8.1f} {b['peak_rss_mb']:8.1f}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark lotus-cp against local FTP/MySQL stand-ins.')
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run (default: all)')
+    parser.add_argument('--list', action='store_true', help='list scenarios')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per scenario (median is reported)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiply tree file counts / large file sizes')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra setting for every scenario, e.g. --set FTP_BLOCK_KB=256')
+    parser.add_argument('--label', default='', help='free-form note stored with the results')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<timestamp>_<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two results files')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, spec in SCENARIOS.items():
+            print(f"{name:32} {spec['target']:9} {spec.get('tree', '')}")
+        return 0
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    overrides = dict(kv.split('=', 1) for kv in args.set)
+
+    started = datetime.now()
+    results: Dict[str, Dict] = {}
+    for name in names:
+        samples = []
+        for i in range(max(1, args.repeat)):
+            print(f'[{name}] run {i + 1}/{args.repeat} ...', flush=True)
+            samples.append(run_scenario(name, args.scale, overrides))
+        results[name] = summarize(samples)
+
+    commit = git_commit()
+    report = {
+        'started_at': started.isoformat(),
+        'commit': commit,
+        'label': args.label,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'scale': args.scale,
+        'repeat': args.repeat,
+        'overrides': overrides,
+        'scenarios': results,
+    }
+    path = args.output or os.path.join(RESULTS_DIR, f"{started.strftime('%Y%m%d_%H%M%S')}_{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as fh:
+        json.dump(report, fh, indent=1, default=str)
+    print_table(results)
+    print(f'Results written to {path}')
+    return 1 if any(r['errors'] for r in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Benchmark scenarios.
+
+Each scenario runs one sync phase in a fresh process. Keys:
+
+- ``target``: 'files' (sync_files) or 'database' (copy_database)
+- ``tree``: tree shape from fixtures.TREE_SHAPES (file scenarios)
+- ``latency``: seconds added to every FTP command reply
+- ``bandwidth``: bytes/s per FTP data connection (0 = unlimited)
+- ``max_connections``: FTP sessions before the server answers 421
+- ``warm``: run the sync once untimed first, then time a re-sync with nothing to fetch
+- ``env``: settings passed to the sync as environment variables
+"""
+MiB = 1024 * 1024
+
+SCENARIOS = {
+    # -- many small files -----------------------------------------------------
+    'small-sequential': {'target': 'files', 'tree': 'small', 'env': {'FTP_MAX_WORKERS': '1'}},
+    'small-parallel': {'target': 'files', 'tree': 'small', 'env': {'FTP_MAX_WORKERS': '8'}},
+    'small-latency-threads': {
+        'target': 'files', 'tree': 'small', 'latency': 0.02,
+        'env': {'FTP_MAX_WORKERS': '8', 'FTP_MAX_WORKERS_LIMIT': '16'},
+    },
+    'small-latency-asyncio': {
+        'target': 'files', 'tree': 'small', 'latency': 0.02,
+        'env': {'FTP_ENGINE': 'asyncio', 'FTP_ASYNC_CONNECTIONS': '16'},
+    },
+    'small-warm-resync': {'target': 'files', 'tree': 'small', 'warm': True, 'env': {'FTP_MAX_WORKERS': '8'}},
+    'small-nlst': {'target': 'files', 'tree': 'small', 'env': {'FTP_MAX_WORKERS': '8', 'FTP_USE_MLSD': 'false'}},
+    'deep-warm-listing-cache': {
+        'target': 'files', 'tree': 'deep', 'latency': 0.005, 'warm': True,
+        'env': {'FTP_MAX_WORKERS': '8', 'FTP_LISTING_CACHE': 'true'},
+    },
+    # -- a few huge files ---------------------------------------------------------
+    'huge-parallel': {'target': 'files', 'tree': 'huge', 'env': {'FTP_MAX_WORKERS': '4'}},
+    'huge-throttled': {
+        'target': 'files', 'tree': 'huge', 'bandwidth': 16 * MiB,
+        'env': {'FTP_MAX_WORKERS': '4'},
+    },
+    'huge-throttled-segmented': {
+        'target': 'files', 'tree': 'huge', 'bandwidth': 16 * MiB,
+        'env': {'FTP_MAX_WORKERS': '4', 'FTP_SEGMENTED_MIN_MB': '16', 'FTP_SEGMENTS': '4'},
+    },
+    # -- deep nesting ---------------------------------------------------------------
+    'deep-mlsd': {'target': 'files', 'tree': 'deep', 'latency': 0.005, 'env': {'FTP_MAX_WORKERS': '8'}},
+    'deep-list-workers-1': {
+        'target': 'files', 'tree': 'deep', 'latency': 0.005,
+        'env': {'FTP_MAX_WORKERS': '8', 'FTP_LIST_WORKERS': '1'},
+    },
+    # -- connection limits --------------------------------------------------------
+    'mixed-conn-limit': {
+        'target': 'files', 'tree': 'mixed', 'max_connections': 4,
+        'env': {'FTP_MAX_WORKERS': '8', 'FTP_MAX_WORKERS_LIMIT': '8'},
+    },
+    # -- database pipeline (mysqldump/mysql stand-ins) ------------------------------
+    'db-dump-file': {'target': 'database', 'env': {'BENCH_DUMP_MB': '256', 'BENCH_DUMP_MBPS': '100'}},
+    'db-stream': {
+        'target': 'database',
+        'env': {'BENCH_DUMP_MB': '256', 'BENCH_DUMP_MBPS': '100', 'DB_STREAM_RESTORE': 'true'},
+    },
+    'db-stream-archive': {
+        'target': 'database',
+        'env': {'BENCH_DUMP_MB': '256', 'BENCH_DUMP_MBPS': '100', 'DB_STREAM_RESTORE': 'true', 'DB_ARCHIVE': 'true'},
+    },
+}
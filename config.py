@@ -46,6 +46,55 @@ LOCAL_DB = {
     'port': int(os.getenv('LOCAL_DB_PORT', '3306'))
 }
 
+# Table-parallel copy engine (consistent snapshot shared by all workers)
+DB_PARALLEL = os.getenv('DB_PARALLEL', 'false').lower() == 'true'
+DB_PARALLEL_WORKERS = int(os.getenv('DB_PARALLEL_WORKERS', '4'))
+DB_PARALLEL_BATCH_ROWS = int(os.getenv('DB_PARALLEL_BATCH_ROWS', '5000'))  # rows per multi-row INSERT
+
+# Local state (manifests, checkpoints) kept between runs
+SYNC_STATE_DIR = os.getenv('SYNC_STATE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state'))
+
+# Incremental DB sync: only reload tables whose fingerprint changed since the last run
+DB_INCREMENTAL = os.getenv('DB_INCREMENTAL', 'false').lower() == 'true'
+DB_INCREMENTAL_CHECKSUM = os.getenv('DB_INCREMENTAL_CHECKSUM', 'false').lower() == 'true'  # CHECKSUM TABLE (full scan)
+DB_INCREMENTAL_UPDATED_COLUMN = os.getenv('DB_INCREMENTAL_UPDATED_COLUMN', 'updated_at')  # blank disables
+DB_MANIFEST_PATH = os.path.join(SYNC_STATE_DIR, 'db_manifest.json')
+
+# Binlog replication: full dumps record their binlog coordinates, later runs apply the
+# remote binlog's row events from the checkpoint (needs pymysqlreplication). The server id
+# must be unique among the source's replicas; local commits/checkpoints every N rows
+DB_BINLOG = os.getenv('DB_BINLOG', 'false').lower() == 'true'
+DB_BINLOG_SERVER_ID = int(os.getenv('DB_BINLOG_SERVER_ID', '4701'))
+DB_BINLOG_BATCH_ROWS = int(os.getenv('DB_BINLOG_BATCH_ROWS', '5000'))
+DB_BINLOG_CHECKPOINT_PATH = os.path.join(SYNC_STATE_DIR, 'db_binlog.json')
+
+# Database copy mode: stream mysqldump straight into the local mysql client
+# (no intermediate .sql file; dump and restore run concurrently)
+DB_STREAM_RESTORE = os.getenv('DB_STREAM_RESTORE', 'false').lower() == 'true'
+DB_STREAM_CHUNK_SIZE = int(os.getenv('DB_STREAM_CHUNK_KB', '1024')) * 1024
+DB_STREAM_BUFFER_CHUNKS = int(os.getenv('DB_STREAM_BUFFER_CHUNKS', '64'))  # bounded buffer (chunks in flight)
+# Deprecated: used to tee each streamed dump into a gzip file here; now turns on DB_ARCHIVE
+# with this directory as DB_ARCHIVE_DIR unless those are set
+DB_STREAM_ARCHIVE_DIR = os.getenv('DB_STREAM_ARCHIVE_DIR', '')
+
+# Bulk-load restore (mysqldump -> mysql): session without FK/unique checks, local binlog or
+# autocommit; secondary indexes and foreign keys added after the data (built by N workers);
+# optionally load into a shadow database swapped in with one RENAME TABLE
+DB_BULK_LOAD = os.getenv('DB_BULK_LOAD', 'false').lower() == 'true'
+DB_BULK_LOAD_DEFER_INDEXES = os.getenv('DB_BULK_LOAD_DEFER_INDEXES', 'true').lower() == 'true'
+DB_BULK_LOAD_INDEX_WORKERS = int(os.getenv('DB_BULK_LOAD_INDEX_WORKERS', '2'))
+DB_BULK_LOAD_SHADOW = os.getenv('DB_BULK_LOAD_SHADOW', 'false').lower() == 'true'
+
+# Dump archive: keep every mysqldump (file or streamed) as a compressed, deduplicated snapshot
+# (see dump_archive.py). Compression: auto (zstd when the zstandard package is installed,
+# else gzip), zstd or gzip; level 0 = codec default
+DB_ARCHIVE = os.getenv('DB_ARCHIVE', 'true' if DB_STREAM_ARCHIVE_DIR else 'false').lower() == 'true'
+DB_ARCHIVE_DIR = os.getenv('DB_ARCHIVE_DIR') or DB_STREAM_ARCHIVE_DIR or os.path.join(SYNC_STATE_DIR, 'db_archive')
+DB_ARCHIVE_COMPRESSION = os.getenv('DB_ARCHIVE_COMPRESSION', 'auto').lower()
+DB_ARCHIVE_LEVEL = int(os.getenv('DB_ARCHIVE_LEVEL', '0'))
+DB_ARCHIVE_KEEP_DAILY = int(os.getenv('DB_ARCHIVE_KEEP_DAILY', '7'))
+DB_ARCHIVE_KEEP_WEEKLY = int(os.getenv('DB_ARCHIVE_KEEP_WEEKLY', '4'))
+
 # File sync paths
 REMOTE_FILES_PATH = os.getenv('REMOTE_FILES_PATH', '/')
 LOCAL_FILES_PATH = os.getenv('LOCAL_FILES_PATH', './synced_files')
@@ -53,6 +102,7 @@ LOCAL_FILES_PATH = os.getenv('LOCAL_FILES_PATH', './synced_files')
 # FTP server credentials
 REMOTE_FTP = {
     'host': os.getenv('REMOTE_FTP_HOST'),
+    'port': int(os.getenv('REMOTE_FTP_PORT', '21')),
     'user': os.getenv('REMOTE_FTP_USER'),
     'password': os.getenv('REMOTE_FTP_PASSWORD'),
     'passive': os.getenv('REMOTE_FTP_PASSIVE', 'true').lower() == 'true'
@@ -64,14 +114,85 @@ FILTER_EXTENSIONS = [ext.strip() for ext in os.getenv('FILTER_EXTENSIONS', '').s
 # Recursive FTP sync toggle
 RECURSIVE_FTP = os.getenv('FTP_RECURSIVE', 'false').lower() == 'true'
 
+# Concurrent listing: connections crawling the tree and maximum depth below REMOTE_FILES_PATH (0 = unlimited)
+FTP_LIST_WORKERS = int(os.getenv('FTP_LIST_WORKERS', '4'))
+FTP_MAX_DEPTH = int(os.getenv('FTP_MAX_DEPTH', '0'))
+
 # Recent file filtering
 RECENT_ONLY = os.getenv('FTP_RECENT_ONLY', 'false').lower() == 'true'
 RECENT_WINDOW_HOURS = int(os.getenv('FTP_RECENT_WINDOW_HOURS', '24'))
 
 # Performance tuning
 FTP_MAX_WORKERS = int(os.getenv('FTP_MAX_WORKERS', '4'))
+# Download concurrency may grow up to this limit while throughput keeps improving
+# (and shrinks on 421, or 530 "too many connections", replies)
+FTP_MAX_WORKERS_LIMIT = max(FTP_MAX_WORKERS, int(os.getenv('FTP_MAX_WORKERS_LIMIT', str(FTP_MAX_WORKERS))))
+FTP_BANDWIDTH_LIMIT = int(os.getenv('FTP_BANDWIDTH_LIMIT_KBPS', '0')) * 1024  # bytes/s across all downloads, 0 = unlimited
 FTP_TIMEOUT = int(os.getenv('FTP_TIMEOUT', '60'))  # seconds
 FTP_USE_MLSD = os.getenv('FTP_USE_MLSD', 'true').lower() == 'true'
 FTP_SKIP_UNCHANGED = os.getenv('FTP_SKIP_UNCHANGED', 'true').lower() == 'true'
+# Integrity: hash downloads as they stream (checked against HASH/XMD5/XCRC when the server
+# offers one) and store the digest in the manifest; `python main.py --verify` re-hashes the
+# local tree with FTP_VERIFY_WORKERS processes
+FTP_VERIFY = os.getenv('FTP_VERIFY', 'false').lower() == 'true'
+FTP_HASH_ALGO = os.getenv('FTP_HASH_ALGO', 'sha256').lower()
+FTP_VERIFY_WORKERS = int(os.getenv('FTP_VERIFY_WORKERS', str(os.cpu_count() or 2)))
+# Mirror mode: delete local files removed on the server and turn remote renames into local
+# renames; deletions are skipped when they exceed this share of the local files
+FTP_MIRROR = os.getenv('FTP_MIRROR', 'false').lower() == 'true'
+FTP_MIRROR_DRY_RUN = os.getenv('FTP_MIRROR_DRY_RUN', 'false').lower() == 'true'
+FTP_MIRROR_MAX_DELETE_PERCENT = float(os.getenv('FTP_MIRROR_MAX_DELETE_PERCENT', '10'))
+# Persistent sync manifest: skip unchanged files without stat'ing LOCAL_FILES_PATH
+FTP_MANIFEST = os.getenv('FTP_MANIFEST', 'true').lower() == 'true'
+FTP_MANIFEST_PATH = os.getenv('FTP_MANIFEST_PATH') or os.path.join(SYNC_STATE_DIR, 'ftp_manifest.sqlite')
+# Listing cache: reuse a directory's stored listing while its MLSD modify fact is unchanged
+# (needs MLST; entries older than MAX_AGE seconds are listed again, 0 = no limit)
+FTP_LISTING_CACHE = os.getenv('FTP_LISTING_CACHE', 'false').lower() == 'true'
+FTP_LISTING_CACHE_PATH = os.getenv('FTP_LISTING_CACHE_PATH') or os.path.join(SYNC_STATE_DIR, 'ftp_listing.sqlite')
+FTP_LISTING_CACHE_MAX_AGE = int(os.getenv('FTP_LISTING_CACHE_MAX_AGE', '0'))
+# Probe commands (MLST, MDTM, SIZE, CWD) sent back to back before reading the replies (1 = off)
+FTP_PIPELINE_DEPTH = int(os.getenv('FTP_PIPELINE_DEPTH', '32'))
+# Large files: resume interrupted downloads from their .part file (REST), transfer block size,
+# and optional parallel byte-range download for files of at least FTP_SEGMENTED_MIN_MB (0 = off)
+FTP_RESUME = os.getenv('FTP_RESUME', 'true').lower() == 'true'
+FTP_BLOCK_SIZE = int(os.getenv('FTP_BLOCK_KB', '64')) * 1024
+FTP_SEGMENTED_MIN_SIZE = int(os.getenv('FTP_SEGMENTED_MIN_MB', '0')) * 1024 * 1024
+FTP_SEGMENTS = int(os.getenv('FTP_SEGMENTS', '4'))
+# Buffer size of the local file each download is written to (fewer, larger writes)
+FTP_WRITE_BUFFER = int(os.getenv('FTP_WRITE_BUFFER_KB', '1024')) * 1024
+# Aggregate download progress: 'auto' (a status line only when stdout is a terminal),
+# 'log' (a log line per interval, also under cron) or 'off'; seconds between updates
+# (0 = 1 on a terminal, 30 as log lines)
+FTP_PROGRESS = os.getenv('FTP_PROGRESS', 'auto').lower()
+FTP_PROGRESS_INTERVAL = float(os.getenv('FTP_PROGRESS_INTERVAL', '0'))
+# Logged-in control connections reused across downloads (defaults to FTP_MAX_WORKERS_LIMIT)
+FTP_POOL_SIZE = int(os.getenv('FTP_POOL_SIZE', str(max(1, FTP_MAX_WORKERS_LIMIT))))
+FTP_POOL_NOOP_AFTER = int(os.getenv('FTP_POOL_NOOP_AFTER', '15'))  # idle seconds before a NOOP health check
+# Transfer engine: 'threads' (ftplib pool + scheduler) or 'asyncio' (one event loop driving
+# FTP_ASYNC_CONNECTIONS connections; disk writes go through FTP_ASYNC_DISK_WORKERS threads)
+FTP_ENGINE = os.getenv('FTP_ENGINE', 'threads').lower()
+FTP_ASYNC_CONNECTIONS = int(os.getenv('FTP_ASYNC_CONNECTIONS', '16'))
+FTP_ASYNC_DISK_WORKERS = int(os.getenv('FTP_ASYNC_DISK_WORKERS', '4'))
+
+# Run orchestration: run the database copy and the file sync at the same time,
+# each with its own timeout in seconds (0 = no timeout)
+SYNC_CONCURRENT = os.getenv('SYNC_CONCURRENT', 'false').lower() == 'true'
+DB_PHASE_TIMEOUT = int(os.getenv('DB_PHASE_TIMEOUT', '0'))
+FTP_PHASE_TIMEOUT = int(os.getenv('FTP_PHASE_TIMEOUT', '0'))
+
+# Watch mode (python main.py --watch): seconds between change probes, seconds between full
+# resyncs (0 = only at start) and the database change signal: 'auto' (binlog position with
+# DB_INCREMENTAL/DB_BINLOG, else information_schema UPDATE_TIME), 'binlog', 'tables' or 'off'
+# (copy on full resyncs only)
+SYNC_WATCH_INTERVAL = int(os.getenv('SYNC_WATCH_INTERVAL', '60'))
+SYNC_WATCH_FULL_EVERY = int(os.getenv('SYNC_WATCH_FULL_EVERY', '86400'))
+SYNC_WATCH_DB_PROBE = os.getenv('SYNC_WATCH_DB_PROBE', 'auto').lower()
+
+# Run reports: JSON report per run in this directory (blank disables), how many of them to
+# keep (0 = all) and an optional Prometheus node-exporter textfile
+# (e.g. /var/lib/node_exporter/textfile_collector/lotus_sync.prom)
+SYNC_REPORT_DIR = os.getenv('SYNC_REPORT_DIR', os.path.join(SYNC_STATE_DIR, 'reports'))
+SYNC_REPORT_KEEP = int(os.getenv('SYNC_REPORT_KEEP', '200'))
+SYNC_PROMETHEUS_TEXTFILE = os.getenv('SYNC_PROMETHEUS_TEXTFILE', '')
 
 # Add any other configuration as needed
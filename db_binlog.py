@@ -0,0 +1,331 @@
+"""Binlog replication of REMOTE_DB into LOCAL_DB (DB_BINLOG=true).
+
+A full copy is a mysqldump taken with ``--source-data=2`` (``--master-data=2``
+on older clients), which writes the binary log coordinates of the
+``--single-transaction`` snapshot into the dump header. Once that dump is
+restored, the coordinates are saved as a checkpoint in SYNC_STATE_DIR. Later
+runs read the remote binary log from the checkpoint with the optional
+``pymysqlreplication`` package (pip install mysql-replication), apply the row
+events of REMOTE_DB to LOCAL_DB and move the checkpoint forward. The source
+then only serves a sequential binlog read instead of whole tables.
+
+Row events are applied idempotently (REPLACE / UPDATE by primary key / DELETE
+by primary key), so events replayed after a crash between a local commit and
+the checkpoint write are harmless. That needs a primary key on every table:
+check_source() refuses DB_BINLOG when a table of REMOTE_DB has none. A full
+copy is needed again (BinlogResyncNeeded) when there is no usable checkpoint,
+the checkpointed binlog file has been purged, or a DDL statement touches
+REMOTE_DB. The source needs ``binlog_format=ROW``,
+``binlog_row_image=FULL`` and, on MySQL 8, ``binlog_row_metadata=FULL`` (for
+column names); the user needs REPLICATION SLAVE/CLIENT (and RELOAD for the dump).
+"""
+import json
+import logging
+import os
+import re
+import subprocess
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    REMOTE_DB,
+    LOCAL_DB,
+    DB_BINLOG_CHECKPOINT_PATH,
+    DB_BINLOG_SERVER_ID,
+    DB_BINLOG_BATCH_ROWS,
+)
+from db_common import connect_mysql, quote_ident, run_command
+from metrics import METRICS
+
+# Dump header written by --source-data=2 / --master-data=2, e.g.
+# -- CHANGE REPLICATION SOURCE TO SOURCE_LOG_FILE='binlog.000012', SOURCE_LOG_POS=157;
+_COORDS_RE = re.compile(
+    rb"CHANGE (?:MASTER|REPLICATION SOURCE) TO (?:MASTER|SOURCE)_LOG_FILE='([^']+)', (?:MASTER|SOURCE)_LOG_POS=(\d+);")
+# The header comes before any table data
+_HEAD_BYTES = 1024 * 1024
+# Statements in a row-based binlog that are not DDL
+_TX_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'XA ', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+_IDENT = r'(?:`((?:[^`]|``)+)`|([A-Za-z0-9_$]+))'
+# The schema of a qualified name (`db`.`tbl`, db.tbl) ...
+_QUALIFIED_RE = re.compile(_IDENT + r'\s*\.\s*(?:`|[A-Za-z_$])')
+# ... and of CREATE/ALTER/DROP DATABASE|SCHEMA [IF [NOT] EXISTS] name
+_DATABASE_DDL_RE = re.compile(r'^\s*(?:CREATE|ALTER|DROP)\s+(?:DATABASE|SCHEMA)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?' + _IDENT,
+                              re.IGNORECASE)
+
+Position = Tuple[str, int]
+
+
+class BinlogResyncNeeded(Exception):
+    """The local copy cannot be brought up to date from the binlog; take a full dump."""
+
+
+_source_data_flag: Optional[str] = None
+
+
+def source_data_flag() -> str:
+    """mysqldump option that records the snapshot's binlog coordinates as a comment."""
+    global _source_data_flag
+    if _source_data_flag is None:
+        try:
+            help_text = run_command(['mysqldump', '--help'], stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL).stdout or b''
+        except OSError:
+            help_text = b''
+        # --master-data was renamed in MySQL 8.0.26
+        _source_data_flag = '--source-data=2' if b'--source-data' in help_text else '--master-data=2'
+    return _source_data_flag
+
+
+class DumpCoordinates:
+    """Picks the binlog coordinates out of the head of a dump as it streams past."""
+
+    def __init__(self):
+        self.position: Optional[Position] = None
+        self._head = b''
+
+    def feed(self, chunk: bytes):
+        if self.position is not None or len(self._head) >= _HEAD_BYTES:
+            return
+        self._head += chunk[:_HEAD_BYTES - len(self._head)]
+        m = _COORDS_RE.search(self._head)
+        if m:
+            self.position = (m.group(1).decode(), int(m.group(2)))
+            self._head = b''
+
+    def feed_file(self, path: str):
+        with open(path, 'rb') as f:
+            self.feed(f.read(_HEAD_BYTES))
+
+
+def _target() -> Dict[str, str]:
+    return {
+        'source': f"{REMOTE_DB['host']}:{REMOTE_DB['port']}/{REMOTE_DB['database']}",
+        'target': f"{LOCAL_DB['host']}:{LOCAL_DB['port']}/{LOCAL_DB['database']}",
+    }
+
+
+def load_checkpoint(path: str = DB_BINLOG_CHECKPOINT_PATH) -> Optional[Position]:
+    """The last applied position, or None when there is none for this source/target."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as fh:
+            data = json.load(fh)
+    except Exception as e:
+        logging.warning('Ignoring unreadable binlog checkpoint %s: %s', path, e)
+        return None
+    if any(data.get(k) != v for k, v in _target().items()):
+        logging.info('Binlog checkpoint is for another source or target; ignoring it')
+        return None
+    return data['log_file'], int(data['log_pos'])
+
+
+def save_checkpoint(position: Position, path: str = DB_BINLOG_CHECKPOINT_PATH):
+    """Write the checkpoint atomically (temp file + rename)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump({
+            **_target(),
+            'log_file': position[0],
+            'log_pos': position[1],
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+        }, fh, indent=1)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def check_source():
+    """Raise RuntimeError when the remote server's binlog cannot be replicated row by row."""
+    try:
+        import pymysqlreplication  # noqa: F401
+    except ImportError as e:
+        raise RuntimeError('DB_BINLOG needs pymysqlreplication. Install with: pip install mysql-replication') from e
+    conn = connect_mysql(REMOTE_DB, 'REMOTE_DB')
+    try:
+        cur = conn.cursor()
+        cur.execute("SHOW GLOBAL VARIABLES WHERE Variable_name IN ('log_bin', 'binlog_format', 'binlog_row_image')")
+        settings = {name.lower(): str(value).upper() for name, value in cur.fetchall()}
+        cur.execute(
+            "SELECT t.TABLE_NAME FROM information_schema.TABLES t "
+            "LEFT JOIN information_schema.TABLE_CONSTRAINTS c ON c.TABLE_SCHEMA = t.TABLE_SCHEMA "
+            "AND c.TABLE_NAME = t.TABLE_NAME AND c.CONSTRAINT_TYPE = 'PRIMARY KEY' "
+            "WHERE t.TABLE_SCHEMA = %s AND t.TABLE_TYPE = 'BASE TABLE' AND c.CONSTRAINT_NAME IS NULL",
+            (REMOTE_DB['database'],))
+        keyless = [_decode(name) for (name,) in cur.fetchall()]
+        cur.close()
+    finally:
+        conn.close()
+    if settings.get('log_bin') not in ('ON', '1'):
+        raise RuntimeError('binary logging is off on the remote server')
+    if settings.get('binlog_format') != 'ROW':
+        raise RuntimeError(f"remote binlog_format is {settings.get('binlog_format')}, DB_BINLOG needs ROW")
+    if settings.get('binlog_row_image', 'FULL') != 'FULL':
+        raise RuntimeError(f"remote binlog_row_image is {settings['binlog_row_image']}, DB_BINLOG needs FULL")
+    if keyless:
+        # Without a key, a replayed insert or update would duplicate the row
+        raise RuntimeError(f"DB_BINLOG needs a primary key on every table; none on: {', '.join(sorted(keyless))}")
+
+
+def _binlog_files() -> List[str]:
+    conn = connect_mysql(REMOTE_DB, 'REMOTE_DB')
+    try:
+        cur = conn.cursor()
+        cur.execute('SHOW BINARY LOGS')
+        names = [row[0] for row in cur.fetchall()]
+        cur.close()
+        return names
+    finally:
+        conn.close()
+
+
+def _is_ddl(query: str) -> bool:
+    q = query.lstrip().upper()
+    return not q.startswith(_TX_STATEMENTS)
+
+
+def _touches(query: str, schema: Optional[str], database: str) -> bool:
+    """Whether a statement run with default schema ``schema`` may change ``database``."""
+    if schema == database:
+        return True
+    m = _DATABASE_DDL_RE.match(query)
+    names = [m] if m else []
+    names += _QUALIFIED_RE.finditer(query)
+    return any((n.group(1).replace('``', '`') if n.group(1) is not None else n.group(2)) == database
+               for n in names)
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class RowApplier:
+    """Applies row events to LOCAL_DB in batches of source transactions."""
+
+    def __init__(self):
+        self.conn = connect_mysql(LOCAL_DB, 'LOCAL_DB', autocommit=False)
+        self.cur = self.conn.cursor()
+        # Like a replica: rows arrive in source commit order, constraints were checked there
+        self.cur.execute('SET SESSION foreign_key_checks = 0')
+        self.rows = 0
+
+    def _check(self, values: Dict):
+        if any(str(k).startswith('UNKNOWN_COL') for k in values):
+            raise BinlogResyncNeeded('row events carry no column names; set binlog_row_metadata=FULL on the source')
+
+    @staticmethod
+    def _key(event, values: Dict) -> Dict:
+        pk = event.primary_key
+        if not pk:
+            # check_source() refuses these; a table may have lost its key since
+            raise BinlogResyncNeeded(f'table {event.table} has no primary key')
+        cols = [pk] if isinstance(pk, str) else list(pk)
+        return {c: values[c] for c in cols}
+
+    @staticmethod
+    def _where(key: Dict) -> Tuple[str, list]:
+        return ' AND '.join(f'{quote_ident(c)} <=> %s' for c in key), list(key.values())
+
+    def _replace(self, table: str, values: Dict):
+        cols = ', '.join(quote_ident(c) for c in values)
+        marks = ', '.join(['%s'] * len(values))
+        self.cur.execute(f'REPLACE INTO {table} ({cols}) VALUES ({marks})', list(values.values()))
+
+    def apply(self, event) -> int:
+        from pymysqlreplication.row_event import DeleteRowsEvent, UpdateRowsEvent, WriteRowsEvent
+        table = quote_ident(event.table)
+        for row in event.rows:
+            if isinstance(event, WriteRowsEvent):
+                self._check(row['values'])
+                self._replace(table, row['values'])
+            elif isinstance(event, UpdateRowsEvent):
+                before, after = row['before_values'], row['after_values']
+                self._check(after)
+                where, args = self._where(self._key(event, before))
+                sets = ', '.join(f'{quote_ident(c)} = %s' for c in after)
+                self.cur.execute(f'UPDATE {table} SET {sets} WHERE {where} LIMIT 1', list(after.values()) + args)
+                if self.cur.rowcount == 0:
+                    # Missing locally (or already up to date): write the new image
+                    self._replace(table, after)
+            elif isinstance(event, DeleteRowsEvent):
+                self._check(row['values'])
+                where, args = self._where(self._key(event, row['values']))
+                self.cur.execute(f'DELETE FROM {table} WHERE {where} LIMIT 1', args)
+        self.rows += len(event.rows)
+        return len(event.rows)
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        try:
+            self.conn.rollback()
+            self.conn.close()
+        except Exception:
+            pass
+
+
+def catch_up(position: Position) -> Position:
+    """Apply REMOTE_DB row events from ``position`` to the current end of the
+    remote binlog. Returns the new position; commits and checkpoints every
+    DB_BINLOG_BATCH_ROWS rows (at transaction boundaries) and at the end.
+    """
+    from pymysqlreplication import BinLogStreamReader
+    from pymysqlreplication.event import QueryEvent, RotateEvent, XidEvent
+    from pymysqlreplication.row_event import DeleteRowsEvent, UpdateRowsEvent, WriteRowsEvent
+
+    if position[0] not in _binlog_files():
+        raise BinlogResyncNeeded(f'binlog file {position[0]} is no longer on the server')
+    database = REMOTE_DB['database']
+    stream = BinLogStreamReader(
+        connection_settings={
+            'host': REMOTE_DB['host'],
+            'port': REMOTE_DB['port'],
+            'user': REMOTE_DB['user'],
+            'passwd': REMOTE_DB['password'],
+        },
+        server_id=DB_BINLOG_SERVER_ID,
+        log_file=position[0],
+        log_pos=position[1],
+        resume_stream=True,
+        blocking=False,
+        # No only_schemas: it would also drop DDL run from another default schema
+        # that names REMOTE_DB; row events are filtered by schema below
+        only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, QueryEvent, XidEvent, RotateEvent],
+    )
+    applier = RowApplier()
+    committed = position
+    pending = 0
+    transactions = 0
+    started = time.monotonic()
+    try:
+        for event in stream:
+            if isinstance(event, (WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent)):
+                if _decode(event.schema) == database:
+                    pending += applier.apply(event)
+            elif isinstance(event, QueryEvent):
+                query = _decode(event.query)
+                if _is_ddl(query) and _touches(query, _decode(event.schema), database):
+                    raise BinlogResyncNeeded(f'DDL on {database}: {query[:200]}')
+            elif isinstance(event, XidEvent):
+                transactions += 1
+                if pending >= DB_BINLOG_BATCH_ROWS:
+                    applier.commit()
+                    committed = (stream.log_file, stream.log_pos)
+                    save_checkpoint(committed)
+                    pending = 0
+        # The stream stops at the end of the binlog, which is a transaction boundary
+        applier.commit()
+        committed = (stream.log_file, stream.log_pos)
+        save_checkpoint(committed)
+    finally:
+        applier.close()
+        stream.close()
+    METRICS.incr('db_binlog_rows', applier.rows)
+    METRICS.incr('db_binlog_transactions', transactions)
+    METRICS.observe('db_binlog_apply', time.monotonic() - started)
+    logging.info('Binlog: applied %d rows in %d transactions; now at %s:%d',
+                 applier.rows, transactions, committed[0], committed[1])
+    return committed
@@ -0,0 +1,376 @@
+"""Bulk-load restore of a mysqldump stream into LOCAL_DB (DB_BULK_LOAD=true).
+
+The dump is piped into the mysql client behind a session preamble that turns
+off foreign key and unique checks, keeps the load out of the local binary log
+(``sql_log_bin=0``, when the user may set it) and disables autocommit, so each
+table's rows are committed once instead of per INSERT statement (the dump's
+LOCK/UNLOCK TABLES and DDL commit between tables).
+
+With DB_BULK_LOAD_DEFER_INDEXES the CREATE TABLE statements in the stream are
+rewritten without their secondary indexes and foreign keys; once the data is
+in they are added back with one ALTER TABLE per table, which sorts each index
+once instead of maintaining it row by row. Keys that lead with an
+AUTO_INCREMENT column stay in place (the column needs one).
+
+With DB_BULK_LOAD_SHADOW the dump goes into a shadow database
+(``<LOCAL_DB_NAME>__shadow``). After the indexes are built, one RENAME TABLE
+statement moves the live tables out and the shadow tables in, so readers see
+either the old or the new data, never a half-restored schema. The dump also
+creates its triggers, views, routines and events in the shadow database; their
+definitions are read back from there and recreated in the live database on
+the swap connection right after the RENAME (RENAME TABLE cannot move a table
+with triggers to another database). A failed load leaves the live database
+untouched.
+"""
+import logging
+import queue
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    LOCAL_DB,
+    DB_BULK_LOAD_DEFER_INDEXES,
+    DB_BULK_LOAD_SHADOW,
+    DB_BULK_LOAD_INDEX_WORKERS,
+)
+from db_common import connect_mysql, quote_ident
+from metrics import METRICS
+
+# mysqldump starts every table definition on a line of its own
+_CREATE_START = b'\nCREATE TABLE '
+_TABLE_RE = re.compile(r'CREATE TABLE (`(?:[^`]|``)+`) \(')
+_INDEX_RE = re.compile(r'(?:(UNIQUE|FULLTEXT|SPATIAL) )?KEY `(?:[^`]|``)+` \(`((?:[^`]|``)+)`')
+_FK_RE = re.compile(r'CONSTRAINT `(?:[^`]|``)+` FOREIGN KEY ')
+_COLUMN_RE = re.compile(r'`((?:[^`]|``)+)` ')
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+class IndexDeferrer:
+    """Strips secondary indexes and foreign keys from CREATE TABLE statements as
+    a dump streams past and remembers them as ALTER TABLE clauses.
+
+    ``feed(chunk)`` returns the bytes to pass on (held back while a CREATE
+    TABLE statement is incomplete); ``flush()`` returns what is left at the end.
+    """
+
+    def __init__(self):
+        self.indexes: Dict[str, List[str]] = {}  # quoted table -> ['ADD KEY ...', ...]
+        self.foreign_keys: Dict[str, List[str]] = {}
+        self._buf = b''
+        self._in_create = False
+
+    @property
+    def deferred(self) -> int:
+        return sum(len(v) for v in self.indexes.values()) + sum(len(v) for v in self.foreign_keys.values())
+
+    def feed(self, chunk: bytes) -> bytes:
+        self._buf += chunk
+        out: List[bytes] = []
+        while True:
+            if not self._in_create:
+                i = self._buf.find(_CREATE_START)
+                if i < 0:
+                    # Keep a tail that may hold the start of a split marker
+                    keep = len(_CREATE_START) - 1
+                    if len(self._buf) > keep:
+                        out.append(self._buf[:-keep])
+                        self._buf = self._buf[-keep:]
+                    break
+                out.append(self._buf[:i + 1])
+                self._buf = self._buf[i + 1:]
+                self._in_create = True
+            close = self._buf.find(b'\n)')
+            end = self._buf.find(b';\n', close) if close >= 0 else -1
+            if end < 0:
+                break
+            end += 2
+            out.append(self._rewrite(self._buf[:end]))
+            self._buf = self._buf[end:]
+            self._in_create = False
+        return b''.join(out)
+
+    def flush(self) -> bytes:
+        rest, self._buf = self._buf, b''
+        return rest
+
+    def _rewrite(self, stmt: bytes) -> bytes:
+        lines = stmt.decode('utf-8', 'surrogateescape').split('\n')
+        m = _TABLE_RE.match(lines[0])
+        close = next((i for i, line in enumerate(lines) if line.startswith(')')), None)
+        if m is None or close is None:
+            return stmt
+        table = m.group(1)
+        body = [line[:-1] if line.endswith(',') else line for line in lines[1:close]]
+        auto = {c.group(1) for line in body if ' AUTO_INCREMENT' in line
+                for c in [_COLUMN_RE.match(line.strip())] if c}
+        kept: List[str] = []
+        indexes: List[str] = []
+        fks: List[str] = []
+        for line in body:
+            item = line.strip()
+            idx = _INDEX_RE.match(item)
+            if idx and idx.group(2) not in auto:
+                indexes.append('ADD ' + item)
+            elif _FK_RE.match(item):
+                fks.append('ADD ' + item)
+            else:
+                kept.append(line)
+        if not indexes and not fks:
+            return stmt
+        if indexes:
+            self.indexes[table] = indexes
+        if fks:
+            self.foreign_keys[table] = fks
+        return '\n'.join([lines[0], ',\n'.join(kept)] + lines[close:]).encode('utf-8', 'surrogateescape')
+
+
+def alter_statements(table: str, clauses: List[str]) -> List[str]:
+    """ALTER TABLE statements adding ``clauses``: all in one, except FULLTEXT
+    indexes, which InnoDB only builds one per statement.
+    """
+    fulltext = [c for c in clauses if c.startswith('ADD FULLTEXT ')]
+    others = [c for c in clauses if not c.startswith('ADD FULLTEXT ')]
+    stmts = [f"ALTER TABLE {table} {', '.join(others)}"] if others else []
+    return stmts + [f'ALTER TABLE {table} {c}' for c in fulltext]
+
+
+class BulkLoad:
+    """One bulk-load restore: ``prepare()``, pipe ``preamble()``, ``filter(chunk)``
+    for every dump chunk and ``epilogue()`` into ``mysql_command(self.database)``,
+    then ``finish()`` on success or ``abort()`` on failure.
+    """
+
+    def __init__(self):
+        self.live = LOCAL_DB['database']
+        self.database = f'{self.live}__shadow' if DB_BULK_LOAD_SHADOW else self.live
+        self.deferrer = IndexDeferrer() if DB_BULK_LOAD_DEFER_INDEXES else None
+        self.skip_binlog = False
+
+    def _connect(self, database: Optional[str] = None):
+        conn = connect_mysql(LOCAL_DB, 'LOCAL_DB', database=database or self.live)
+        cur = conn.cursor()
+        cur.execute('SET SESSION foreign_key_checks = 0')
+        if self.skip_binlog:
+            cur.execute('SET SESSION sql_log_bin = 0')
+        cur.close()
+        return conn
+
+    def prepare(self):
+        """Check whether the load may skip the local binlog and create the shadow database."""
+        conn = connect_mysql(LOCAL_DB, 'LOCAL_DB')
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT @@log_bin')
+            if int(cur.fetchone()[0] or 0):
+                try:
+                    cur.execute('SET SESSION sql_log_bin = 0')
+                    self.skip_binlog = True
+                except Exception as e:
+                    logging.warning('Bulk load: cannot set sql_log_bin=0 (%s); the restore will be binlogged', e)
+            if DB_BULK_LOAD_SHADOW:
+                cur.execute(
+                    'SELECT DEFAULT_CHARACTER_SET_NAME, DEFAULT_COLLATION_NAME FROM information_schema.SCHEMATA '
+                    'WHERE SCHEMA_NAME = %s', (self.live,))
+                row = cur.fetchone()
+                if row is None:
+                    # First restore: the swap needs a live database to rename into
+                    logging.info('Bulk load: creating database %s', self.live)
+                    cur.execute(f'CREATE DATABASE {quote_ident(self.live)}')
+                    options = ''
+                else:
+                    options = f' CHARACTER SET {row[0]} COLLATE {row[1]}'
+                cur.execute(f'DROP DATABASE IF EXISTS {quote_ident(self.database)}')
+                cur.execute(f'CREATE DATABASE {quote_ident(self.database)}{options}')
+                logging.info('Bulk load: restoring into shadow database %s', self.database)
+            cur.close()
+        finally:
+            _close(conn)
+        return self
+
+    def preamble(self) -> bytes:
+        stmts = ['SET SESSION foreign_key_checks = 0', 'SET SESSION unique_checks = 0']
+        if self.skip_binlog:
+            stmts.append('SET SESSION sql_log_bin = 0')
+        stmts.append('SET SESSION autocommit = 0')
+        return ''.join(s + ';\n' for s in stmts).encode()
+
+    def filter(self, chunk: bytes) -> bytes:
+        return self.deferrer.feed(chunk) if self.deferrer is not None else chunk
+
+    def epilogue(self) -> bytes:
+        rest = self.deferrer.flush() if self.deferrer is not None else b''
+        return rest + b'\nCOMMIT;\n'
+
+    def finish(self):
+        if self.deferrer is not None and self.deferrer.deferred:
+            self._build_indexes()
+        if DB_BULK_LOAD_SHADOW:
+            self._swap()
+
+    def abort(self):
+        if not DB_BULK_LOAD_SHADOW:
+            return
+        try:
+            conn = self._connect()
+            try:
+                cur = conn.cursor()
+                cur.execute(f'DROP DATABASE IF EXISTS {quote_ident(self.database)}')
+                cur.close()
+            finally:
+                _close(conn)
+        except Exception as e:
+            logging.warning('Bulk load: could not drop shadow database %s: %s', self.database, e)
+
+    def _build_indexes(self):
+        """Add the deferred indexes (several tables at a time), then the foreign keys."""
+        started = time.monotonic()
+        workers = max(1, min(DB_BULK_LOAD_INDEX_WORKERS, len(self.deferrer.indexes) or 1))
+        conns: 'queue.Queue' = queue.Queue()
+        opened = []
+        try:
+            for _ in range(workers):
+                conn = self._connect(self.database)
+                opened.append(conn)
+                conns.put(conn)
+
+            def build(table: str, clauses: List[str]):
+                conn = conns.get()
+                try:
+                    t0 = time.monotonic()
+                    cur = conn.cursor()
+                    for stmt in alter_statements(table, clauses):
+                        cur.execute(stmt)
+                    cur.close()
+                    logging.info('Built %d indexes on %s in %.2fs', len(clauses), table, time.monotonic() - t0)
+                finally:
+                    conns.put(conn)
+
+            failed = []
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                futures = {ex.submit(build, t, c): t for t, c in self.deferrer.indexes.items()}
+                for fut in as_completed(futures):
+                    try:
+                        fut.result()
+                    except Exception as e:
+                        failed.append(futures[fut])
+                        logging.error('Failed to build indexes on %s: %s', futures[fut], e)
+            if failed:
+                raise RuntimeError(f"building deferred indexes failed for tables: {', '.join(sorted(failed))}")
+            # Referenced keys exist now; foreign_key_checks=0 skips re-validating the rows
+            cur = opened[0].cursor()
+            for table, clauses in self.deferrer.foreign_keys.items():
+                cur.execute(f"ALTER TABLE {table} {', '.join(clauses)}")
+            cur.close()
+        finally:
+            for conn in opened:
+                _close(conn)
+        elapsed = time.monotonic() - started
+        METRICS.observe('db_index_build', elapsed)
+        METRICS.incr('db_indexes_deferred', self.deferrer.deferred)
+        logging.info('Bulk load: added %d deferred indexes and foreign keys in %.1fs', self.deferrer.deferred, elapsed)
+
+    def _objects(self, cur, schema: str) -> Dict[str, List[Tuple[str, str, str]]]:
+        """Triggers, views, routines and events of ``schema`` as {kind: [(name, sql_mode, CREATE statement)]}."""
+        db = quote_ident(schema)
+        queries = {
+            'TRIGGER': ('SELECT TRIGGER_NAME FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = %s', 1, 2),
+            'VIEW': ('SELECT TABLE_NAME FROM information_schema.VIEWS WHERE TABLE_SCHEMA = %s', None, 1),
+            'PROCEDURE': ("SELECT ROUTINE_NAME FROM information_schema.ROUTINES "
+                          "WHERE ROUTINE_SCHEMA = %s AND ROUTINE_TYPE = 'PROCEDURE'", 1, 2),
+            'FUNCTION': ("SELECT ROUTINE_NAME FROM information_schema.ROUTINES "
+                         "WHERE ROUTINE_SCHEMA = %s AND ROUTINE_TYPE = 'FUNCTION'", 1, 2),
+            'EVENT': ('SELECT EVENT_NAME FROM information_schema.EVENTS WHERE EVENT_SCHEMA = %s', 1, 3),
+        }
+        objects: Dict[str, List[Tuple[str, str, str]]] = {}
+        for kind, (query, mode_col, stmt_col) in queries.items():
+            cur.execute(query, (schema,))
+            objects[kind] = []
+            for (name,) in cur.fetchall():
+                cur.execute(f'SHOW CREATE {kind} {db}.{quote_ident(name)}')
+                row = cur.fetchone()
+                objects[kind].append((name, row[mode_col] if mode_col is not None else None, row[stmt_col]))
+        return objects
+
+    def _create(self, cur, kind: str, objects: List[Tuple[str, str, str]]):
+        """Create ``objects`` in the live database (views retried until their dependencies exist)."""
+        pending = list(objects)
+        while pending:
+            errors = []
+            for obj in pending:
+                name, sql_mode, stmt = obj
+                try:
+                    if sql_mode is not None:
+                        cur.execute('SET SESSION sql_mode = %s', (sql_mode,))
+                    cur.execute(stmt)
+                except Exception as e:
+                    errors.append((obj, e))
+            if len(errors) == len(pending):
+                for (name, _, _), e in errors:
+                    logging.error('Bulk load: failed to create %s %s: %s', kind.lower(), name, e)
+                raise RuntimeError(f'recreating {kind.lower()}s after the swap failed')
+            pending = [obj for obj, _ in errors]
+
+    def _swap(self):
+        """Swap the shadow tables in with one atomic RENAME TABLE, then move the
+        shadow's triggers, views, routines and events over on the same connection."""
+        started = time.monotonic()
+        old = f'{self.live}__old'
+        live, shadow = quote_ident(self.live), quote_ident(self.database)
+        conn = self._connect()
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT @@SESSION.sql_mode')
+            sql_mode = cur.fetchone()[0]
+            cur.execute(
+                "SELECT TABLE_SCHEMA, TABLE_NAME FROM information_schema.TABLES "
+                "WHERE TABLE_SCHEMA IN (%s, %s) AND TABLE_TYPE = 'BASE TABLE'", (self.live, self.database))
+            tables: Dict[str, List[str]] = {self.live: [], self.database: []}
+            for schema, name in cur.fetchall():
+                tables[schema].append(name)
+            new = self._objects(cur, self.database)
+            current = self._objects(cur, self.live)
+            # Views read back from the shadow name its tables by schema
+            prefix = shadow + '.'
+            new['VIEW'] = [(name, mode, stmt.replace(prefix, live + '.').replace('CREATE ', 'CREATE OR REPLACE ', 1))
+                           for name, mode, stmt in new['VIEW']]
+            cur.execute(f'DROP DATABASE IF EXISTS {quote_ident(old)}')
+            cur.execute(f'CREATE DATABASE {quote_ident(old)}')
+            renames = [f'{live}.{quote_ident(t)} TO {quote_ident(old)}.{quote_ident(t)}' for t in tables[self.live]]
+            renames += [f'{shadow}.{quote_ident(t)} TO {live}.{quote_ident(t)}' for t in tables[self.database]]
+            # RENAME TABLE cannot move a table with triggers to another database
+            for schema, triggers in ((self.database, new['TRIGGER']), (self.live, current['TRIGGER'])):
+                for name, _, _ in triggers:
+                    cur.execute(f'DROP TRIGGER {quote_ident(schema)}.{quote_ident(name)}')
+            try:
+                cur.execute('RENAME TABLE ' + ', '.join(renames))
+            except Exception:
+                # The live tables did not move: give them their triggers back
+                self._create(cur, 'TRIGGER', current['TRIGGER'])
+                raise
+            self._create(cur, 'TRIGGER', new['TRIGGER'])
+            self._create(cur, 'VIEW', new['VIEW'])
+            names = {name for name, _, _ in new['VIEW']}
+            for name, _, _ in current['VIEW']:
+                if name not in names:
+                    cur.execute(f'DROP VIEW IF EXISTS {live}.{quote_ident(name)}')
+            for kind in ('PROCEDURE', 'FUNCTION', 'EVENT'):
+                for name, _, _ in current[kind]:
+                    cur.execute(f'DROP {kind} IF EXISTS {live}.{quote_ident(name)}')
+                self._create(cur, kind, new[kind])
+            cur.execute('SET SESSION sql_mode = %s', (sql_mode,))
+            cur.execute(f'DROP DATABASE {quote_ident(old)}')
+            cur.execute(f'DROP DATABASE {shadow}')
+            cur.close()
+        finally:
+            _close(conn)
+        elapsed = time.monotonic() - started
+        METRICS.observe('db_shadow_swap', elapsed)
+        logging.info('Bulk load: swapped %d tables into %s in %.1fs', len(tables[self.database]), self.live, elapsed)
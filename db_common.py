@@ -0,0 +1,107 @@
+"""Shared helpers for talking to the remote and local MySQL servers."""
+import subprocess
+import threading
+import weakref
+from typing import Dict, List, Optional
+
+from config import REMOTE_DB, LOCAL_DB
+
+# Flags used for a full logical dump of REMOTE_DB
+# (--skip-dump-date keeps unchanged dumps byte-identical for the archive)
+DUMP_FLAGS = ['--single-transaction', '--quick', '--routines', '--events', '--skip-dump-date']
+
+
+def check_db_config(db: Dict, label: str):
+    required = ['host', 'user', 'password', 'database', 'port']
+    missing = [k for k in required if not db.get(k)]
+    if missing:
+        raise RuntimeError(f"Missing {label} config keys: {', '.join(missing)}. Check your .env and config.")
+
+
+def mysqldump_command(*flags: str) -> List[str]:
+    """mysqldump invocation against REMOTE_DB; ``flags`` go before the database name."""
+    check_db_config(REMOTE_DB, 'REMOTE_DB')
+    return [
+        'mysqldump',
+        f"-h{REMOTE_DB['host']}",
+        f"-P{REMOTE_DB['port']}",
+        f"-u{REMOTE_DB['user']}",
+        f"-p{REMOTE_DB['password']}",
+        *flags,
+        REMOTE_DB['database']
+    ]
+
+
+def mysql_command(database: Optional[str] = None) -> List[str]:
+    """mysql client invocation against LOCAL_DB (or another local ``database``)."""
+    check_db_config(LOCAL_DB, 'LOCAL_DB')
+    return [
+        'mysql',
+        f"-h{LOCAL_DB['host']}",
+        f"-P{LOCAL_DB['port']}",
+        f"-u{LOCAL_DB['user']}",
+        f"-p{LOCAL_DB['password']}",
+        database or LOCAL_DB['database']
+    ]
+
+
+_children: 'weakref.WeakSet[subprocess.Popen]' = weakref.WeakSet()
+_children_lock = threading.Lock()
+
+
+def spawn(cmd: List[str], **kwargs) -> subprocess.Popen:
+    """subprocess.Popen that registers the child so kill_children() can stop it."""
+    proc = subprocess.Popen(cmd, **kwargs)
+    with _children_lock:
+        _children.add(proc)
+    return proc
+
+
+def run_command(cmd: List[str], **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run() equivalent whose child is registered like spawn()."""
+    with spawn(cmd, **kwargs) as proc:
+        stdout, stderr = proc.communicate()
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def drain_stream(stream, sink: List[bytes]):
+    """Collect a child's stderr in the background so a full pipe never blocks it."""
+    try:
+        for line in iter(stream.readline, b''):
+            sink.append(line)
+    except Exception:
+        pass
+
+
+def kill_children():
+    """Kill every still-running mysqldump/mysql child (used when a phase times out)."""
+    with _children_lock:
+        procs = list(_children)
+    for proc in procs:
+        if proc.poll() is None:
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+
+def connect_mysql(db: Dict, label: str, **kwargs):
+    """Open a mysql-connector connection for REMOTE_DB / LOCAL_DB style config."""
+    check_db_config(db, label)
+    try:
+        import mysql.connector  # provided by mysql-connector-python
+    except ImportError as e:
+        raise RuntimeError('mysql-connector-python is required for this mode. Install with: pip install mysql-connector-python') from e
+    params = {
+        'host': db['host'],
+        'port': db['port'],
+        'user': db['user'],
+        'password': db['password'],
+        'database': db['database'],
+    }
+    params.update(kwargs)
+    return mysql.connector.connect(**params)
+
+
+def quote_ident(name: str) -> str:
+    return '`' + name.replace('`', '``') + '`'
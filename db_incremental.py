@@ -0,0 +1,177 @@
+"""Incremental copy of REMOTE_DB: reload only the tables whose fingerprint changed.
+
+A JSON manifest in SYNC_STATE_DIR records, per table, the fingerprint seen at
+the last successful copy. A fingerprint is either CHECKSUM TABLE (when
+DB_INCREMENTAL_CHECKSUM is on) or cheap metadata: information_schema
+UPDATE_TIME and AUTO_INCREMENT, plus COUNT(*) and MAX(<updated column>) for
+tables that have DB_INCREMENTAL_UPDATED_COLUMN. Tables whose fingerprint
+cannot be determined are always copied. Any change to the table set or to a
+table definition falls back to a full copy.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+from config import (
+    REMOTE_DB,
+    LOCAL_DB,
+    DB_MANIFEST_PATH,
+    DB_INCREMENTAL_CHECKSUM,
+    DB_INCREMENTAL_UPDATED_COLUMN,
+)
+from db_common import connect_mysql, quote_ident
+from metrics import METRICS
+from db_parallel import parallel_copy, copy_schema_objects
+
+_AUTO_INC_RE = re.compile(r' AUTO_INCREMENT=\d+')
+
+
+def load_manifest(path: str = DB_MANIFEST_PATH) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as fh:
+            return json.load(fh)
+    except Exception as e:
+        logging.warning('Ignoring unreadable DB manifest %s: %s', path, e)
+        return None
+
+
+def save_manifest(manifest: Dict, path: str = DB_MANIFEST_PATH):
+    """Write the manifest atomically (temp file + rename)."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def _target() -> str:
+    return f"{LOCAL_DB['host']}:{LOCAL_DB['port']}/{LOCAL_DB['database']}"
+
+
+def collect_fingerprints(conn) -> Tuple[Dict[str, Optional[Dict]], str, str]:
+    """Return ({table: fingerprint or None}, schema hash, schema-objects hash)."""
+    db = REMOTE_DB['database']
+    cur = conn.cursor()
+    try:
+        # MySQL 8 caches information_schema.TABLES statistics for a day by default
+        cur.execute('SET SESSION information_schema_stats_expiry = 0')
+    except Exception:
+        pass
+    cur.execute(
+        "SELECT TABLE_NAME, UPDATE_TIME, AUTO_INCREMENT FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE' ORDER BY TABLE_NAME",
+        (db,),
+    )
+    meta = {t: (upd, ai) for t, upd, ai in cur.fetchall()}
+
+    with_updated = set()
+    if DB_INCREMENTAL_UPDATED_COLUMN:
+        cur.execute(
+            "SELECT TABLE_NAME FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = %s AND COLUMN_NAME = %s",
+            (db, DB_INCREMENTAL_UPDATED_COLUMN),
+        )
+        with_updated = {r[0] for r in cur.fetchall()}
+
+    schema = hashlib.sha256()
+    fingerprints: Dict[str, Optional[Dict]] = {}
+    for t, (upd, ai) in meta.items():
+        cur.execute(f'SHOW CREATE TABLE {quote_ident(t)}')
+        schema.update(t.encode() + b'\0' + _AUTO_INC_RE.sub('', cur.fetchone()[1]).encode() + b'\0')
+        if DB_INCREMENTAL_CHECKSUM:
+            cur.execute(f'CHECKSUM TABLE {quote_ident(t)}')
+            checksum = cur.fetchone()[1]
+            fingerprints[t] = None if checksum is None else {'checksum': int(checksum)}
+            continue
+        fp = {'auto_increment': ai, 'update_time': upd.isoformat() if upd else None}
+        if t in with_updated:
+            col = quote_ident(DB_INCREMENTAL_UPDATED_COLUMN)
+            cur.execute(f'SELECT COUNT(*), MAX({col}) FROM {quote_ident(t)}')
+            count, latest = cur.fetchone()
+            fp['rows'] = count
+            fp['max_updated'] = str(latest) if latest is not None else None
+        elif upd is None:
+            # No reliable change signal for this table
+            fp = None
+        fingerprints[t] = fp
+
+    objects = hashlib.sha256()
+    for sql in (
+        "SELECT ROUTINE_TYPE, ROUTINE_NAME, LAST_ALTERED FROM information_schema.ROUTINES WHERE ROUTINE_SCHEMA = %s ORDER BY 1, 2",
+        "SELECT TABLE_NAME, VIEW_DEFINITION FROM information_schema.VIEWS WHERE TABLE_SCHEMA = %s ORDER BY 1",
+        "SELECT TRIGGER_NAME, ACTION_STATEMENT FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = %s ORDER BY 1",
+        "SELECT EVENT_NAME, LAST_ALTERED FROM information_schema.EVENTS WHERE EVENT_SCHEMA = %s ORDER BY 1",
+    ):
+        cur.execute(sql, (db,))
+        for row in cur.fetchall():
+            objects.update(repr(row).encode())
+    cur.close()
+    return fingerprints, schema.hexdigest(), objects.hexdigest()
+
+
+def _local_tables() -> set:
+    conn = connect_mysql(LOCAL_DB, 'LOCAL_DB')
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT TABLE_NAME FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE'",
+            (LOCAL_DB['database'],),
+        )
+        names = {r[0] for r in cur.fetchall()}
+        cur.close()
+        return names
+    finally:
+        conn.close()
+
+
+def incremental_copy():
+    """Copy only changed tables, falling back to a full parallel copy when needed."""
+    remote = connect_mysql(REMOTE_DB, 'REMOTE_DB')
+    try:
+        # Fingerprints are taken before the copy snapshot, so a concurrent write
+        # can only make the next run copy a table again, never miss it
+        with METRICS.timer('db_fingerprint'):
+            fingerprints, schema_hash, objects_hash = collect_fingerprints(remote)
+    finally:
+        remote.close()
+
+    manifest = load_manifest()
+    reason = None
+    if manifest is None:
+        reason = 'no manifest'
+    elif manifest.get('target') != _target():
+        reason = 'local target changed'
+    elif manifest.get('schema') != schema_hash:
+        reason = 'schema changed'
+
+    if reason:
+        logging.info('Incremental DB sync: full copy (%s)', reason)
+        parallel_copy()
+    else:
+        previous = manifest.get('tables', {})
+        missing = set(fingerprints) - _local_tables()
+        changed = sorted(
+            t for t, fp in fingerprints.items()
+            if fp is None or previous.get(t) != fp or t in missing
+        )
+        objects_changed = manifest.get('objects') != objects_hash
+        logging.info('Incremental DB sync: %d of %d tables changed', len(changed), len(fingerprints))
+        METRICS.incr('db_tables_unchanged', len(fingerprints) - len(changed))
+        if changed:
+            # Recreated tables lose their triggers, so schema objects are always re-applied
+            parallel_copy(changed, with_objects=True)
+        elif objects_changed:
+            copy_schema_objects()
+
+    save_manifest({
+        'target': _target(),
+        'schema': schema_hash,
+        'objects': objects_hash,
+        'tables': fingerprints,
+    })
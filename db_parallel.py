@@ -0,0 +1,271 @@
+"""Table-parallel copy of REMOTE_DB into LOCAL_DB.
+
+Every worker reads from the same consistent snapshot: a coordinator connection
+holds FLUSH TABLES WITH READ LOCK just long enough for each worker connection
+to START TRANSACTION WITH CONSISTENT SNAPSHOT, and the table definitions are
+captured under that same lock. Tables are then streamed row batch by row batch
+straight into the local server, several tables at a time, without an
+intermediate dump file. Views, triggers, routines and events are copied last.
+
+Both sides use the session settings mysqldump writes into a dump: time_zone
+'+00:00', so TIMESTAMP values do not shift between servers in different time
+zones, and sql_mode NO_AUTO_VALUE_ON_ZERO on the local side, so an explicit 0
+in an AUTO_INCREMENT column stays 0 and zero dates are accepted. Rows are read
+with a raw cursor and written back as the server sent them; a converting
+cursor would turn zero dates into None.
+"""
+import logging
+import queue
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from config import REMOTE_DB, LOCAL_DB, DB_PARALLEL_WORKERS, DB_PARALLEL_BATCH_ROWS
+from metrics import METRICS
+from db_common import connect_mysql, mysqldump_command, mysql_command, quote_ident, spawn, run_command
+
+
+# What mysqldump sets at the top of every dump
+_TIME_ZONE = "SET SESSION time_zone = '+00:00'"
+_LOCAL_SQL_MODE = "SET SESSION sql_mode = 'NO_AUTO_VALUE_ON_ZERO'"
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def open_snapshot(workers: int, tables: Optional[List[str]] = None) -> Tuple[List, Dict[str, str], Dict[str, List[str]]]:
+    """Open ``workers`` remote connections sharing one consistent snapshot.
+
+    Returns (connections, {table: CREATE TABLE}, {table: [copyable columns]}),
+    restricted to ``tables`` when given. Tables are ordered largest first so
+    the biggest ones start early and the pool drains evenly.
+    """
+    coord = connect_mysql(REMOTE_DB, 'REMOTE_DB')
+    conns = []
+    try:
+        cur = coord.cursor()
+        locked = False
+        try:
+            cur.execute('FLUSH TABLES WITH READ LOCK')
+            locked = True
+        except Exception as e:
+            logging.warning('FLUSH TABLES WITH READ LOCK failed (%s); worker snapshots may not be mutually consistent', e)
+        for _ in range(max(1, workers)):
+            c = connect_mysql(REMOTE_DB, 'REMOTE_DB')
+            conns.append(c)
+            wc = c.cursor()
+            wc.execute(_TIME_ZONE)
+            wc.execute('SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            wc.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+            wc.close()
+
+        cur.execute(
+            "SELECT TABLE_NAME FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = %s AND TABLE_TYPE = 'BASE TABLE' "
+            "ORDER BY DATA_LENGTH + INDEX_LENGTH DESC",
+            (REMOTE_DB['database'],),
+        )
+        names = [r[0] for r in cur.fetchall()]
+        if tables is not None:
+            wanted = set(tables)
+            names = [t for t in names if t in wanted]
+        ddl: Dict[str, str] = {}
+        for t in names:
+            cur.execute(f'SHOW CREATE TABLE {quote_ident(t)}')
+            ddl[t] = cur.fetchone()[1]
+        cur.execute(
+            "SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = %s AND EXTRA NOT LIKE '%%GENERATED%%' "
+            "ORDER BY TABLE_NAME, ORDINAL_POSITION",
+            (REMOTE_DB['database'],),
+        )
+        columns: Dict[str, List[str]] = {}
+        for t, col in cur.fetchall():
+            if t in ddl:
+                columns.setdefault(t, []).append(col)
+        if locked:
+            cur.execute('UNLOCK TABLES')
+        cur.close()
+    except Exception:
+        for c in conns:
+            _close(c)
+        raise
+    finally:
+        _close(coord)
+    return conns, ddl, columns
+
+
+def prepare_local_tables(ddl: Dict[str, str], database: Optional[str] = None):
+    """Drop and recreate the given tables in the local database."""
+    conn = connect_mysql(LOCAL_DB, 'LOCAL_DB', **({'database': database} if database else {}))
+    try:
+        cur = conn.cursor()
+        cur.execute('SET FOREIGN_KEY_CHECKS = 0')
+        # Column defaults such as '0000-00-00' need the dump's sql_mode
+        cur.execute(_LOCAL_SQL_MODE)
+        for t, stmt in ddl.items():
+            cur.execute(f'DROP VIEW IF EXISTS {quote_ident(t)}')
+            cur.execute(f'DROP TABLE IF EXISTS {quote_ident(t)}')
+            cur.execute(stmt)
+        conn.commit()
+        cur.close()
+    finally:
+        _close(conn)
+
+
+def copy_table(src, dst, table: str, columns: List[str]) -> int:
+    """Stream one table from the snapshot connection ``src`` into ``dst``."""
+    cols = ', '.join(quote_ident(c) for c in columns)
+    placeholders = ', '.join(['%s'] * len(columns))
+    insert = f'INSERT INTO {quote_ident(table)} ({cols}) VALUES ({placeholders})'
+    # Raw: values pass through as the server's text, so zero dates survive
+    rcur = src.cursor(raw=True)
+    wcur = dst.cursor()
+    rows = 0
+    try:
+        rcur.execute(f'SELECT {cols} FROM {quote_ident(table)}')
+        while True:
+            batch = rcur.fetchmany(DB_PARALLEL_BATCH_ROWS)
+            if not batch:
+                break
+            wcur.executemany(insert, batch)
+            rows += len(batch)
+        dst.commit()
+    finally:
+        rcur.close()
+        wcur.close()
+    return rows
+
+
+def copy_schema_objects(database: Optional[str] = None):
+    """Copy triggers, routines, events and views from REMOTE_DB into a local database."""
+    dump_cmd = mysqldump_command('--single-transaction', '--no-data', '--no-create-info', '--triggers', '--add-drop-trigger', '--routines', '--events')
+    dump = spawn(dump_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    result = run_command(mysql_command(database), stdin=dump.stdout, stderr=subprocess.PIPE)
+    dump.stdout.close()
+    dump_stderr = dump.stderr.read()
+    if dump.wait() != 0:
+        logging.error('mysqldump (schema objects) failed: %s', dump_stderr.decode(errors='replace'))
+        raise RuntimeError('mysqldump failed')
+    if result.returncode != 0:
+        logging.error('mysql restore (schema objects) failed: %s', result.stderr.decode(errors='replace'))
+        raise RuntimeError('mysql restore failed')
+
+    src = connect_mysql(REMOTE_DB, 'REMOTE_DB')
+    try:
+        cur = src.cursor()
+        cur.execute('SELECT TABLE_NAME FROM information_schema.VIEWS WHERE TABLE_SCHEMA = %s', (REMOTE_DB['database'],))
+        views = {}
+        for (name,) in cur.fetchall():
+            cur.execute(f'SHOW CREATE VIEW {quote_ident(name)}')
+            views[name] = cur.fetchone()[1]
+        cur.close()
+    finally:
+        _close(src)
+    if not views:
+        return
+    dst = connect_mysql(LOCAL_DB, 'LOCAL_DB', **({'database': database} if database else {}))
+    try:
+        cur = dst.cursor()
+        # Views may depend on each other; retry until a pass makes no progress
+        pending = dict(views)
+        while pending:
+            before = len(pending)
+            errors = {}
+            for name, stmt in list(pending.items()):
+                try:
+                    cur.execute('CREATE OR REPLACE ' + stmt[len('CREATE '):])
+                    del pending[name]
+                except Exception as e:
+                    errors[name] = e
+            if len(pending) == before:
+                for name, e in errors.items():
+                    logging.error('Failed to create view %s: %s', name, e)
+                raise RuntimeError('creating views failed')
+        cur.close()
+    finally:
+        _close(dst)
+
+
+def parallel_copy(tables: Optional[List[str]] = None, with_objects: bool = True) -> Dict[str, Dict]:
+    """Copy REMOTE_DB (or only ``tables``) into LOCAL_DB across DB_PARALLEL_WORKERS workers.
+
+    Returns {table: {'rows': n, 'seconds': s}} for the copied tables.
+    """
+    started = time.monotonic()
+    workers = max(1, DB_PARALLEL_WORKERS)
+    logging.info('Starting parallel copy from %s (%d workers)', REMOTE_DB['host'], workers)
+    snapshot_conns, ddl, columns = open_snapshot(workers, tables)
+    local_conns = []
+    timings: Dict[str, Dict] = {}
+    try:
+        prepare_local_tables(ddl)
+        pairs: 'queue.Queue' = queue.Queue()
+        for src in snapshot_conns:
+            dst = connect_mysql(LOCAL_DB, 'LOCAL_DB')
+            local_conns.append(dst)
+            cur = dst.cursor()
+            cur.execute('SET SESSION foreign_key_checks = 0, unique_checks = 0')
+            cur.execute(_TIME_ZONE)
+            cur.execute(_LOCAL_SQL_MODE)
+            cur.close()
+            pairs.put((src, dst))
+
+        abort = threading.Event()
+
+        def work(table: str):
+            if abort.is_set():
+                raise RuntimeError('aborted')
+            src, dst = pairs.get()
+            try:
+                t0 = time.monotonic()
+                rows = copy_table(src, dst, table, columns.get(table, []))
+                secs = time.monotonic() - t0
+                logging.info('Copied table %s: %d rows in %.2fs', table, rows, secs)
+                METRICS.observe('db_table_copy', secs)
+                METRICS.incr('db_rows_copied', rows)
+                return rows, secs
+            except Exception:
+                abort.set()
+                raise
+            finally:
+                pairs.put((src, dst))
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = {ex.submit(work, t): t for t in ddl}
+            for fut in as_completed(futures):
+                t = futures[fut]
+                try:
+                    rows, secs = fut.result()
+                    timings[t] = {'rows': rows, 'seconds': secs}
+                except Exception as e:
+                    failed.append(t)
+                    logging.error('Failed to copy table %s: %s', t, e)
+        if failed:
+            raise RuntimeError(f"parallel copy failed for tables: {', '.join(sorted(failed))}")
+    finally:
+        for c in snapshot_conns:
+            try:
+                c.rollback()
+            except Exception:
+                pass
+            _close(c)
+        for c in local_conns:
+            _close(c)
+
+    if with_objects:
+        t0 = time.monotonic()
+        copy_schema_objects()
+        METRICS.observe('db_schema_objects', time.monotonic() - t0)
+        logging.info('Copied views, triggers, routines and events in %.2fs', time.monotonic() - t0)
+    total_rows = sum(v['rows'] for v in timings.values())
+    METRICS.incr('db_tables_copied', len(timings))
+    logging.info('Parallel copy complete: %d tables, %d rows in %.1fs', len(timings), total_rows, time.monotonic() - started)
+    return timings
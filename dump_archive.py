@@ -0,0 +1,371 @@
+"""Compressed, content-addressed archive of mysqldump output (DB_ARCHIVE=true).
+
+The dump stream is split at mysqldump's per-object comment markers ("Table
+structure for table", "Dumping data for table", routines, events, views).
+Every section is compressed while it streams in and stored once under the
+sha256 of its uncompressed bytes, so tables that did not change between
+nights share the same object. A snapshot is a small JSON file listing its
+sections in order; restoring one decompresses the sections straight into the
+mysql client.
+
+Layout under DB_ARCHIVE_DIR::
+
+    objects/<2 hex>/<sha256>.zst|.gz
+    snapshots/<YYYYmmdd_HHMMSS>.json
+
+Retention keeps the newest snapshot of each of the last DB_ARCHIVE_KEEP_DAILY
+days and of each of the last DB_ARCHIVE_KEEP_WEEKLY ISO weeks; objects no
+longer referenced by any snapshot are deleted. zstd needs the optional
+``zstandard`` package; gzip is used otherwise.
+
+Command line::
+
+    python dump_archive.py --list
+    python dump_archive.py --restore latest|<snapshot> [--database NAME]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import (
+    REMOTE_DB,
+    LOCAL_DB,
+    DB_ARCHIVE_DIR,
+    DB_ARCHIVE_COMPRESSION,
+    DB_ARCHIVE_LEVEL,
+    DB_ARCHIVE_KEEP_DAILY,
+    DB_ARCHIVE_KEEP_WEEKLY,
+    DB_STREAM_CHUNK_SIZE,
+)
+from db_common import drain_stream, mysql_command, spawn
+from metrics import METRICS
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+# Start of a new section in mysqldump output
+SECTION_RE = re.compile(
+    rb'^-- (?:Table structure for table|Dumping data for table|Temporary view structure for view'
+    rb'|Final view structure for view|Dumping events for database|Dumping routines for database) ',
+    re.M,
+)
+_LABEL_RE = re.compile(rb'-- ([^\n]*)')
+CODEC_EXT = {'zstd': '.zst', 'gzip': '.gz'}
+# GC leaves files younger than this alone: a dump still being archived has temp
+# files and objects that no manifest references yet
+_GC_GRACE_SECONDS = 24 * 3600
+
+
+def resolve_codec(name: str = DB_ARCHIVE_COMPRESSION) -> str:
+    name = (name or 'auto').lower()
+    if name == 'auto':
+        return 'zstd' if zstandard is not None else 'gzip'
+    if name == 'zstd' and zstandard is None:
+        logging.warning('DB_ARCHIVE_COMPRESSION=zstd but the zstandard package is not installed; using gzip')
+        return 'gzip'
+    if name not in CODEC_EXT:
+        raise RuntimeError(f'Unknown DB_ARCHIVE_COMPRESSION: {name}')
+    return name
+
+
+class _Section:
+    """One section being written: hashed and compressed into a temp file as it arrives."""
+
+    def __init__(self, archive: 'DumpArchive', label: str):
+        self.archive = archive
+        self.label = label
+        self.size = 0
+        self.sha = hashlib.sha256()
+        fd, self.tmp = tempfile.mkstemp(dir=archive.objects_dir, suffix='.tmp')
+        self._raw = os.fdopen(fd, 'wb')
+        level = DB_ARCHIVE_LEVEL
+        if archive.codec == 'zstd':
+            cctx = zstandard.ZstdCompressor(level=level or 3)
+            self._out = cctx.stream_writer(self._raw, closefd=False)
+        else:
+            self._out = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=level or 6, mtime=0)
+
+    def write(self, data: bytes):
+        self.sha.update(data)
+        self.size += len(data)
+        self._out.write(data)
+
+    def close(self) -> Dict:
+        self._out.close()
+        self._raw.close()
+        digest = self.sha.hexdigest()
+        existing = self.archive.object_path(digest)
+        if existing:
+            os.remove(self.tmp)
+            # Reused by a snapshot that is not committed yet: keep it out of GC's reach
+            os.utime(existing)
+            METRICS.incr('db_archive_sections_deduplicated')
+        else:
+            path = self.archive.object_path(digest, create=True)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            METRICS.incr('db_archive_bytes_stored', os.path.getsize(self.tmp))
+            os.replace(self.tmp, path)
+        return {'hash': digest, 'size': self.size, 'label': self.label}
+
+    def discard(self):
+        for f in (self._out, self._raw):
+            try:
+                f.close()
+            except Exception:
+                pass
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+
+class SnapshotWriter:
+    """File-like sink for a dump stream; ``commit()`` publishes the snapshot."""
+
+    def __init__(self, archive: 'DumpArchive'):
+        self.archive = archive
+        self.created = datetime.now()
+        self.sections: List[Dict] = []
+        self.size = 0
+        self._carry = b''
+        self._current = _Section(archive, 'header')
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        buf = self._carry + data
+        end = buf.rfind(b'\n') + 1
+        # Only complete lines are scanned for markers; the rest waits for the next chunk
+        self._carry = buf[end:]
+        self._feed(buf[:end])
+
+    def _feed(self, block: bytes):
+        pos = 0
+        for m in SECTION_RE.finditer(block):
+            if m.start() > pos:
+                self._current.write(block[pos:m.start()])
+            pos = m.start()
+            self.sections.append(self._current.close())
+            label = _LABEL_RE.match(block, m.start()).group(1).decode('utf-8', 'replace')
+            self._current = _Section(self.archive, label)
+        if pos < len(block):
+            self._current.write(block[pos:])
+
+    def commit(self) -> str:
+        if self._carry:
+            self._feed(self._carry)
+            self._carry = b''
+        self.sections.append(self._current.close())
+        self._current = None
+        name = self.created.strftime('%Y%m%d_%H%M%S')
+        manifest = {
+            'created': self.created.isoformat(),
+            'source': f"{REMOTE_DB['host']}/{REMOTE_DB['database']}",
+            'codec': self.archive.codec,
+            'size': self.size,
+            'sections': self.sections,
+        }
+        path = os.path.join(self.archive.snapshots_dir, name + '.json')
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(manifest, fh, indent=1)
+        os.replace(tmp, path)
+        METRICS.incr('db_archive_bytes_raw', self.size)
+        logging.info('Dump archived as snapshot %s (%d sections, %.1f MiB uncompressed)',
+                     name, len(self.sections), self.size / (1024 * 1024))
+        return name
+
+    def abort(self):
+        if self._current is not None:
+            self._current.discard()
+            self._current = None
+
+
+class DumpArchive:
+    def __init__(self, root: str = DB_ARCHIVE_DIR, codec: Optional[str] = None):
+        self.root = root
+        self.codec = codec or resolve_codec()
+        self.objects_dir = os.path.join(root, 'objects')
+        self.snapshots_dir = os.path.join(root, 'snapshots')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+
+    def object_path(self, digest: str, create: bool = False) -> Optional[str]:
+        """Path of the stored object (any codec), or where a new one goes when ``create``."""
+        base = os.path.join(self.objects_dir, digest[:2], digest)
+        if create:
+            return base + CODEC_EXT[self.codec]
+        for ext in CODEC_EXT.values():
+            if os.path.exists(base + ext):
+                return base + ext
+        return None
+
+    def writer(self) -> SnapshotWriter:
+        return SnapshotWriter(self)
+
+    def snapshots(self) -> List[str]:
+        """Snapshot names, oldest first."""
+        return sorted(f[:-5] for f in os.listdir(self.snapshots_dir) if f.endswith('.json'))
+
+    def load(self, name: str) -> Dict:
+        if name == 'latest':
+            names = self.snapshots()
+            if not names:
+                raise RuntimeError(f'No snapshots in {self.root}')
+            name = names[-1]
+        with open(os.path.join(self.snapshots_dir, name + '.json'), 'r') as fh:
+            manifest = json.load(fh)
+        manifest['name'] = name
+        return manifest
+
+    def _open(self, digest: str):
+        path = self.object_path(digest)
+        if path is None:
+            raise RuntimeError(f'Archive object {digest} is missing')
+        raw = open(path, 'rb')
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raw.close()
+                raise RuntimeError('Restoring a zstd archive needs the zstandard package')
+            return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+
+    def _digest(self, digest: str) -> str:
+        sha = hashlib.sha256()
+        with self._open(digest) as f:
+            for chunk in iter(lambda: f.read(DB_STREAM_CHUNK_SIZE), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def verify(self, name: str):
+        """Decompress and hash every section of ``name``; raise when one is missing or corrupt."""
+        for section in self.load(name)['sections']:
+            if self._digest(section['hash']) != section['hash']:
+                raise RuntimeError(f"Archive object {section['hash']} is corrupt")
+
+    def iter_snapshot(self, name: str):
+        """Yield the uncompressed dump of ``name`` in chunks. Call verify() first:
+        a section that fails its check here has already been yielded."""
+        for section in self.load(name)['sections']:
+            sha = hashlib.sha256()
+            with self._open(section['hash']) as f:
+                while True:
+                    chunk = f.read(DB_STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    sha.update(chunk)
+                    yield chunk
+            if sha.hexdigest() != section['hash']:
+                raise RuntimeError(f"Archive object {section['hash']} is corrupt")
+
+    def restore(self, name: str = 'latest', database: Optional[str] = None):
+        """Verify snapshot ``name``, then stream it into the local mysql client."""
+        manifest = self.load(name)
+        # A corrupt section must be found before any of the dump reaches the database
+        with METRICS.timer('db_archive_verify'):
+            self.verify(manifest['name'])
+        logging.info('Restoring archived dump %s into local database %s', manifest['name'], database or LOCAL_DB['database'])
+        proc = spawn(mysql_command(database), stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        err: List[bytes] = []
+        drain = threading.Thread(target=drain_stream, args=(proc.stderr, err), daemon=True)
+        drain.start()
+        try:
+            with METRICS.timer('db_archive_restore'):
+                for chunk in self.iter_snapshot(manifest['name']):
+                    proc.stdin.write(chunk)
+                proc.stdin.close()
+                rc = proc.wait()
+        except BrokenPipeError:
+            rc = proc.wait()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            drain.join(timeout=5)
+        if rc != 0:
+            logging.error('mysql restore failed: %s', b''.join(err).decode(errors='replace').strip())
+            raise RuntimeError('archive restore failed')
+        logging.info('Restore of %s complete', manifest['name'])
+
+    def apply_retention(self, keep_daily: int = DB_ARCHIVE_KEEP_DAILY,
+                        keep_weekly: int = DB_ARCHIVE_KEEP_WEEKLY) -> List[str]:
+        """Delete snapshots outside the retention policy, then unreferenced objects."""
+        names = self.snapshots()
+        if not names:
+            return []
+        keep = {names[-1]}
+        days: Dict[str, str] = {}
+        weeks: Dict[tuple, str] = {}
+        for name in reversed(names):
+            ts = datetime.strptime(name, '%Y%m%d_%H%M%S')
+            days.setdefault(ts.strftime('%Y%m%d'), name)
+            weeks.setdefault(ts.isocalendar()[:2], name)
+        keep.update(list(days.values())[:keep_daily])
+        keep.update(list(weeks.values())[:keep_weekly])
+        removed = [n for n in names if n not in keep]
+        for name in removed:
+            os.remove(os.path.join(self.snapshots_dir, name + '.json'))
+        if removed:
+            logging.info('Archive retention: removed %d snapshot(s): %s', len(removed), ', '.join(removed))
+        self._collect_garbage()
+        return removed
+
+    def _collect_garbage(self):
+        referenced = set()
+        for name in self.snapshots():
+            referenced.update(s['hash'] for s in self.load(name)['sections'])
+        freed = 0
+        cutoff = time.time() - _GC_GRACE_SECONDS
+        for dirpath, _, files in os.walk(self.objects_dir):
+            for f in files:
+                digest = f.split('.', 1)[0]
+                if digest in referenced:
+                    continue
+                path = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(path)
+                    if st.st_mtime > cutoff:
+                        continue
+                    os.remove(path)
+                except OSError:
+                    # Renamed or removed by a concurrent writer
+                    continue
+                freed += st.st_size
+        if freed:
+            logging.info('Archive GC freed %.1f MiB', freed / (1024 * 1024))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Inspect and restore archived database dumps.')
+    parser.add_argument('--list', action='store_true', help='list snapshots')
+    parser.add_argument('--restore', metavar='SNAPSHOT', help="restore a snapshot ('latest' for the newest)")
+    parser.add_argument('--database', help='local database to restore into (default: LOCAL_DB_NAME)')
+    args = parser.parse_args(argv)
+    archive = DumpArchive()
+    if args.restore:
+        archive.restore(args.restore, args.database)
+    else:
+        for name in archive.snapshots():
+            m = archive.load(name)
+            stored = sum(os.path.getsize(archive.object_path(s['hash']) or os.devnull) for s in m['sections'])
+            print(f"{name}  {m['source']}  {m['size'] / (1024 * 1024):.1f} MiB raw  "
+                  f"{len(m['sections'])} sections  {stored / (1024 * 1024):.1f} MiB compressed ({m['codec']})")
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s: %(message)s')
+    sys.exit(main())
@@ -0,0 +1,417 @@
+"""asyncio transfer engine (FTP_ENGINE=asyncio).
+
+One event loop drives FTP_ASYNC_CONNECTIONS control connections. Every
+connection runs a worker that takes directory listings and downloads from one
+shared queue, listings first, so crawling and transfers overlap without a
+thread per connection. Blocking disk work (opening, writing and renaming
+files) runs on FTP_ASYNC_DISK_WORKERS threads.
+
+The engine lists by absolute path with MLSD and only uses passive data
+connections. When either is unavailable it raises AsyncEngineUnsupported
+before anything is downloaded, and the caller falls back to the thread engine.
+"""
+import asyncio
+import ftplib
+import itertools
+import logging
+import os
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config import (
+    REMOTE_FTP,
+    REMOTE_FILES_PATH,
+    RECURSIVE_FTP,
+    FTP_MAX_DEPTH,
+    FTP_TIMEOUT,
+    FTP_USE_MLSD,
+    FTP_BLOCK_SIZE,
+    FTP_WRITE_BUFFER,
+    FTP_BANDWIDTH_LIMIT,
+    FTP_ASYNC_CONNECTIONS,
+    FTP_ASYNC_DISK_WORKERS,
+)
+from ftp_hash import DownloadVerifier, HashMismatch, detect_remote_hash
+from ftp_pool import is_connection_error
+from ftp_progress import ProgressReporter
+from ftp_scheduler import RateLimiter, is_throttle_error
+from metrics import METRICS
+
+ENCODING = 'utf-8'
+# Queue priorities: directories are listed before files are fetched
+_DIR, _FILE = 0, 1
+
+
+class AsyncEngineUnsupported(Exception):
+    """The server (or configuration) does not allow the asyncio engine."""
+
+
+def _reply_error(text: str) -> ftplib.Error:
+    # Same exception types as ftplib, so retry/throttle classification is shared
+    if text[:1] == '4':
+        return ftplib.error_temp(text)
+    if text[:1] == '5':
+        return ftplib.error_perm(text)
+    return ftplib.error_reply(text)
+
+
+class AsyncFTP:
+    """Minimal FTP client on asyncio streams: login, MLSD and RETR (with REST)."""
+
+    def __init__(self):
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.epsv = True
+
+    async def connect(self):
+        started = time.monotonic()
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(REMOTE_FTP['host'], REMOTE_FTP['port']), FTP_TIMEOUT)
+        await self.response('2')
+        connected = time.monotonic()
+        METRICS.observe('ftp_connect', connected - started)
+        resp = await self.command(f"USER {REMOTE_FTP['user']}", '23')
+        if resp.startswith('3'):
+            await self.command(f"PASS {REMOTE_FTP['password']}", '2')
+        METRICS.observe('ftp_login', time.monotonic() - connected)
+        await self.command('TYPE I', '2')
+
+    async def _line(self) -> str:
+        line = await asyncio.wait_for(self.reader.readline(), FTP_TIMEOUT)
+        if not line:
+            raise EOFError('FTP control connection closed')
+        return line.decode(ENCODING, 'surrogateescape').rstrip('\r\n')
+
+    async def response(self, expect: Optional[str] = None) -> str:
+        """Read one (possibly multi-line) reply; raise unless its first digit is in ``expect``."""
+        line = await self._line()
+        lines = [line]
+        if line[3:4] == '-':
+            code = line[:3]
+            while True:
+                line = await self._line()
+                lines.append(line)
+                if line[:3] == code and line[3:4] == ' ':
+                    break
+        text = '\n'.join(lines)
+        if expect is not None and text[:1] not in expect:
+            raise _reply_error(text)
+        return text
+
+    async def command(self, cmd: str, expect: Optional[str] = '2') -> str:
+        self.writer.write(cmd.encode(ENCODING, 'surrogateescape') + b'\r\n')
+        await self.writer.drain()
+        return await self.response(expect)
+
+    async def pwd(self) -> str:
+        return ftplib.parse257(await self.command('PWD', '2'))
+
+    async def _open_data(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        host = self.writer.get_extra_info('peername')[0]
+        port = None
+        if self.epsv:
+            resp = await self.command('EPSV', None)
+            if resp.startswith('229'):
+                port = ftplib.parse229(resp, (host, 0))[1]
+            else:
+                self.epsv = False
+        if port is None:
+            # Like ftplib, ignore the address in a 227 reply and reuse the control host
+            port = ftplib.parse227(await self.command('PASV', '2'))[1]
+        return await asyncio.wait_for(asyncio.open_connection(host, port), FTP_TIMEOUT)
+
+    async def _transfer(self, cmd: str, sink: Callable, rest: int = 0):
+        if rest:
+            await self.command(f'REST {rest}', '3')
+        reader, writer = await self._open_data()
+        try:
+            await self.command(cmd, '1')
+            while True:
+                data = await asyncio.wait_for(reader.read(FTP_BLOCK_SIZE), FTP_TIMEOUT)
+                if not data:
+                    break
+                await sink(data)
+        finally:
+            writer.close()
+        await self.response('2')
+
+    async def mlsd(self, path: str) -> List[Tuple[str, Dict[str, str]]]:
+        chunks: List[bytes] = []
+
+        async def collect(data: bytes):
+            chunks.append(data)
+
+        await self._transfer(f'MLSD {path}', collect)
+        entries = []
+        for line in b''.join(chunks).decode(ENCODING, 'surrogateescape').splitlines():
+            facts_found, _, name = line.partition(' ')
+            facts = {}
+            for fact in facts_found[:-1].split(';'):
+                key, _, value = fact.partition('=')
+                facts[key.lower()] = value
+            entries.append((name, facts))
+        return entries
+
+    async def retr(self, path: str, sink: Callable, rest: int = 0):
+        await self._transfer(f'RETR {path}', sink, rest)
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            await asyncio.wait_for(self.command('QUIT', None), 5)
+        except Exception:
+            pass
+        self.writer.close()
+        self.writer = None
+
+
+def _parse_entry(facts: Dict[str, str]) -> Tuple[Optional[bool], Optional[int], Optional[datetime]]:
+    """(is_dir or None for cdir/pdir, size, modify time) from MLSD facts."""
+    typ = facts.get('type', '').lower()
+    if typ in ('cdir', 'pdir'):
+        return None, None, None
+    if typ == 'dir':
+        return True, None, None
+    size = int(facts['size']) if facts.get('size', '').isdigit() else None
+    mdtm_dt = None
+    if 'modify' in facts:
+        try:
+            mdtm_dt = datetime.strptime(facts['modify'][:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return False, size, mdtm_dt
+
+
+class AsyncSyncEngine:
+    """Crawl REMOTE_FILES_PATH and download the selected files over one event loop.
+
+    The caller supplies the policy as plain callables, so both engines share
+    the same filters and bookkeeping:
+
+    - ``select(remote_dir, rel_dir, name, size, mdtm)`` returns a task dict or None;
+    - ``prepare(task)`` returns ``(part_path, resume_offset)``;
+    - ``complete(task, part_path, seconds)`` moves the file into place and records it;
+    - ``on_root(root)`` is called once with the resolved remote root.
+
+    ``select``, ``prepare``, ``complete`` and ``on_root`` run on the disk
+    threads (they stat files and write the manifest). With ``verify`` the
+    data is hashed as it arrives (see ftp_hash) and the digest is left in
+    ``task['hash']`` for ``complete``. An optional ``progress`` reporter is
+    fed the queued files and received bytes.
+    """
+
+    def __init__(self, select: Callable, prepare: Callable, complete: Callable,
+                 on_root: Optional[Callable[[str], None]] = None, verify: bool = False,
+                 progress: Optional[ProgressReporter] = None):
+        self._select = select
+        self._prepare = prepare
+        self._complete = complete
+        self._on_root = on_root
+        self._verify = verify
+        self._progress = progress
+        self._dirs_pending = 0
+        self.verifier: Optional[DownloadVerifier] = None
+        self.root: Optional[str] = None
+        self.submitted = 0
+        self.completed = 0
+        self.list_errors = 0
+        self.failures: List[Tuple[Dict, BaseException]] = []
+
+    def run(self) -> 'AsyncSyncEngine':
+        if not FTP_USE_MLSD:
+            raise AsyncEngineUnsupported('FTP_USE_MLSD is disabled')
+        if not REMOTE_FTP['passive']:
+            raise AsyncEngineUnsupported('active mode is not supported')
+        asyncio.run(self._main())
+        return self
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._disk = ThreadPoolExecutor(max_workers=max(1, FTP_ASYNC_DISK_WORKERS), thread_name_prefix='ftp-disk')
+        self._limiter = RateLimiter(FTP_BANDWIDTH_LIMIT) if FTP_BANDWIDTH_LIMIT > 0 else None
+        self._queue: asyncio.PriorityQueue = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        first = AsyncFTP()
+        try:
+            await first.connect()
+            await first.command(f'CWD {REMOTE_FILES_PATH}', '2')
+            self.root = await first.pwd()
+            if self._verify:
+                feat = await first.command('FEAT', None)
+                self.verifier = DownloadVerifier(detect_remote_hash(feat if feat[:1] == '2' else ''))
+            try:
+                with METRICS.timer('ftp_list_dir'):
+                    entries = await first.mlsd(self.root)
+            except ftplib.error_perm as e:
+                raise AsyncEngineUnsupported(f'MLSD not supported: {e}')
+            if self._on_root is not None:
+                await self._loop.run_in_executor(self._disk, self._on_root, self.root)
+            await self._handle_listing('', 0, entries)
+            self._listed()
+        except BaseException:
+            await first.close()
+            self._disk.shutdown()
+            raise
+
+        self._live = max(1, FTP_ASYNC_CONNECTIONS)
+        workers = [asyncio.create_task(self._worker(first))]
+        workers += [asyncio.create_task(self._worker(None)) for _ in range(self._live - 1)]
+        try:
+            await self._queue.join()
+        finally:
+            for w in workers:
+                w.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._disk.shutdown()
+
+    def _listed(self):
+        if not self._dirs_pending and self._progress is not None:
+            self._progress.listing_done()
+
+    def _put(self, kind: int, item, size: Optional[int] = None):
+        # Files are fetched largest first
+        self._queue.put_nowait((kind, -(size or 0), next(self._seq), item))
+
+    async def _handle_listing(self, rel_dir: str, depth: int, entries):
+        remote_dir = self.remote_path(rel_dir)
+        files = []
+        METRICS.incr('ftp_dirs_listed')
+        METRICS.incr('ftp_entries_listed', len(entries))
+        for name, facts in entries:
+            if name in ('.', '..'):
+                continue
+            is_dir, size, mdtm_dt = _parse_entry(facts)
+            if is_dir is None:
+                continue
+            child = posixpath.join(rel_dir, name) if rel_dir else name
+            if is_dir:
+                if not RECURSIVE_FTP:
+                    logging.debug('Skipping directory (recursion disabled): %s/%s', remote_dir, name)
+                elif FTP_MAX_DEPTH and depth + 1 > FTP_MAX_DEPTH:
+                    logging.debug('Skipping directory (depth limit %d): %s/%s', FTP_MAX_DEPTH, remote_dir, name)
+                else:
+                    self._dirs_pending += 1
+                    self._put(_DIR, (child, depth + 1))
+                continue
+            files.append((name, size, mdtm_dt))
+        if not files:
+            return
+        # One trip to the disk threads per directory: the filters stat files and query the manifest
+        tasks = await self._loop.run_in_executor(
+            self._disk, lambda: [self._select(remote_dir, rel_dir, *f) for f in files])
+        for task in tasks:
+            if task is not None:
+                self.submitted += 1
+                if self._progress is not None:
+                    self._progress.add(task['size'])
+                self._put(_FILE, task, task['size'])
+
+    def remote_path(self, rel_path: str) -> str:
+        return posixpath.join(self.root, rel_path.replace('\\', '/')) if rel_path else self.root
+
+    async def _worker(self, conn: Optional[AsyncFTP]):
+        try:
+            while True:
+                entry = await self._queue.get()
+                kind, item = entry[0], entry[-1]
+                try:
+                    if conn is None:
+                        conn = AsyncFTP()
+                        try:
+                            await conn.connect()
+                        except Exception as e:
+                            conn = None
+                            if self._live > 1 and (is_throttle_error(e) or is_connection_error(e)):
+                                # The server will not take another login; leave the work to the others
+                                self._live -= 1
+                                logging.warning('FTP connection refused (%s); continuing with %d connections', e, self._live)
+                                self._queue.put_nowait(entry)
+                                return
+                            raise
+                    if kind == _DIR:
+                        await self._list(conn, *item)
+                    else:
+                        await self._download(conn, item)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    broken = is_connection_error(e)
+                    if broken and conn is not None:
+                        await conn.close()
+                        conn = None
+                    attempts = item.get('attempts', 0) + 1 if kind == _FILE else 0
+                    if kind == _FILE and broken and attempts <= 1:
+                        item['attempts'] = attempts
+                        METRICS.incr('ftp_retries')
+                        self._put(_FILE, item, item.get('size'))
+                    elif kind == _FILE:
+                        self.failures.append((item, e))
+                    else:
+                        logging.error('Failed to list %s: %s', self.remote_path(item[0]), e)
+                        METRICS.incr('ftp_list_errors')
+                        self.list_errors += 1
+                    if kind == _DIR:
+                        self._dirs_pending -= 1
+                        self._listed()
+                finally:
+                    self._queue.task_done()
+        finally:
+            if conn is not None:
+                await conn.close()
+
+    async def _list(self, conn: AsyncFTP, rel_dir: str, depth: int):
+        with METRICS.timer('ftp_list_dir'):
+            entries = await conn.mlsd(self.remote_path(rel_dir))
+        await self._handle_listing(rel_dir, depth, entries)
+        self._dirs_pending -= 1
+        self._listed()
+
+    async def _download(self, conn: AsyncFTP, task: Dict):
+        loop = self._loop
+        part, offset = await loop.run_in_executor(self._disk, self._prepare, task)
+        if offset:
+            logging.info('Resuming %s at byte %d', task['rel_path'], offset)
+            METRICS.incr('ftp_resumed')
+            METRICS.incr('ftp_resumed_bytes_saved', offset)
+            if self._progress is not None:
+                self._progress.skip(offset)
+        verifier = self.verifier
+        progress = self._progress
+        hasher = await loop.run_in_executor(self._disk, verifier.start, part, offset) if verifier else None
+        started = time.monotonic()
+        f = await loop.run_in_executor(self._disk, open, part, 'ab' if offset else 'wb', FTP_WRITE_BUFFER)
+
+        def store(data: bytes):
+            f.write(data)
+            if hasher is not None:
+                hasher.update(data)
+
+        try:
+            async def write(data: bytes):
+                await loop.run_in_executor(self._disk, store, data)
+                if progress is not None:
+                    progress.advance(len(data))
+                if self._limiter is not None:
+                    wait = self._limiter.reserve(len(data))
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+            await conn.retr(self.remote_path(task['rel_path']), write, offset)
+        finally:
+            await loop.run_in_executor(self._disk, f.close)
+        if verifier is not None:
+            cmd = verifier.remote_command(self.remote_path(task['rel_path']))
+            reply = await conn.command(cmd, None) if cmd else None
+            try:
+                task['hash'] = verifier.finish(hasher, reply, task['rel_path'])
+            except HashMismatch:
+                await loop.run_in_executor(self._disk, os.remove, part)
+                raise
+        await loop.run_in_executor(self._disk, self._complete, task, part, time.monotonic() - started)
+        self.completed += 1
+        if progress is not None:
+            progress.file_done()
@@ -0,0 +1,173 @@
+"""Content hashes for downloaded files (FTP_VERIFY=true).
+
+Files are hashed while their blocks arrive, so verification costs no second
+read. When the server advertises HASH (draft-bryan-ftpext-hash), XMD5 or
+XCRC in FEAT, the remote digest is fetched after the transfer and compared
+before the .part file is moved into place. The local digest is stored in the
+sync manifest as ``<algo>:<hex>`` and can be re-checked later with
+``python main.py --verify``.
+"""
+import hashlib
+import logging
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from config import FTP_HASH_ALGO, FTP_BLOCK_SIZE
+
+# Server algorithm names (HASH / FEAT) -> local names
+_HASH_NAMES = {'SHA-256': 'sha256', 'SHA-512': 'sha512', 'SHA-1': 'sha1', 'MD5': 'md5', 'CRC32': 'crc32'}
+# Preference when a server offers several
+_PREFERENCE = ('sha256', 'sha512', 'sha1', 'md5', 'crc32')
+
+
+class HashMismatch(Exception):
+    """The downloaded data does not match the server's digest."""
+
+
+class _CRC32:
+    def __init__(self):
+        self.value = 0
+
+    def update(self, data: bytes):
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return f'{self.value:08x}'
+
+
+def new_hash(algo: str):
+    return _CRC32() if algo == 'crc32' else hashlib.new(algo)
+
+
+class StreamHasher:
+    """Feeds each block into the stored algorithm and, if different, the remote one."""
+
+    def __init__(self, algos: List[str]):
+        self._hashes = {a: new_hash(a) for a in dict.fromkeys(algos)}
+
+    def update(self, data: bytes):
+        for h in self._hashes.values():
+            h.update(data)
+
+    def hexdigest(self, algo: str) -> str:
+        return self._hashes[algo].hexdigest()
+
+
+def detect_remote_hash(feat_reply: str) -> Optional[Tuple[str, str]]:
+    """(command, algo) for the best digest the server offers in its FEAT reply, or None."""
+    features = [line.strip() for line in feat_reply.splitlines()[1:-1]]
+    for feat in features:
+        if feat.upper().startswith('HASH '):
+            # e.g. "HASH SHA-256*;SHA-1;MD5": the starred one is the current selection
+            for name in feat[5:].split(';'):
+                if name.endswith('*') and name[:-1].upper() in _HASH_NAMES:
+                    return 'HASH', _HASH_NAMES[name[:-1].upper()]
+    upper = {f.upper() for f in features}
+    if 'XMD5' in upper:
+        return 'XMD5', 'md5'
+    if 'XCRC' in upper:
+        return 'XCRC', 'crc32'
+    return None
+
+
+def parse_remote_hash(reply: str, algo: str) -> Optional[str]:
+    """Digest from a HASH ("213 SHA-256 0-99 <hex> name"), XMD5 or XCRC reply."""
+    width = len(new_hash(algo).hexdigest())
+    for token in reply[4:].split():
+        token = token.lower()
+        if len(token) == width and all(c in '0123456789abcdef' for c in token):
+            return token
+    return None
+
+
+class DownloadVerifier:
+    """Per-run verification settings shared by every download."""
+
+    def __init__(self, remote: Optional[Tuple[str, str]] = None, algo: str = FTP_HASH_ALGO):
+        self.algo = algo
+        self.remote = remote
+        self.checked = 0
+        self.mismatches = 0
+
+    def start(self, part: str, offset: int = 0) -> StreamHasher:
+        """New hasher for a download; a resumed .part's existing bytes are hashed first."""
+        algos = [self.algo] + ([self.remote[1]] if self.remote else [])
+        hasher = StreamHasher(algos)
+        if offset:
+            with open(part, 'rb') as f:
+                remaining = offset
+                while remaining > 0:
+                    data = f.read(min(FTP_BLOCK_SIZE, remaining))
+                    if not data:
+                        break
+                    hasher.update(data)
+                    remaining -= len(data)
+        return hasher
+
+    def remote_command(self, path: str) -> Optional[str]:
+        return f'{self.remote[0]} {path}' if self.remote else None
+
+    def finish(self, hasher: StreamHasher, reply: Optional[str], rel_path: str) -> str:
+        """Compare with the server's reply (when there is one) and return the value to store."""
+        if reply is not None and self.remote is not None and reply[:1] == '2':
+            expected = parse_remote_hash(reply, self.remote[1])
+            if expected is not None:
+                self.checked += 1
+                actual = hasher.hexdigest(self.remote[1])
+                if actual != expected:
+                    self.mismatches += 1
+                    raise HashMismatch(f'{rel_path}: {self.remote[1]} {actual} != server {expected}')
+        return f'{self.algo}:{hasher.hexdigest(self.algo)}'
+
+
+def hash_file(path: str, algo: str = FTP_HASH_ALGO) -> str:
+    h = new_hash(algo)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _check(job: Tuple[str, str, Optional[int], Optional[str]]) -> Tuple[str, Optional[str]]:
+    """Worker process: (rel_path, problem or None)."""
+    path, rel_path, size, stored = job
+    try:
+        if size is not None and os.path.getsize(path) != size:
+            return rel_path, 'size differs'
+        if stored is None:
+            return rel_path, None
+        algo, _, digest = stored.partition(':')
+        if hash_file(path, algo) != digest:
+            return rel_path, 'content hash differs'
+    except FileNotFoundError:
+        return rel_path, 'missing'
+    except OSError as e:
+        return rel_path, str(e)
+    return rel_path, None
+
+
+def verify_tree(manifest, local_root: str, workers: int) -> Dict[str, str]:
+    """Re-hash every file in ``manifest`` across ``workers`` processes.
+
+    Returns {rel_path: problem}. Bad entries are invalidated in the manifest so
+    the next sync downloads them again.
+    """
+    jobs = []
+    unhashed = 0
+    for rel_path, entry in manifest.items():
+        if entry.size is None:
+            continue
+        if entry.hash is None:
+            unhashed += 1
+        jobs.append((os.path.join(local_root, rel_path), rel_path, entry.size, entry.hash))
+    problems: Dict[str, str] = {}
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as ex:
+        for rel_path, problem in ex.map(_check, jobs, chunksize=16):
+            if problem:
+                problems[rel_path] = problem
+                manifest.invalidate(rel_path)
+    if unhashed:
+        logging.info('%d file(s) have no stored hash (synced without FTP_VERIFY); only their size was checked', unhashed)
+    return problems
@@ -0,0 +1,249 @@
+"""Fewer round-trips for remote directory listings.
+
+Listing cache (FTP_LISTING_CACHE=true): every listed directory is stored in a
+SQLite database with its parsed entries and its own MLSD ``modify`` fact. The
+next time the crawler reaches that directory with the same modify time, the
+stored entries are used instead of a new listing. A directory's modify time
+comes from its parent's listing. When the parent itself came from the cache,
+it comes from MLST probes, which are pipelined over the control connection and
+need no data connection. Like watch mode, this relies on a directory's modify
+time changing when entries are added, removed or renamed in it. A file
+overwritten in place usually does not change it, so cache entries can be
+given a maximum age (FTP_LISTING_CACHE_MAX_AGE).
+
+Pipelined fallback: without MLSD, a directory is listed with one LIST whose
+lines give each entry's type and size. The MDTM of every file, and CWD/SIZE
+probes for entries LIST could not describe, are then sent FTP_PIPELINE_DEPTH
+commands at a time before their replies are read. The old fallback took
+several round-trips per entry.
+"""
+import ftplib
+import json
+import logging
+import os
+import posixpath
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple, Union
+
+from config import FTP_PIPELINE_DEPTH
+from metrics import METRICS
+from sync_manifest import epoch
+from sync_watch import parse_mlst_modify
+
+# (name, is_dir, size, modify) as returned by list_entries()
+Entry = Tuple[str, bool, Optional[int], Optional[datetime]]
+
+# drwxr-xr-x   2 owner group   4096 Jan 12 10:31 name  (group is optional)
+_UNIX_RE = re.compile(
+    r'^([\-dlbcps])[rwxsStTl\-]{9}[+.@]?\s+\d+\s+\S+(?:\s+\S+)?\s+(\d+)\s+'
+    r'[A-Za-z]{3}\s+\d{1,2}\s+(?:\d{1,2}:\d{2}|\d{4})\s(.+)$')
+# 01-12-21  10:31AM       <DIR>          name
+_DOS_RE = re.compile(r'^\d{2}-\d{2}-\d{2,4}\s+\d{1,2}:\d{2}(?:[AP]M)?\s+(<DIR>|\d+)\s+(.+)$', re.IGNORECASE)
+# A listing younger than this (seconds) may still miss a change made in the same second
+_SETTLE_SECONDS = 2
+
+
+def parse_list_line(line: str) -> Optional[Tuple[str, Optional[bool], Optional[int]]]:
+    """(name, is_dir, size) for a Unix or DOS style LIST line, None when not understood.
+    ``is_dir`` is None for symlinks, whose target type LIST does not show.
+    """
+    m = _UNIX_RE.match(line)
+    if m:
+        kind, size, name = m.groups()
+        if kind == 'l':
+            return name.split(' -> ', 1)[0], None, None
+        return name, kind == 'd', None if kind == 'd' else int(size)
+    m = _DOS_RE.match(line)
+    if m:
+        size, name = m.groups()
+        is_dir = size.upper() == '<DIR>'
+        return name, is_dir, None if is_dir else int(size)
+    return None
+
+
+def pipeline(conn: ftplib.FTP, commands: List[str], depth: int = 0) -> List[Union[str, Exception]]:
+    """Send ``commands`` ``depth`` at a time without waiting for each reply.
+
+    Returns one entry per command in order: the reply, or the error_perm /
+    error_temp (or ValueError, for a command with a line break) it produced.
+    Other errors leave the connection unusable and are raised.
+    """
+    depth = max(1, depth or FTP_PIPELINE_DEPTH)
+    replies: List[Union[str, Exception]] = []
+    for i in range(0, len(commands), depth):
+        batch = commands[i:i + depth]
+        valid = [c for c in batch if '\r' not in c and '\n' not in c]
+        if valid:
+            conn.sock.sendall(''.join(c + '\r\n' for c in valid).encode(conn.encoding))
+        for cmd in batch:
+            if '\r' in cmd or '\n' in cmd:
+                replies.append(ValueError('an illegal newline character should not be contained'))
+                continue
+            try:
+                replies.append(conn.getresp())
+            except (ftplib.error_perm, ftplib.error_temp) as e:
+                replies.append(e)
+    METRICS.incr('ftp_pipelined_commands', len(commands))
+    return replies
+
+
+def _mdtm(reply) -> Optional[datetime]:
+    if not isinstance(reply, str) or not reply.startswith('213 '):
+        return None
+    try:
+        return datetime.strptime(reply[4:].strip()[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def _size(reply) -> Optional[int]:
+    if not isinstance(reply, str) or not reply.startswith('213 '):
+        return None
+    value = reply[4:].strip()
+    return int(value) if value.isdigit() else None
+
+
+def mlst_modify(conn: ftplib.FTP, paths: List[str]) -> List[Optional[int]]:
+    """Pipelined MLST: each path's modify time (epoch), or None when unknown."""
+    return [parse_mlst_modify(r) if isinstance(r, str) else None
+            for r in pipeline(conn, [f'MLST {p}' for p in paths])]
+
+
+def list_fallback(conn: ftplib.FTP, path: Optional[str] = None) -> List[Entry]:
+    """List a directory without MLSD: one LIST plus pipelined MDTM/CWD/SIZE probes."""
+    cwd = conn.pwd()
+    base = path or cwd
+
+    def child(name: str) -> str:
+        return posixpath.join(base, name)
+
+    lines: List[str] = []
+    conn.retrlines(f'LIST {path}' if path else 'LIST', lines.append)
+    known: Dict[str, Tuple[Optional[bool], Optional[int]]] = {}
+    unparsed = False
+    for line in lines:
+        if not line.strip() or line.lower().startswith('total '):
+            continue
+        parsed = parse_list_line(line)
+        if parsed is None:
+            unparsed = True
+        elif parsed[0] not in ('.', '..'):
+            known[parsed[0]] = parsed[1:]
+    if unparsed:
+        # Some lines were not understood: take the names from NLST instead
+        names = []
+        for name in (conn.nlst(path) if path else conn.nlst()):
+            # Some servers answer NLST <path> with full paths
+            name = posixpath.basename(name.rstrip('/'))
+            if name not in ('.', '..', ''):
+                names.append(name)
+    else:
+        names = list(known)
+
+    # Entries of unknown type: a CWD into them succeeds for directories
+    unknown = [n for n in names if known.get(n, (None, None))[0] is None]
+    dirs = set()
+    if unknown:
+        replies = pipeline(conn, [f'CWD {child(n)}' for n in unknown] + [f'CWD {cwd}'])
+        dirs = {n for n, r in zip(unknown, replies) if isinstance(r, str)}
+        if not isinstance(replies[-1], str) and hasattr(conn, 'current_dir'):
+            conn.current_dir = None
+    files = [n for n in names if n not in dirs and known.get(n, (None, None))[0] is not True]
+    sizes = {n: known[n][1] for n in files if n in known and known[n][1] is not None}
+    need_size = [n for n in files if n not in sizes]
+    # SIZE is refused in ASCII mode by many servers, and LIST just switched to it
+    commands = (['TYPE I'] + [f'SIZE {child(n)}' for n in need_size] if need_size else [])
+    commands += [f'MDTM {child(n)}' for n in files]
+    replies = pipeline(conn, commands) if commands else []
+    if need_size:
+        replies = replies[1:]
+        sizes.update((n, _size(r)) for n, r in zip(need_size, replies))
+        replies = replies[len(need_size):]
+    mdtms = dict(zip(files, (_mdtm(r) for r in replies)))
+
+    entries: List[Entry] = []
+    for name in names:
+        if name in dirs or known.get(name, (None, None))[0] is True:
+            entries.append((name, True, None, None))
+        else:
+            entries.append((name, False, sizes.get(name), mdtms.get(name)))
+    return entries
+
+
+class ListingCache:
+    """rel_dir -> (modify, listed at, entries) in SQLite, loaded into memory when opened.
+
+    A cache only describes one remote root (``scope``); a different one starts
+    it afresh. Writes go straight to the database, one row per directory.
+    """
+
+    def __init__(self, path: str, scope: str, max_age: int = 0):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS dirs (rel_dir TEXT PRIMARY KEY, modify INTEGER, listed_at INTEGER, entries TEXT)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'scope'").fetchone()
+        if row is None or row[0] != scope:
+            if row is not None:
+                logging.info('Listing cache scope changed (%s -> %s); starting a new cache', row[0], scope)
+            self._db.execute('BEGIN')
+            self._db.execute('DELETE FROM dirs')
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('scope', ?)", (scope,))
+            self._db.execute('COMMIT')
+        self._dirs: Dict[str, Tuple[int, int, str]] = {
+            r[0]: (r[1], r[2], r[3]) for r in self._db.execute('SELECT rel_dir, modify, listed_at, entries FROM dirs')
+        }
+
+    def __len__(self) -> int:
+        return len(self._dirs)
+
+    def lookup(self, rel_dir: str, modify: Optional[int]) -> Optional[List[Entry]]:
+        """The stored entries when ``modify`` matches the cached one and they have not expired."""
+        if modify is None:
+            return None
+        row = self._dirs.get(rel_dir)
+        if row is None or row[0] != modify:
+            return None
+        if self.max_age and time.time() - row[1] > self.max_age:
+            return None
+        return [(name, bool(is_dir), size, datetime.fromtimestamp(m, timezone.utc) if m is not None else None)
+                for name, is_dir, size, m in json.loads(row[2])]
+
+    def store(self, rel_dir: str, modify: Optional[int], entries: List[Entry]):
+        """Remember a listing taken while the directory had modify time ``modify``."""
+        now = int(time.time())
+        if modify is None or now - modify < _SETTLE_SECONDS:
+            return
+        data = json.dumps([[name, int(is_dir), size, epoch(m)] for name, is_dir, size, m in entries])
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO dirs (rel_dir, modify, listed_at, entries) VALUES (?, ?, ?, ?)',
+                             (rel_dir, modify, now, data))
+            self._dirs[rel_dir] = (modify, now, data)
+
+    def prune(self, keep):
+        """Forget directories not in ``keep`` (after a complete crawl)."""
+        with self._lock:
+            gone = [d for d in self._dirs if d not in keep]
+            if not gone:
+                return
+            self._db.execute('BEGIN')
+            self._db.executemany('DELETE FROM dirs WHERE rel_dir = ?', [(d,) for d in gone])
+            self._db.execute('COMMIT')
+            for d in gone:
+                del self._dirs[d]
+
+    def close(self):
+        with self._lock:
+            try:
+                self._db.close()
+            except Exception:
+                pass
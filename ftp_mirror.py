@@ -0,0 +1,189 @@
+"""Mirror mode (FTP_MIRROR=true): propagate remote deletions and renames locally.
+
+The local tree is indexed once before listing starts (rel_path -> size,
+mtime) and the crawler records every remote file in scope. Files that already
+exist locally are downloaded as soon as they are listed; new files are held
+until the listing is complete. The diff is then done in one pass over the
+local index:
+
+- a local file that is missing remotely and has the same (size, modify time)
+  as exactly one new remote file is renamed instead of downloaded again
+  (synced files carry the remote modify time as their mtime);
+- the remaining local-only files are deleted.
+
+Nothing is renamed or deleted when any directory failed to list, and
+deletions are skipped entirely when they would remove more than
+FTP_MIRROR_MAX_DELETE_PERCENT of the local files. With FTP_MIRROR_DRY_RUN
+the planned actions are only logged.
+"""
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import METRICS
+from sync_manifest import SyncManifest, epoch
+
+Key = Tuple[int, Optional[int]]  # (size, mtime epoch seconds)
+
+
+def index_local(root: str, in_scope: Callable[[str], bool]) -> Dict[str, Key]:
+    """rel_path -> (size, mtime) for every file under ``root`` that ``in_scope`` accepts."""
+    index: Dict[str, Key] = {}
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root, rel_dir) if rel_dir else root)
+        except OSError as e:
+            logging.warning('Mirror: cannot read %s: %s', os.path.join(root, rel_dir), e)
+            continue
+        with it:
+            for entry in it:
+                rel_path = os.path.join(rel_dir, entry.name) if rel_dir else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(rel_path)
+                elif entry.is_file(follow_symlinks=False) and not entry.name.endswith('.part') and in_scope(rel_path):
+                    st = entry.stat(follow_symlinks=False)
+                    index[rel_path] = (st.st_size, int(st.st_mtime))
+    return index
+
+
+class FileMirror:
+    def __init__(self, local_root: str, in_scope: Callable[[str], bool], submit: Callable[[Dict], None],
+                 manifest: Optional[SyncManifest] = None, dry_run: bool = False,
+                 max_delete_percent: float = 10.0):
+        self.local_root = local_root
+        self._submit = submit
+        self.manifest = manifest
+        self.dry_run = dry_run
+        self.max_delete_percent = max_delete_percent
+        with METRICS.timer('ftp_mirror_index'):
+            self.local = index_local(local_root, in_scope)
+        if manifest is not None:
+            # The local index is authoritative: files removed by hand are fetched again
+            stale = [p for p, _ in manifest.items() if p not in self.local and in_scope(p)]
+            for rel_path in stale:
+                manifest.remove(rel_path)
+            if stale:
+                logging.info('Mirror: %d manifest entries have no local file; they will be downloaded again', len(stale))
+        self.remote: Dict[str, Key] = {}
+        self._held: List[Dict] = []
+        self._lock = threading.Lock()
+
+    # -- called by the crawler threads ----------------------------------------
+    def listed(self, rel_path: str, size, mdtm_dt):
+        self.remote[rel_path] = (size, epoch(mdtm_dt))
+
+    def on_file(self, task: Dict):
+        if task['rel_path'] in self.local:
+            self._submit(task)
+        else:
+            # New remote file: may turn out to be a rename of a local file
+            with self._lock:
+                self._held.append(task)
+
+    # -- after listing -----------------------------------------------------------
+    def finish(self, list_errors: int) -> Dict[str, int]:
+        """Apply renames and deletions, and submit the held downloads."""
+        held, self._held = self._held, []
+        gone = [p for p in self.local if p not in self.remote]
+        if list_errors:
+            logging.warning('Mirror: %d director(ies) could not be listed; skipping renames and deletions', list_errors)
+            for task in held:
+                self._submit(task)
+            return {'renamed': 0, 'deleted': 0}
+
+        by_key: Dict[Key, List[str]] = defaultdict(list)
+        for rel_path in gone:
+            by_key[self.local[rel_path]].append(rel_path)
+        new_keys: Dict[Key, int] = defaultdict(int)
+        for task in held:
+            new_keys[(task['size'], epoch(task['mdtm']))] += 1
+
+        renames: List[Tuple[str, Dict]] = []
+        for task in held:
+            key = (task['size'], epoch(task['mdtm']))
+            candidates = by_key.get(key, [])
+            # Only unambiguous matches: one vanished local file, one new remote file
+            if task['size'] is not None and key[1] is not None and len(candidates) == 1 and new_keys[key] == 1:
+                renames.append((candidates.pop(), task))
+            else:
+                self._submit(task)
+        renamed_from = {old for old, _ in renames}
+        deletes = [p for p in gone if p not in renamed_from]
+
+        for old, task in renames:
+            self._rename(old, task)
+        deleted = 0
+        limit = len(self.local) * self.max_delete_percent / 100.0
+        if deletes and len(deletes) > limit:
+            logging.error('Mirror: %d deletions exceed FTP_MIRROR_MAX_DELETE_PERCENT (%g%% of %d local files); '
+                          'not deleting anything', len(deletes), self.max_delete_percent, len(self.local))
+            METRICS.incr('ftp_mirror_delete_blocked', len(deletes))
+            if self.dry_run:
+                for rel_path in sorted(deletes):
+                    logging.info('Mirror (dry run): would delete %s (blocked by the threshold)', rel_path)
+        else:
+            for rel_path in sorted(deletes):
+                deleted += self._delete(rel_path)
+        new = len(held) - len(renames)
+        if self.dry_run:
+            logging.info('Mirror (dry run): would rename %d and delete %d file(s) (%.1f MiB); %d new file(s)',
+                         len(renames), len(deletes), sum(self.local[p][0] for p in deletes) / (1024 * 1024), new)
+        else:
+            logging.info('Mirror: %d renamed, %d deleted, %d new file(s) to download', len(renames), deleted, new)
+        return {'renamed': 0 if self.dry_run else len(renames), 'deleted': deleted}
+
+    def _rename(self, old: str, task: Dict):
+        new = task['rel_path']
+        if self.dry_run:
+            logging.info('Mirror (dry run): would rename %s -> %s', old, new)
+            self._submit(task)
+            return
+        src = os.path.join(self.local_root, old)
+        dst = os.path.join(self.local_root, new)
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.rename(src, dst)
+        except OSError as e:
+            logging.warning('Mirror: rename %s -> %s failed (%s); downloading instead', old, new, e)
+            self._submit(task)
+            return
+        logging.info('Mirror: renamed %s -> %s', old, new)
+        METRICS.incr('ftp_mirror_renamed')
+        METRICS.incr('ftp_mirror_bytes_saved', self.local[old][0])
+        if self.manifest is not None:
+            entry = self.manifest.get(old)
+            st = os.stat(dst)
+            self.manifest.record(new, st.st_size, epoch(task['mdtm']), st.st_mtime, entry.hash if entry else None)
+            self.manifest.remove(old)
+        self._prune(os.path.dirname(old))
+
+    def _delete(self, rel_path: str) -> int:
+        if self.dry_run:
+            logging.info('Mirror (dry run): would delete %s', rel_path)
+            return 0
+        try:
+            os.remove(os.path.join(self.local_root, rel_path))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning('Mirror: could not delete %s: %s', rel_path, e)
+            return 0
+        logging.info('Mirror: deleted %s', rel_path)
+        METRICS.incr('ftp_mirror_deleted')
+        if self.manifest is not None:
+            self.manifest.remove(rel_path)
+        self._prune(os.path.dirname(rel_path))
+        return 1
+
+    def _prune(self, rel_dir: str):
+        """Remove directories emptied by a rename or delete, up to (not including) the root."""
+        while rel_dir:
+            try:
+                os.rmdir(os.path.join(self.local_root, rel_dir))
+            except OSError:
+                return
+            rel_dir = os.path.dirname(rel_dir)
@@ -0,0 +1,203 @@
+"""Bounded pool of logged-in FTP control connections shared by download workers."""
+import ftplib
+import logging
+import posixpath
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from config import REMOTE_FTP, REMOTE_FILES_PATH, FTP_TIMEOUT, FTP_POOL_NOOP_AFTER
+from metrics import METRICS
+
+
+class PooledFTP(ftplib.FTP):
+    """ftplib.FTP that remembers its working directory and when it was last used."""
+
+    def __init__(self):
+        super().__init__()
+        self.current_dir: Optional[str] = None
+        self.last_used = time.monotonic()
+
+
+def is_connection_error(exc: BaseException) -> bool:
+    """True when ``exc`` leaves the control connection unusable."""
+    if isinstance(exc, ftplib.error_perm):
+        # 5xx replies (missing file, no permission) leave the session intact
+        return False
+    if isinstance(exc, (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError)):
+        # Local filesystem problems
+        return False
+    return isinstance(exc, (ftplib.Error, OSError, EOFError))
+
+
+class FTPConnectionPool:
+    """Reuse at most ``size`` logged-in connections across tasks.
+
+    Idle connections are health-checked with NOOP once they have been idle for
+    FTP_POOL_NOOP_AFTER seconds and transparently replaced when dead. Each
+    connection tracks its working directory so repeated CWDs are skipped.
+    ``throttled()`` lowers the limit when the server refuses more sessions.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(1, size)
+        self.limit = self.size
+        self.root: Optional[str] = None
+        self._slots = threading.Condition()
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._idle: List[PooledFTP] = []
+        self.stats: Dict[str, float] = {
+            'connects': 0,
+            'reconnects': 0,
+            'reuses': 0,
+            'noop_checks': 0,
+            'cwd_sent': 0,
+            'cwd_skipped': 0,
+            'connect_seconds': 0.0,
+        }
+
+    def _count(self, key: str, n: float = 1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _connect(self) -> PooledFTP:
+        started = time.monotonic()
+        conn = PooledFTP()
+        conn.connect(REMOTE_FTP['host'], REMOTE_FTP['port'], timeout=FTP_TIMEOUT)
+        connected = time.monotonic()
+        METRICS.observe('ftp_connect', connected - started)
+        conn.login(REMOTE_FTP['user'], REMOTE_FTP['password'])
+        METRICS.observe('ftp_login', time.monotonic() - connected)
+        if REMOTE_FTP['passive']:
+            conn.set_pasv(True)
+        if self.root is None:
+            # Resolve REMOTE_FILES_PATH once so later CWDs can be absolute
+            conn.cwd(REMOTE_FILES_PATH)
+            self.root = conn.pwd()
+            conn.current_dir = self.root
+        self._count('connects')
+        self._count('connect_seconds', time.monotonic() - started)
+        return conn
+
+    def _alive(self, conn: PooledFTP) -> bool:
+        if time.monotonic() - conn.last_used < FTP_POOL_NOOP_AFTER:
+            return True
+        self._count('noop_checks')
+        try:
+            conn.voidcmd('NOOP')
+            return True
+        except Exception:
+            return False
+
+    def _take_slot(self):
+        with self._slots:
+            while self._in_use >= self.limit:
+                self._slots.wait()
+            self._in_use += 1
+
+    def _give_slot(self):
+        with self._slots:
+            self._in_use -= 1
+            self._slots.notify()
+
+    def acquire(self) -> PooledFTP:
+        self._take_slot()
+        try:
+            while True:
+                with self._lock:
+                    conn = self._idle.pop() if self._idle else None
+                if conn is None:
+                    return self._connect()
+                if self._alive(conn):
+                    self._count('reuses')
+                    return conn
+                self._count('reconnects')
+                self._close(conn)
+        except Exception:
+            self._give_slot()
+            raise
+
+    def release(self, conn: PooledFTP, broken: bool = False):
+        try:
+            if not broken:
+                conn.last_used = time.monotonic()
+                with self._lock:
+                    # Above a lowered limit, idle sessions would still count against the server's cap
+                    keep = self._in_use + len(self._idle) <= self.limit
+                    if keep:
+                        self._idle.append(conn)
+                broken = not keep
+            if broken:
+                self._close(conn)
+        finally:
+            self._give_slot()
+
+    def throttled(self, exc: BaseException):
+        """The server refused another session (421): cap the pool at the sessions open now."""
+        with self._slots:
+            with self._lock:
+                open_now = self._in_use + len(self._idle)
+            new = max(1, min(self.limit - 1, open_now))
+            if new >= self.limit:
+                return
+            logging.warning('Server is limiting connections (%s); FTP connections %d -> %d', exc, self.limit, new)
+            self.limit = new
+        with self._lock:
+            extra = max(0, self._in_use + len(self._idle) - new)
+            surplus, self._idle = self._idle[:extra], self._idle[extra:]
+        for conn in surplus:
+            self._close(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except BaseException as e:
+            broken = is_connection_error(e) or not isinstance(e, Exception)
+            raise
+        finally:
+            self.release(conn, broken)
+
+    def remote_dir(self, rel_dir: str) -> str:
+        """Absolute remote directory for a path relative to REMOTE_FILES_PATH."""
+        root = self.root or REMOTE_FILES_PATH
+        return posixpath.join(root, rel_dir.replace('\\', '/')) if rel_dir else root
+
+    def chdir(self, conn: PooledFTP, rel_dir: str):
+        """CWD into ``rel_dir`` unless the connection is already there."""
+        target = self.remote_dir(rel_dir)
+        if conn.current_dir == target:
+            self._count('cwd_skipped')
+            return
+        conn.current_dir = None
+        conn.cwd(target)
+        conn.current_dir = target
+        self._count('cwd_sent')
+
+    @staticmethod
+    def _close(conn: PooledFTP):
+        try:
+            conn.quit()
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn)
+
+    def log_stats(self):
+        s = self.stats
+        avg = s['connect_seconds'] / s['connects'] if s['connects'] else 0.0
+        logging.info(
+            'FTP pool: connects=%d, reuses=%d, reconnects=%d, noop_checks=%d, cwd_sent=%d, cwd_skipped=%d, avg_connect=%.3fs',
+            s['connects'], s['reuses'], s['reconnects'], s['noop_checks'], s['cwd_sent'], s['cwd_skipped'], avg,
+        )
@@ -0,0 +1,159 @@
+"""Aggregate download progress across all transfer workers.
+
+Transfers only add to a few counters; one background thread renders a
+single summary (files, bytes, bytes/s, ETA) every ``interval`` seconds.
+
+Modes (FTP_PROGRESS):
+
+- ``auto``: a self-overwriting line on stdout when it is a terminal, nothing
+  otherwise (so cron logs stay small);
+- ``log``: a ``logging.info`` line per interval, also when not interactive;
+- ``off``: nothing.
+"""
+import logging
+import sys
+import threading
+import time
+from typing import Optional
+
+# Default render interval (seconds) when FTP_PROGRESS_INTERVAL is 0
+TTY_INTERVAL = 1.0
+LOG_INTERVAL = 30.0
+
+
+def resolve_mode(setting: str, stream=None) -> Optional[str]:
+    """'tty', 'log' or None for an FTP_PROGRESS setting."""
+    setting = (setting or 'auto').lower()
+    if setting == 'log':
+        return 'log'
+    if setting in ('auto', 'tty'):
+        stream = stream if stream is not None else sys.stdout
+        isatty = getattr(stream, 'isatty', None)
+        return 'tty' if isatty is not None and isatty() else None
+    return None
+
+
+def _fmt_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    return f'{h}:{m:02d}:{s:02d}'
+
+
+class ProgressReporter:
+    """Thread-safe progress counters with a fixed-interval renderer.
+
+    ``add(size)`` is called when a file is queued, ``advance(n)`` for every
+    received block, ``skip(n)`` for bytes already present (resume) and
+    ``file_done()`` when a file is in place. Totals may keep growing while
+    listing runs; ``listing_done()`` makes them final and enables the ETA.
+    """
+
+    def __init__(self, mode: Optional[str], interval: float = 0.0, stream=None):
+        self.mode = mode
+        self.interval = interval or (TTY_INTERVAL if mode == 'tty' else LOG_INTERVAL)
+        self.stream = stream if stream is not None else sys.stdout
+        self._lock = threading.Lock()
+        self.files_total = 0
+        self.files_done = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.bytes_skipped = 0
+        self.unknown_sizes = 0
+        self._listing = True
+        self._rate = 0.0
+        self._last_bytes = 0
+        self._last_time = self._started = time.monotonic()
+        self._width = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode is not None
+
+    # -- counters --------------------------------------------------------------
+    def add(self, size: Optional[int]):
+        with self._lock:
+            self.files_total += 1
+            if size is None:
+                self.unknown_sizes += 1
+            else:
+                self.bytes_total += size
+
+    def advance(self, n: int):
+        with self._lock:
+            self.bytes_done += n
+
+    def skip(self, n: int):
+        with self._lock:
+            self.bytes_skipped += n
+
+    def file_done(self):
+        with self._lock:
+            self.files_done += 1
+
+    def listing_done(self):
+        self._listing = False
+
+    # -- rendering ---------------------------------------------------------------
+    def start(self) -> 'ProgressReporter':
+        if self.enabled and self._thread is None:
+            self._last_time = self._started = time.monotonic()
+            self._thread = threading.Thread(target=self._run, name='ftp-progress', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self._emit(self.render(final=True), final=True)
+
+    def __enter__(self) -> 'ProgressReporter':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._emit(self.render())
+
+    def render(self, final: bool = False) -> str:
+        """Current status line; ``final`` reports the average rate over the whole run."""
+        now = time.monotonic()
+        with self._lock:
+            files_done, files_total = self.files_done, self.files_total
+            done = self.bytes_done
+            have = done + self.bytes_skipped
+            total, unknown = self.bytes_total, self.unknown_sizes
+        elapsed = now - self._last_time
+        if final:
+            self._rate = done / (now - self._started) if now > self._started else 0.0
+        elif elapsed > 0:
+            rate = (done - self._last_bytes) / elapsed
+            # Smoothed so one slow interval does not swing the ETA
+            self._rate = rate if not self._rate else 0.3 * rate + 0.7 * self._rate
+            self._last_bytes, self._last_time = done, now
+        mib = 1024 * 1024
+        line = f'Progress: {files_done}/{files_total} files, {have / mib:.1f}/{total / mib:.1f} MiB'
+        if unknown:
+            line += f' (+{unknown} of unknown size)'
+        line += f', {self._rate / mib:.1f} MiB/s'
+        if self._listing:
+            line += ', listing...'
+        elif self._rate > 0 and total > have:
+            line += f', ETA {_fmt_eta((total - have) / self._rate)}'
+        return line
+
+    def _emit(self, line: str, final: bool = False):
+        if self.mode == 'log':
+            logging.info(line)
+            return
+        pad = max(0, self._width - len(line))
+        self._width = len(line)
+        self.stream.write('\r' + line + ' ' * pad + ('\n' if final else ''))
+        self.stream.flush()
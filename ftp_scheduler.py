@@ -0,0 +1,211 @@
+"""Size-aware download scheduling with adaptive concurrency and a bandwidth cap."""
+import bisect
+import ftplib
+import itertools
+import logging
+import re
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Replies that mean "too many connections / try again later"
+THROTTLE_CODES = ('421',)
+# Some servers refuse extra sessions with 530, which otherwise means a failed login
+_LIMIT_530_RE = re.compile(r'too many|maximum|\bmax\b|limit', re.IGNORECASE)
+# Attempts after a throttling reply, each after throttle_backoff() seconds
+THROTTLE_RETRIES = 3
+
+
+def is_throttle_error(exc: BaseException) -> bool:
+    if not isinstance(exc, ftplib.Error):
+        return False
+    reply = str(exc)
+    return reply[:3] in THROTTLE_CODES or (reply[:3] == '530' and bool(_LIMIT_530_RE.search(reply[4:])))
+
+
+def throttle_backoff(attempts: int) -> float:
+    return min(30.0, 2.0 ** attempts)
+
+
+class RateLimiter:
+    """Token bucket shared by every transfer; ``rate`` is in bytes per second."""
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._allowance = float(rate)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, n: int) -> float:
+        """Take ``n`` bytes from the bucket; returns how long the caller should wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= n
+            return -self._allowance / self.rate if self._allowance < 0 else 0.0
+
+    def consume(self, n: int):
+        wait = self.reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+
+
+class DownloadScheduler:
+    """Run download tasks largest-first, with small files filling the other slots.
+
+    Tasks can be submitted while listing is still in progress. Half of the
+    active slots take the largest queued file and the rest take the smallest,
+    so huge files discovered late do not end up running alone at the end.
+    Concurrency starts at ``workers`` and is tuned every ``interval`` seconds by
+    hill-climbing on measured throughput (up to ``max_workers``); replies such
+    as 421 (or a 530 about a connection limit) halve it and the task is requeued
+    to run again after a backoff. Its slot is free while it waits.
+    """
+
+    def __init__(self, run: Callable[[Dict], None], workers: int, max_workers: int,
+                 bandwidth: int = 0, interval: float = 5.0, retries: int = THROTTLE_RETRIES):
+        self._run = run
+        self.max_workers = max(1, max_workers, workers)
+        self.target = max(1, min(workers, self.max_workers))
+        self.interval = interval
+        self.retries = retries
+        self.limiter = RateLimiter(bandwidth) if bandwidth > 0 else None
+        self._cond = threading.Condition()
+        self._queue: List[Tuple[int, int, Dict]] = []  # sorted by (size, seq)
+        self._delayed: List[Tuple[float, int, Dict]] = []  # throttled tasks, sorted by (ready at, seq)
+        self._seq = itertools.count()
+        self._active = 0
+        self._active_large = 0
+        self._closed = False
+        self._bytes = 0
+        self.submitted = 0
+        self.completed = 0
+        self.retries_done = 0
+        self.failures: List[Tuple[Dict, BaseException]] = []
+        self._threads = [
+            threading.Thread(target=self._worker, name=f'ftp-dl-{i}', daemon=True)
+            for i in range(self.max_workers)
+        ]
+        self._monitor = threading.Thread(target=self._adapt, name='ftp-dl-adapt', daemon=True)
+        for t in self._threads:
+            t.start()
+        self._monitor.start()
+
+    # -- called by transfers -------------------------------------------------
+    def meter(self, n: int):
+        """Per-block hook: enforces the bandwidth cap and feeds throughput sampling."""
+        self._bytes += n
+        if self.limiter is not None:
+            self.limiter.consume(n)
+
+    # -- producer side ---------------------------------------------------------
+    def submit(self, task: Dict):
+        with self._cond:
+            self._enqueue(task)
+            self.submitted += 1
+            self._cond.notify()
+
+    def finish(self) -> List[Tuple[Dict, BaseException]]:
+        """No more submissions; wait for the queue to drain and return the failures."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
+        self._monitor.join()
+        return self.failures
+
+    # -- workers ---------------------------------------------------------------
+    def _enqueue(self, task: Dict):
+        size = task.get('size')
+        bisect.insort(self._queue, (size if size is not None else -1, next(self._seq), task))
+
+    def _drained(self) -> bool:
+        return self._closed and not self._queue and not self._delayed and self._active == 0
+
+    def _take(self) -> Optional[Tuple[Dict, bool]]:
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    self._enqueue(self._delayed.pop(0)[2])
+                if self._queue and self._active < self.target:
+                    large = self._active_large < (self.target + 1) // 2
+                    _, _, task = self._queue.pop() if large else self._queue.pop(0)
+                    self._active += 1
+                    self._active_large += large
+                    return task, large
+                if self._drained():
+                    self._cond.notify_all()
+                    return None
+                wait = 1.0 if not self._delayed else min(1.0, self._delayed[0][0] - now)
+                self._cond.wait(timeout=max(0.01, wait))
+
+    def _worker(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+            task, large = item
+            requeue = False
+            try:
+                self._run(task)
+                with self._cond:
+                    self.completed += 1
+            except Exception as e:
+                attempts = task.get('attempts', 0) + 1
+                if is_throttle_error(e) and attempts <= self.retries:
+                    task['attempts'] = attempts
+                    requeue = True
+                    with self._cond:
+                        self.retries_done += 1
+                    self._throttled(e)
+                else:
+                    with self._cond:
+                        self.failures.append((task, e))
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._active_large -= large
+                    if requeue:
+                        # Back off without holding the slot
+                        ready = time.monotonic() + throttle_backoff(task['attempts'])
+                        bisect.insort(self._delayed, (ready, next(self._seq), task))
+                    self._cond.notify_all()
+
+    def _throttled(self, exc: BaseException):
+        with self._cond:
+            new = max(1, self.target // 2)
+            if new != self.target:
+                logging.warning('Server is limiting connections (%s); concurrency %d -> %d', exc, self.target, new)
+                self.target = new
+
+    def _adapt(self):
+        prev_rate = None
+        last_up = False
+        hold = 0
+        last_bytes = self._bytes
+        while True:
+            with self._cond:
+                if self._cond.wait_for(self._drained, timeout=self.interval):
+                    return
+                busy = bool(self._queue)
+            rate = (self._bytes - last_bytes) / self.interval
+            last_bytes = self._bytes
+            if not busy or rate <= 0:
+                continue
+            with self._cond:
+                if last_up and prev_rate and rate < prev_rate * 1.05:
+                    # The extra connection did not help; step back and settle
+                    self.target = max(1, self.target - 1)
+                    last_up = False
+                    hold = 3
+                elif hold:
+                    hold -= 1
+                elif self.target < self.max_workers:
+                    self.target += 1
+                    last_up = True
+                    logging.debug('Download concurrency -> %d (%.1f MiB/s)', self.target, rate / (1024 * 1024))
+                self._cond.notify_all()
+            prev_rate = rate
@@ -1,15 +1,22 @@
 import os
+import argparse
+import ftplib
+import glob
+import posixpath
+import queue
+import signal
 import subprocess
 import logging
 import sys
+import threading
+import time
 from datetime import datetime, timezone
 from ftplib import FTP
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Optional
 from config import (
     REMOTE_DB,
     LOCAL_DB,
-    REMOTE_FILES_PATH,
     LOCAL_FILES_PATH,
     REMOTE_FTP,
     FILTER_EXTENSIONS,
@@ -17,429 +24,1348 @@ from config import (
     RECENT_ONLY,
     RECENT_WINDOW_HOURS,
     FTP_SKIP_UNCHANGED,
-    FTP_TIMEOUT,
+    FTP_VERIFY,
+    FTP_VERIFY_WORKERS,
+    FTP_MIRROR,
+    FTP_MIRROR_DRY_RUN,
+    FTP_MIRROR_MAX_DELETE_PERCENT,
     FTP_USE_MLSD,
+    FTP_MAX_WORKERS,
+    FTP_POOL_SIZE,
+    FTP_LIST_WORKERS,
+    FTP_MAX_DEPTH,
+    FTP_MANIFEST,
+    FTP_MANIFEST_PATH,
+    FTP_LISTING_CACHE,
+    FTP_LISTING_CACHE_PATH,
+    FTP_LISTING_CACHE_MAX_AGE,
+    FTP_RESUME,
+    FTP_BLOCK_SIZE,
+    FTP_SEGMENTED_MIN_SIZE,
+    FTP_SEGMENTS,
+    FTP_WRITE_BUFFER,
+    FTP_PROGRESS,
+    FTP_PROGRESS_INTERVAL,
+    FTP_MAX_WORKERS_LIMIT,
+    FTP_BANDWIDTH_LIMIT,
+    FTP_ENGINE,
+    FTP_ASYNC_CONNECTIONS,
+    DB_STREAM_RESTORE,
+    DB_STREAM_CHUNK_SIZE,
+    DB_STREAM_BUFFER_CHUNKS,
+    DB_STREAM_ARCHIVE_DIR,
+    DB_ARCHIVE,
+    DB_ARCHIVE_DIR,
+    DB_BULK_LOAD,
+    DB_PARALLEL,
+    DB_INCREMENTAL,
+    DB_BINLOG,
+    SYNC_CONCURRENT,
+    DB_PHASE_TIMEOUT,
+    FTP_PHASE_TIMEOUT,
+    SYNC_WATCH_INTERVAL,
+    SYNC_WATCH_FULL_EVERY,
+    SYNC_WATCH_DB_PROBE,
 )
+from db_common import DUMP_FLAGS, mysqldump_command, mysql_command, spawn, run_command, kill_children, drain_stream
+from db_parallel import parallel_copy
+from db_bulk import BulkLoad
+from db_incremental import incremental_copy
+from db_binlog import (
+    BinlogResyncNeeded,
+    DumpCoordinates,
+    catch_up,
+    check_source,
+    load_checkpoint,
+    save_checkpoint,
+    source_data_flag,
+)
+from dump_archive import DumpArchive
+from ftp_pool import FTPConnectionPool, is_connection_error
+from sync_manifest import SyncManifest, epoch
+from ftp_scheduler import DownloadScheduler, RateLimiter, THROTTLE_RETRIES, is_throttle_error, throttle_backoff
+from ftp_async import AsyncSyncEngine, AsyncEngineUnsupported
+from ftp_mirror import FileMirror
+from ftp_listing import ListingCache, list_fallback, mlst_modify
+from ftp_progress import ProgressReporter, resolve_mode
+from ftp_hash import DownloadVerifier, HashMismatch, detect_remote_hash, verify_tree
+from metrics import METRICS, write_reports
+from sync_watch import DatabaseWatch, DirectoryWatch
 
 logging.basicConfig(
     level=logging.INFO,
     format='[%(asctime)s] %(levelname)s: %(message)s'
 )
 
-def run_mysqldump():
-    """Run mysqldump directly against remote MySQL host (needs network access & privileges)."""
+def dump_flags(coords: Optional[DumpCoordinates] = None) -> List[str]:
+    """DUMP_FLAGS, plus the binlog coordinates option when ``coords`` should capture them."""
+    return DUMP_FLAGS + [source_data_flag()] if coords is not None else DUMP_FLAGS
+
+
+def run_mysqldump(coords: Optional[DumpCoordinates] = None):
+    """Run mysqldump directly against remote MySQL host (needs network access & privileges).
+    With ``coords`` the snapshot's binlog coordinates are read from the dump header.
+    """
     dump_file = f"remote_db_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.sql"
-    required = ['host', 'user', 'password', 'database', 'port']
-    missing = [k for k in required if not REMOTE_DB.get(k)]
-    if missing:
-        raise RuntimeError(f"Missing REMOTE_DB config keys: {', '.join(missing)}. Check your .env and config.")
-    cmd = [
-        'mysqldump',
-        f"-h{REMOTE_DB['host']}",
-        f"-P{REMOTE_DB['port']}",
-        f"-u{REMOTE_DB['user']}",
-        f"-p{REMOTE_DB['password']}",
-        '--single-transaction',
-        '--quick',
-        '--routines',
-        '--events',
-        REMOTE_DB['database']
-    ]
+    cmd = mysqldump_command(*dump_flags(coords))
+    snapshot = DumpArchive().writer() if DB_ARCHIVE else None
     logging.info('Starting mysqldump from remote host %s', REMOTE_DB['host'])
-    with open(dump_file, 'wb') as f:
-        result = subprocess.run(cmd, stdout=f, stderr=subprocess.PIPE)
+    try:
+        with METRICS.timer('mysqldump'), open(dump_file, 'wb') as f:
+            if snapshot is None:
+                result = run_command(cmd, stdout=f, stderr=subprocess.PIPE)
+            else:
+                result = _dump_to(cmd, (f, snapshot))
+    except BaseException:
+        if snapshot is not None:
+            snapshot.abort()
+        raise
     if result.returncode != 0:
+        if snapshot is not None:
+            snapshot.abort()
         logging.error('mysqldump failed: %s', result.stderr.decode())
         raise RuntimeError('mysqldump failed')
+    METRICS.incr('db_dump_bytes', os.path.getsize(dump_file))
+    if snapshot is not None:
+        archive_snapshot(snapshot)
+    if coords is not None:
+        coords.feed_file(dump_file)
     logging.info('mysqldump complete: %s', dump_file)
     return dump_file
 
+def _dump_to(cmd: List[str], sinks) -> subprocess.CompletedProcess:
+    """Run mysqldump and copy its output into every file-like object in ``sinks``."""
+    proc = spawn(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    err: List[bytes] = []
+    drain = threading.Thread(target=drain_stream, args=(proc.stderr, err), daemon=True)
+    drain.start()
+    try:
+        for chunk in iter(lambda: proc.stdout.read(DB_STREAM_CHUNK_SIZE), b''):
+            for sink in sinks:
+                sink.write(chunk)
+    except BaseException:
+        _kill(proc)
+        raise
+    finally:
+        rc = proc.wait()
+        drain.join(timeout=5)
+    return subprocess.CompletedProcess(cmd, rc, None, b''.join(err))
+
+
+def archive_snapshot(snapshot):
+    """Publish a completed dump in the archive and apply retention. Failures here
+    are logged but do not fail the database copy, which has already succeeded.
+    """
+    try:
+        with METRICS.timer('db_archive'):
+            snapshot.commit()
+            snapshot.archive.apply_retention()
+    except Exception as e:
+        snapshot.abort()
+        logging.error('Archiving the dump failed: %s', e)
+
 # --- Restore to Local MySQL ---
 def restore_local_mysql(dump_file):
-    required = ['host', 'user', 'password', 'database', 'port']
-    missing = [k for k in required if not LOCAL_DB.get(k)]
-    if missing:
-        raise RuntimeError(f"Missing LOCAL_DB config keys: {', '.join(missing)}. Check your .env and config.")
-    cmd = [
-        'mysql',
-        f"-h{LOCAL_DB['host']}",
-        f"-P{LOCAL_DB['port']}",
-        f"-u{LOCAL_DB['user']}",
-        f"-p{LOCAL_DB['password']}",
-        LOCAL_DB['database']
-    ]
+    bulk = BulkLoad().prepare() if DB_BULK_LOAD else None
+    cmd = mysql_command(bulk.database if bulk is not None else None)
     logging.info('Restoring dump into local database %s', LOCAL_DB['database'])
-    with open(dump_file, 'rb') as f:
-        result = subprocess.run(cmd, stdin=f, stderr=subprocess.PIPE)
-    if result.returncode != 0:
-        logging.error('mysql restore failed: %s', result.stderr.decode())
-        raise RuntimeError('mysql restore failed')
+    try:
+        with METRICS.timer('mysql_restore'), open(dump_file, 'rb') as f:
+            if bulk is None:
+                result = run_command(cmd, stdin=f, stderr=subprocess.PIPE)
+            else:
+                result = _restore_bulk(cmd, f, bulk)
+        if result.returncode != 0:
+            logging.error('mysql restore failed: %s', result.stderr.decode())
+            raise RuntimeError('mysql restore failed')
+        if bulk is not None:
+            bulk.finish()
+    except BaseException:
+        if bulk is not None:
+            bulk.abort()
+        raise
     logging.info('Restore complete')
     os.remove(dump_file)
 
-# --- Sync Files from Remote Server ---
-def sync_files():
-    if not REMOTE_FTP['host']:
-        logging.warning('REMOTE_FTP_HOST not set; skipping file sync')
-        return
-    if not os.path.exists(LOCAL_FILES_PATH):
-        try:
-            os.makedirs(LOCAL_FILES_PATH, exist_ok=True)
-        except PermissionError:
-            logging.error('No write permission to create LOCAL_FILES_PATH: %s', LOCAL_FILES_PATH)
-            logging.error('Change LOCAL_FILES_PATH in .env to a path you own (e.g. ~/lotus-cp/synced_files) or fix permissions.')
-            return
-    if not os.access(LOCAL_FILES_PATH, os.W_OK):
-        logging.error('LOCAL_FILES_PATH is not writable: %s', LOCAL_FILES_PATH)
-        logging.error('Change LOCAL_FILES_PATH in .env or adjust directory permissions (chown/chmod).')
-        return
 
-    def should_download(name: str) -> bool:
-        if not FILTER_EXTENSIONS:
-            return True
-        return any(name.lower().endswith(ext.lower()) for ext in FILTER_EXTENSIONS)
+def _restore_bulk(cmd: List[str], f, bulk: BulkLoad) -> subprocess.CompletedProcess:
+    """Feed a dump file through ``bulk`` into the mysql client."""
+    proc = spawn(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    err: List[bytes] = []
+    drain = threading.Thread(target=drain_stream, args=(proc.stderr, err), daemon=True)
+    drain.start()
+    sent = False
+    try:
+        proc.stdin.write(bulk.preamble())
+        for chunk in iter(lambda: f.read(DB_STREAM_CHUNK_SIZE), b''):
+            proc.stdin.write(bulk.filter(chunk))
+        proc.stdin.write(bulk.epilogue())
+        proc.stdin.close()
+        sent = True
+    except BrokenPipeError:
+        # mysql stopped reading; its exit status and stderr say why
+        _kill(proc)
+    except BaseException:
+        _kill(proc)
+        raise
+    finally:
+        rc = proc.wait()
+        drain.join(timeout=5)
+    if not sent and rc == 0:
+        rc = 1
+    return subprocess.CompletedProcess(cmd, rc, None, b''.join(err))
 
-    def is_directory(ftp_conn: FTP, name: str) -> bool:
-        current = ftp_conn.pwd()
+# --- Stream Dump Straight into Local MySQL ---
+def _kill(proc: subprocess.Popen):
+    if proc.poll() is None:
         try:
-            ftp_conn.cwd(name)
-            ftp_conn.cwd(current)
-            return True
+            proc.kill()
         except Exception:
-            return False
+            pass
 
-    def get_mdtm_datetime(ftp_conn: FTP, name: str):
-        """Return UTC datetime for file via MDTM or None if unsupported."""
-        try:
-            resp = ftp_conn.sendcmd(f"MDTM {name}")  # format: '213 YYYYMMDDHHMMSS'
-            if not resp.startswith('213 '):
-                return None
-            ts = resp.split()[1].strip()
-            # MDTM timestamps are in UTC; return a timezone-aware datetime
-            return datetime.strptime(ts, '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
-        except Exception:
-            return None
 
-    # Use timezone-aware UTC now to avoid deprecation warnings
-    recent_cutoff = datetime.now(timezone.utc)
+def stream_dump_to_local(coords: Optional[DumpCoordinates] = None):
+    """Pipe mysqldump into the local mysql client through a bounded in-memory buffer.
 
-    def is_recent(ftp_conn: FTP, name: str) -> bool:
-        if not RECENT_ONLY:
-            return True
-        mdtm = get_mdtm_datetime(ftp_conn, name)
-        if mdtm is None:
-            # If MDTM unsupported, default to downloading to avoid missing updates
-            return True
-        delta_hours = (recent_cutoff - mdtm).total_seconds() / 3600.0
-        return delta_hours <= RECENT_WINDOW_HOURS
-
-    def get_size(ftp_conn: FTP, name: str):
-        try:
-            return ftp_conn.size(name)
-        except Exception:
-            return None
+    Dump and restore overlap, so wall-clock time is roughly max(dump, restore).
+    The buffer gives backpressure: a slow restore stalls the dump reader instead
+    of growing memory. A failure on either side kills both processes, and a
+    non-zero mysqldump exit never reaches the restore as a clean end of input.
+    With DB_ARCHIVE the stream is also stored as an archive snapshot. With
+    DB_BULK_LOAD only the restore side goes through the bulk-load rewrite.
+    """
+    dump_cmd = mysqldump_command(*dump_flags(coords))
+    bulk = BulkLoad().prepare() if DB_BULK_LOAD else None
+    restore_cmd = mysql_command(bulk.database if bulk is not None else None)
+    snapshot = DumpArchive().writer() if DB_ARCHIVE else None
 
-    def make_progress_writer(file_handle, total_size, label):
-        bytes_written = {'n': 0}
-        last_pct = {'p': -1}
-
-        def cb(data: bytes):
-            file_handle.write(data)
-            bytes_written['n'] += len(data)
-            if total_size and total_size > 0:
-                pct = int(bytes_written['n'] * 100 / total_size)
-                if pct != last_pct['p']:
-                    last_pct['p'] = pct
-                    sys.stdout.write(f"\rDownloading {label}: {pct}% ({bytes_written['n']}/{total_size} bytes)")
-                    sys.stdout.flush()
-            else:
-                # Unknown total size; print in MB every ~1MB
-                if bytes_written['n'] % (1024 * 1024) < len(data):
-                    mb = bytes_written['n'] / (1024 * 1024)
-                    sys.stdout.write(f"\rDownloading {label}: {mb:.1f} MiB")
-                    sys.stdout.flush()
-        return cb, bytes_written, last_pct
-
-    def finish_progress(label):
-        sys.stdout.write(f"\rDownloading {label}: 100%\n")
-        sys.stdout.flush()
-
-    def list_entries(ftp_conn: FTP):
-        """Return list of (name, is_dir, size, mdtm_dt) for current directory.
-        Uses MLSD when available, falling back to NLST + stat calls.
-        """
-        entries = []
-        if FTP_USE_MLSD:
+    logging.info('Streaming mysqldump from %s into local database %s', REMOTE_DB['host'], LOCAL_DB['database'])
+    started = time.monotonic()
+    dump = spawn(dump_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        restore = spawn(restore_cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    except Exception:
+        _kill(dump)
+        dump.wait()
+        if snapshot is not None:
+            snapshot.abort()
+        if bulk is not None:
+            bulk.abort()
+        raise
+
+    buf: 'queue.Queue[Optional[bytes]]' = queue.Queue(maxsize=max(1, DB_STREAM_BUFFER_CHUNKS))
+    failed = threading.Event()
+    errors: List[str] = []
+    dump_err: List[bytes] = []
+    restore_err: List[bytes] = []
+    streamed = {'n': 0}
+
+    def fail(msg: str):
+        errors.append(msg)
+        failed.set()
+
+    def put(item) -> bool:
+        while not failed.is_set():
             try:
-                for name, facts in ftp_conn.mlsd():
-                    if name in ('.', '..'):
-                        continue
-                    typ = (facts.get('type') or '').lower()
-                    is_dir = typ == 'dir'
-                    size = None
-                    mdtm_dt = None
-                    if not is_dir:
-                        if 'size' in facts and str(facts['size']).isdigit():
-                            try:
-                                size = int(facts['size'])
-                            except Exception:
-                                size = None
-                        if 'modify' in facts:
-                            try:
-                                mdtm_dt = datetime.strptime(facts['modify'], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
-                            except Exception:
-                                mdtm_dt = None
-                    entries.append((name, is_dir, size, mdtm_dt))
-                return entries
-            except Exception:
-                # fall back below
-                entries = []
-        # Fallback
-        for name in ftp_conn.nlst():
-            if name in ('.', '..'):
+                buf.put(item, timeout=0.5)
+                return True
+            except queue.Full:
                 continue
-            is_dir = is_directory(ftp_conn, name)
-            if is_dir:
-                entries.append((name, True, None, None))
-            else:
-                entries.append((name, False, get_size(ftp_conn, name), get_mdtm_datetime(ftp_conn, name)))
-        return entries
+        return False
 
-    def download_dir(ftp_conn: FTP, remote_dir: str, local_dir: str):
-        ftp_conn.cwd(remote_dir)
+    def reader():
         try:
-            os.makedirs(local_dir, exist_ok=True)
-        except PermissionError:
-            logging.error('Permission denied creating directory: %s (skipping %s)', local_dir, remote_dir)
-            return
-        for entry, is_dir, size, mdtm_dt in list_entries(ftp_conn):
-            if is_dir:
-                if RECURSIVE_FTP:
-                    download_dir(ftp_conn, entry, os.path.join(local_dir, entry))
-                else:
-                    logging.debug('Skipping directory (recursion disabled): %s/%s', remote_dir, entry)
-            else:
-                name = entry
-                if not should_download(name):
-                    continue
-                # Use known mdtm if available to avoid extra command
-                if RECENT_ONLY and mdtm_dt is not None:
-                    delta_hours = (recent_cutoff - mdtm_dt).total_seconds() / 3600.0
-                    if delta_hours > RECENT_WINDOW_HOURS:
-                        continue
-                elif not is_recent(ftp_conn, name):
-                    continue
-                local_target = os.path.join(local_dir, name)
-                label = f"{remote_dir}/{name}"
-                if FTP_SKIP_UNCHANGED and os.path.exists(local_target) and size is not None:
-                    try:
-                        if os.path.getsize(local_target) == int(size):
-                            logging.debug('Skipping unchanged (size match): %s', label)
-                            continue
-                    except Exception:
-                        pass
-                if size is None:
-                    size = get_size(ftp_conn, name)
-                logging.info('Downloading %s -> %s (%s bytes)', label, local_target, size if size is not None else 'unknown')
+            while not failed.is_set():
+                chunk = dump.stdout.read(DB_STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if coords is not None:
+                    coords.feed(chunk)
+                if not put(chunk):
+                    return
+            if failed.is_set():
+                return
+            rc = dump.wait()
+            if rc != 0:
+                fail(f'mysqldump exited with status {rc}')
+                return
+            put(None)
+        except Exception as e:
+            fail(f'reading mysqldump output failed: {e}')
+
+    def writer():
+        try:
+            if bulk is not None:
+                restore.stdin.write(bulk.preamble())
+            while True:
                 try:
-                    with open(local_target, 'wb') as f:
-                        cb, *_ = make_progress_writer(f, size, label)
-                        ftp_conn.retrbinary(f'RETR {name}', cb)
-                except PermissionError:
-                    logging.error('Permission denied writing file: %s (skipping)', local_target)
+                    chunk = buf.get(timeout=0.5)
+                except queue.Empty:
+                    if failed.is_set():
+                        return
                     continue
-                # Preserve remote modified time when known
-                try:
-                    if mdtm_dt is None:
-                        mdtm_dt = get_mdtm_datetime(ftp_conn, name)
-                    if mdtm_dt is not None:
-                        ts = int(mdtm_dt.timestamp())
-                        os.utime(local_target, (ts, ts))
-                except Exception:
-                    pass
-                finish_progress(label)
-        ftp_conn.cwd('..')
+                if chunk is None:
+                    break
+                restore.stdin.write(bulk.filter(chunk) if bulk is not None else chunk)
+                if snapshot is not None:
+                    snapshot.write(chunk)
+                streamed['n'] += len(chunk)
+            # Clean end of input: let mysql finish and commit
+            if bulk is not None:
+                restore.stdin.write(bulk.epilogue())
+            restore.stdin.close()
+        except Exception as e:
+            fail(f'writing to mysql failed: {e}')
 
-    logging.info('Connecting to FTP %s', REMOTE_FTP['host'])
-    ftp = FTP()
-    ftp.connect(REMOTE_FTP['host'], timeout=FTP_TIMEOUT)
-    ftp.login(REMOTE_FTP['user'], REMOTE_FTP['password'])
-    if REMOTE_FTP['passive']:
-        ftp.set_pasv(True)
-    ftp.cwd(REMOTE_FILES_PATH)
-
-    # Build task list (single connection for listing)
-    tasks: List[Dict] = []
-
-    def collect_tasks_in_dir(cur_remote: str, rel_dir: str = ""):
-        for entry, is_dir, size, mdtm_dt in list_entries(ftp):
-            name = entry
-            if is_dir:
-                if RECURSIVE_FTP:
-                    ftp.cwd(name)
-                    collect_tasks_in_dir(ftp.pwd(), os.path.join(rel_dir, name) if rel_dir else name)
-                    ftp.cwd('..')
-                continue
-            # File filtering
-            if not should_download(name):
-                continue
-            if RECENT_ONLY and mdtm_dt is not None:
-                delta_hours = (recent_cutoff - mdtm_dt).total_seconds() / 3600.0
-                if delta_hours > RECENT_WINDOW_HOURS:
-                    continue
-            elif not is_recent(ftp, name):
-                continue
-            rel_path = os.path.join(rel_dir, name) if rel_dir else name
-            local_target = os.path.join(LOCAL_FILES_PATH, rel_path)
-            # Skip unchanged by size when known
-            if FTP_SKIP_UNCHANGED and size is not None and os.path.exists(local_target):
-                try:
-                    if os.path.getsize(local_target) == int(size):
-                        logging.debug('Skipping unchanged (size match): %s', rel_path)
-                        continue
-                except Exception:
-                    pass
-            tasks.append({
-                'rel_path': rel_path,
-                'name': name,
-                'size': size,
-                'mdtm': mdtm_dt,
-            })
-
-    collect_tasks_in_dir(ftp.pwd(), "")
+    threads = [
+        threading.Thread(target=reader, name='dump-reader', daemon=True),
+        threading.Thread(target=writer, name='restore-writer', daemon=True),
+        threading.Thread(target=drain_stream, args=(dump.stderr, dump_err), daemon=True),
+        threading.Thread(target=drain_stream, args=(restore.stderr, restore_err), daemon=True),
+    ]
+    for t in threads:
+        t.start()
+    pumps = threads[:2]
+    while any(t.is_alive() for t in pumps):
+        if failed.is_set() or (restore.poll() not in (None, 0)):
+            # Abort both sides; a dead restore would otherwise leave the dump blocked
+            _kill(dump)
+            _kill(restore)
+        for t in pumps:
+            t.join(timeout=0.2)
+
+    if not failed.is_set():
+        rc = restore.wait()
+        if rc != 0:
+            fail(f'mysql exited with status {rc}')
+    _kill(dump)
+    _kill(restore)
+    dump.wait()
+    restore.wait()
+    for t in threads[2:]:
+        t.join(timeout=5)
+
+    if failed.is_set():
+        if dump_err:
+            logging.error('mysqldump stderr: %s', b''.join(dump_err).decode(errors='replace').strip())
+        if restore_err:
+            logging.error('mysql stderr: %s', b''.join(restore_err).decode(errors='replace').strip())
+        if snapshot is not None:
+            snapshot.abort()
+        if bulk is not None:
+            bulk.abort()
+        logging.error('Streamed restore failed: %s', '; '.join(errors))
+        raise RuntimeError('streamed restore failed')
+
+    if snapshot is not None:
+        archive_snapshot(snapshot)
+    if bulk is not None:
+        try:
+            bulk.finish()
+        except BaseException:
+            bulk.abort()
+            raise
+    elapsed = time.monotonic() - started
+    METRICS.observe('db_stream_restore', elapsed)
+    METRICS.incr('db_dump_bytes', streamed['n'])
+    logging.info('Streamed restore complete: %.1f MiB in %.1fs', streamed['n'] / (1024 * 1024), elapsed)
+
+# --- Sync Files from Remote Server ---
+def should_download(name: str) -> bool:
+    if not FILTER_EXTENSIONS:
+        return True
+    return any(name.lower().endswith(ext.lower()) for ext in FILTER_EXTENSIONS)
+
+
+def parse_mdtm(ts: str) -> datetime:
+    # MDTM/MLSD timestamps are in UTC; return a timezone-aware datetime
+    return datetime.strptime(ts[:14], '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+
+
+def get_mdtm_datetime(ftp_conn: FTP, name: str):
+    """Return UTC datetime for file via MDTM or None if unsupported."""
     try:
-        ftp.quit()
+        resp = ftp_conn.sendcmd(f"MDTM {name}")  # format: '213 YYYYMMDDHHMMSS'
+        if not resp.startswith('213 '):
+            return None
+        return parse_mdtm(resp.split()[1].strip())
     except Exception:
-        pass
-
-    if not tasks:
-        logging.info('No files to download.')
-        return
+        return None
 
-    def connect_fresh() -> FTP:
-        c = FTP()
-        c.connect(REMOTE_FTP['host'], timeout=FTP_TIMEOUT)
-        c.login(REMOTE_FTP['user'], REMOTE_FTP['password'])
-        if REMOTE_FTP['passive']:
-            c.set_pasv(True)
-        return c
 
-    def ensure_cwd(conn: FTP, rel_dir: str):
-        conn.cwd(REMOTE_FILES_PATH)
-        if rel_dir:
-            for part in rel_dir.strip('/').split('/'):
-                if part:
-                    conn.cwd(part)
+def is_recent(ftp_conn: FTP, name: str, mdtm_dt, cutoff: datetime) -> bool:
+    """RECENT_ONLY filter; uses the listed mdtm when known to avoid an extra MDTM."""
+    if not RECENT_ONLY:
+        return True
+    if mdtm_dt is None and ftp_conn is not None:
+        mdtm_dt = get_mdtm_datetime(ftp_conn, name)
+    if mdtm_dt is None:
+        # If MDTM unsupported, default to downloading to avoid missing updates
+        return True
+    delta_hours = (cutoff - mdtm_dt).total_seconds() / 3600.0
+    return delta_hours <= RECENT_WINDOW_HOURS
 
-    downloaded = skipped = failed = 0
 
-    if FTP_MAX_WORKERS <= 1:
-        # Sequential with progress
-        for t in tasks:
-            rel_dir = os.path.dirname(t['rel_path'])
-            local_target = os.path.join(LOCAL_FILES_PATH, t['rel_path'])
-            try:
-                os.makedirs(os.path.dirname(local_target), exist_ok=True)
-            except PermissionError:
-                logging.error('Permission denied creating directory: %s (skipping)', os.path.dirname(local_target))
-                failed += 1
-                continue
-            try:
-                conn = connect_fresh()
-                ensure_cwd(conn, rel_dir)
-                size = t['size']
-                if size is None:
+def list_entries(ftp_conn: FTP, path: Optional[str] = None):
+    """Return list of (name, is_dir, size, mdtm_dt) for ``path`` (default: current directory).
+    Uses MLSD when available, falling back to LIST + pipelined probes (see ftp_listing).
+    """
+    entries = []
+    if FTP_USE_MLSD:
+        try:
+            for name, facts in (ftp_conn.mlsd(path) if path else ftp_conn.mlsd()):
+                if name in ('.', '..'):
+                    continue
+                typ = (facts.get('type') or '').lower()
+                if typ in ('cdir', 'pdir'):
+                    continue
+                is_dir = typ == 'dir'
+                size = None
+                mdtm_dt = None
+                if not is_dir and 'size' in facts and str(facts['size']).isdigit():
                     try:
-                        size = conn.size(t['name'])
+                        size = int(facts['size'])
                     except Exception:
                         size = None
-                label = t['rel_path']
-                logging.info('Downloading %s -> %s (%s bytes)', label, local_target, size if size is not None else 'unknown')
-                with open(local_target, 'wb') as f:
-                    cb, *_ = make_progress_writer(f, size, label)
-                    conn.retrbinary(f"RETR {t['name']}", cb)
-                # Preserve mtime
-                mdtm_dt = t['mdtm']
-                if mdtm_dt is None:
+                # Directories keep their modify fact too (watch mode change probes)
+                if 'modify' in facts:
                     try:
-                        resp = conn.sendcmd(f"MDTM {t['name']}")
-                        if resp.startswith('213 '):
-                            ts = resp.split()[1].strip()
-                            mdtm_dt = datetime.strptime(ts, '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+                        mdtm_dt = parse_mdtm(facts['modify'])
                     except Exception:
                         mdtm_dt = None
-                if mdtm_dt is not None:
-                    try:
-                        ts = int(mdtm_dt.timestamp())
-                        os.utime(local_target, (ts, ts))
-                    except Exception:
-                        pass
-                finish_progress(label)
-                downloaded += 1
-            except PermissionError:
-                logging.error('Permission denied writing file: %s (skipping)', local_target)
-                failed += 1
+                entries.append((name, is_dir, size, mdtm_dt))
+            return entries
+        except Exception:
+            # fall back below
+            entries = []
+    return list_fallback(ftp_conn, path)
+
+
+def preserve_mtime(conn: FTP, local_target: str, name: str, mdtm_dt):
+    """Set the local mtime to the remote modify time (MDTM when not listed); returns that time."""
+    if mdtm_dt is None and conn is not None:
+        mdtm_dt = get_mdtm_datetime(conn, name)
+    if mdtm_dt is not None:
+        try:
+            ts = int(mdtm_dt.timestamp())
+            os.utime(local_target, (ts, ts))
+        except Exception:
+            pass
+    return mdtm_dt
+
+
+def is_unchanged(manifest: Optional[SyncManifest], rel_path: str, size, mdtm_dt) -> bool:
+    """FTP_SKIP_UNCHANGED check: answered from the manifest without touching the
+    filesystem; only files the manifest does not know yet are stat'ed.
+    """
+    if not FTP_SKIP_UNCHANGED or size is None:
+        return False
+    remote_mtime = epoch(mdtm_dt)
+    if manifest is not None:
+        known = manifest.unchanged(rel_path, int(size), remote_mtime)
+        if known is not None:
+            return known
+    try:
+        st = os.stat(os.path.join(LOCAL_FILES_PATH, rel_path))
+    except OSError:
+        return False
+    if st.st_size != int(size):
+        return False
+    if manifest is not None:
+        if remote_mtime is not None and int(st.st_mtime) != remote_mtime:
+            return False
+        # Adopt a file synced before the manifest existed
+        manifest.record(rel_path, st.st_size, remote_mtime, st.st_mtime)
+    return True
+
+
+def select_file(conn: Optional[FTP], remote_dir: str, rel_dir: str, name: str, size, mdtm_dt,
+                cutoff: datetime, manifest: Optional[SyncManifest] = None,
+                on_listed: Optional[Callable] = None) -> Optional[Dict]:
+    """Apply the download filters to one listed file; returns its task or None.
+    ``on_listed`` sees every file that passes FILTER_EXTENSIONS (mirror mode).
+    """
+    if not should_download(name):
+        METRICS.incr('ftp_skipped_filtered')
+        return None
+    if on_listed is not None:
+        on_listed(os.path.join(rel_dir, name) if rel_dir else name, size, mdtm_dt)
+    if not is_recent(conn, posixpath.join(remote_dir, name), mdtm_dt, cutoff):
+        METRICS.incr('ftp_skipped_not_recent')
+        return None
+    rel_path = os.path.join(rel_dir, name) if rel_dir else name
+    if is_unchanged(manifest, rel_path, size, mdtm_dt):
+        logging.debug('Skipping unchanged: %s', rel_path)
+        METRICS.incr('ftp_skipped_unchanged')
+        return None
+    return {
+        'rel_path': rel_path,
+        'name': name,
+        'size': size,
+        'mdtm': mdtm_dt,
+    }
+
+
+def crawl_remote(pool: FTPConnectionPool, on_file: Callable[[Dict], None],
+                 manifest: Optional[SyncManifest] = None,
+                 on_listed: Optional[Callable] = None,
+                 roots: Optional[List[tuple]] = None,
+                 on_dir: Optional[Callable] = None,
+                 listing: Optional[ListingCache] = None) -> int:
+    """List the remote tree concurrently and hand each file to download to ``on_file``.
+
+    Directories are listed by FTP_LIST_WORKERS threads from a shared work queue,
+    each borrowing a pooled connection per directory and listing it by absolute
+    path (no CWD walking). ``on_file`` is called from the crawler threads as soon
+    as a file passes the filters, so downloads can start while listing goes on.
+    ``roots`` are the (rel_dir, depth) pairs to start from (default: the whole
+    tree); ``on_dir(rel_dir, mdtm)`` sees every subdirectory within the limits
+    and returns whether to descend into it. With a ``listing`` cache, directories
+    whose modify time is unchanged are not listed again; the subdirectories of
+    such a directory get their current modify times from pipelined MLST probes.
+    Returns the number of directories that could not be listed.
+    """
+    # Use timezone-aware UTC now to avoid deprecation warnings
+    recent_cutoff = datetime.now(timezone.utc)
+    work: 'queue.Queue[Optional[tuple]]' = queue.Queue()
+    errors = {'n': 0}
+    lock = threading.Lock()
+    visited = set()
+
+    def list_dir(rel_dir: str, depth: int, modify: Optional[int] = None):
+        remote_dir = pool.remote_dir(rel_dir)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with pool.connection() as conn:
+                    entries = None
+                    if listing is not None:
+                        if modify is None:
+                            modify = mlst_modify(conn, [remote_dir])[0]
+                        entries = listing.lookup(rel_dir, modify)
+                    cached = entries is not None
+                    if cached:
+                        METRICS.incr('ftp_dirs_cached')
+                    else:
+                        with METRICS.timer('ftp_list_dir'):
+                            entries = list_entries(conn, remote_dir)
+                        METRICS.incr('ftp_dirs_listed')
+                        if listing is not None:
+                            listing.store(rel_dir, modify, entries)
+                    METRICS.incr('ftp_entries_listed', len(entries))
+                    for name, is_dir, size, mdtm_dt in entries:
+                        if is_dir:
+                            continue
+                        task = select_file(conn, remote_dir, rel_dir, name, size, mdtm_dt, recent_cutoff,
+                                           manifest, on_listed)
+                        if task is not None:
+                            on_file(task)
+                break
             except Exception as e:
-                logging.error('Failed to download %s: %s', t['rel_path'], e)
-                failed += 1
-            finally:
-                try:
-                    conn.quit()
-                except Exception:
-                    pass
-    else:
-        # Parallel without per-chunk progress (to keep logs readable)
-        def worker(t: Dict):
-            rel_dir = os.path.dirname(t['rel_path'])
-            local_target = os.path.join(LOCAL_FILES_PATH, t['rel_path'])
-            os.makedirs(os.path.dirname(local_target), exist_ok=True)
-            conn = connect_fresh()
+                if is_throttle_error(e) and attempt <= THROTTLE_RETRIES:
+                    # Too many sessions: fewer connections, then try again after a backoff
+                    pool.throttled(e)
+                    METRICS.incr('ftp_retries')
+                    time.sleep(throttle_backoff(attempt))
+                    continue
+                if attempt > 1 or not is_connection_error(e):
+                    logging.error('Failed to list %s: %s', remote_dir, e)
+                    METRICS.incr('ftp_list_errors')
+                    with lock:
+                        errors['n'] += 1
+                    return
+                METRICS.incr('ftp_retries')
+        with lock:
+            visited.add(rel_dir)
+        subdirs = []
+        for name, is_dir, _, mdtm_dt in entries:
+            if not is_dir:
+                continue
+            if not RECURSIVE_FTP:
+                logging.debug('Skipping directory (recursion disabled): %s/%s', remote_dir, name)
+            elif FTP_MAX_DEPTH and depth + 1 > FTP_MAX_DEPTH:
+                logging.debug('Skipping directory (depth limit %d): %s/%s', FTP_MAX_DEPTH, remote_dir, name)
+            else:
+                subdirs.append((os.path.join(rel_dir, name) if rel_dir else name, mdtm_dt))
+        if cached and subdirs:
+            # The cached modify times of the subdirectories are stale; ask for the current ones
             try:
-                ensure_cwd(conn, rel_dir)
-                with open(local_target, 'wb') as f:
-                    conn.retrbinary(f"RETR {t['name']}", f.write)
-                # Preserve mtime
-                mdtm_dt = t['mdtm']
-                if mdtm_dt is None:
-                    try:
-                        resp = conn.sendcmd(f"MDTM {t['name']}")
-                        if resp.startswith('213 '):
-                            ts = resp.split()[1].strip()
-                            mdtm_dt = datetime.strptime(ts, '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
-                    except Exception:
-                        mdtm_dt = None
-                if mdtm_dt is not None:
-                    try:
-                        ts = int(mdtm_dt.timestamp())
-                        os.utime(local_target, (ts, ts))
-                    except Exception:
-                        pass
-                return True
+                with pool.connection() as conn:
+                    probed = mlst_modify(conn, [pool.remote_dir(child) for child, _ in subdirs])
+                subdirs = [(child, datetime.fromtimestamp(m, timezone.utc) if m is not None else None)
+                           for (child, _), m in zip(subdirs, probed)]
+            except Exception as e:
+                logging.debug('MLST probes under %s failed (%s); listing its subdirectories', remote_dir, e)
+                subdirs = [(child, None) for child, _ in subdirs]
+        for child, mdtm_dt in subdirs:
+            if on_dir is None or on_dir(child, mdtm_dt):
+                work.put((child, depth + 1, epoch(mdtm_dt)))
+
+    def crawler():
+        while True:
+            item = work.get()
+            try:
+                if item is None:
+                    return
+                list_dir(*item)
             finally:
+                work.task_done()
+
+    workers = max(1, FTP_LIST_WORKERS if RECURSIVE_FTP else 1)
+    threads = [threading.Thread(target=crawler, name=f'ftp-list-{i}', daemon=True) for i in range(workers)]
+    for t in threads:
+        t.start()
+    for root in roots if roots is not None else [('', 0)]:
+        work.put(root)
+    work.join()
+    for _ in threads:
+        work.put(None)
+    for t in threads:
+        t.join()
+    if listing is not None and roots is None and not errors['n']:
+        listing.prune(visited)
+    return errors['n']
+
+
+def in_mirror_scope(rel_path: str) -> bool:
+    """Whether a local file is covered by the listing (filters, recursion, depth)."""
+    depth = rel_path.count(os.sep)
+    if depth and not RECURSIVE_FTP:
+        return False
+    if FTP_MAX_DEPTH and depth > FTP_MAX_DEPTH:
+        return False
+    return should_download(os.path.basename(rel_path))
+
+
+def part_path(local_target: str, size, mdtm_dt) -> str:
+    """Temporary download path. The remote size and modify time are part of the
+    name, so a leftover .part is only resumed for the same remote version.
+    """
+    if size is None or mdtm_dt is None:
+        return local_target + '.part'
+    return f"{local_target}.{int(size)}-{epoch(mdtm_dt)}.part"
+
+
+def remove_stale_parts(local_target: str, keep: str):
+    for stale in glob.glob(glob.escape(local_target) + '.*part'):
+        if stale != keep:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def resume_offset(part: str, size, mdtm_dt) -> int:
+    """Bytes already in ``part`` that can be continued with REST (0 = start over)."""
+    if not FTP_RESUME or not part.endswith(f"-{epoch(mdtm_dt)}.part") or not os.path.exists(part):
+        return 0
+    offset = os.path.getsize(part)
+    if size is not None and offset >= size:
+        return 0
+    return offset
+
+
+def record_download(t: Dict, local_target: str, mdtm_dt, seconds: float,
+                    manifest: Optional[SyncManifest] = None):
+    st = os.stat(local_target)
+    METRICS.record_download(t['rel_path'], st.st_size, seconds)
+    if manifest is not None:
+        manifest.record(t['rel_path'], st.st_size, epoch(mdtm_dt), st.st_mtime, t.get('hash'))
+
+
+def make_verifier(conn: FTP) -> DownloadVerifier:
+    """FTP_VERIFY: pick the server-side digest command (if any) from FEAT."""
+    try:
+        feat = conn.sendcmd('FEAT')
+    except ftplib.error_perm:
+        feat = ''
+    verifier = DownloadVerifier(detect_remote_hash(feat))
+    logging.info('Verifying downloads with %s (server digest: %s)', verifier.algo,
+                 ' '.join(verifier.remote) if verifier.remote else 'not available')
+    return verifier
+
+
+def finish_verify(verifier: DownloadVerifier, hasher, reply: Optional[str], t: Dict, part: str):
+    """Store the digest on the task, or discard the .part and raise on a server mismatch."""
+    try:
+        t['hash'] = verifier.finish(hasher, reply, t['rel_path'])
+    except HashMismatch:
+        os.remove(part)
+        raise
+
+
+def fetch_segmented(pool: FTPConnectionPool, t: Dict, part: str, size: int,
+                    meter: Optional[Callable[[int], None]] = None):
+    """Fetch byte ranges of one file in parallel over several pooled connections.
+
+    Each segment issues REST <offset> + RETR on its own connection and closes the
+    data channel once its range is complete. Needs a server that allows several
+    simultaneous data connections per login.
+    """
+    rel_dir = os.path.dirname(t['rel_path'])
+    segments = max(2, FTP_SEGMENTS)
+    step = -(-size // segments)
+    ranges = [(off, min(step, size - off)) for off in range(0, size, step)]
+    with open(part, 'wb') as f:
+        f.truncate(size)
+
+    def fetch(offset: int, length: int):
+        conn = pool.acquire()
+        broken = False
+        try:
+            pool.chdir(conn, rel_dir)
+            conn.voidcmd('TYPE I')
+            remaining = length
+            with conn.transfercmd(f"RETR {t['name']}", rest=offset or None) as sock, \
+                    open(part, 'r+b', buffering=FTP_WRITE_BUFFER) as f:
+                f.seek(offset)
+                while remaining > 0:
+                    data = sock.recv(min(FTP_BLOCK_SIZE, remaining))
+                    if not data:
+                        break
+                    f.write(data)
+                    remaining -= len(data)
+                    if meter is not None:
+                        meter(len(data))
+            if remaining:
+                broken = True
+                raise EOFError(f"segment at {offset} ended {remaining} bytes short")
+            try:
+                # 226 for the last range; 426/451 where we closed the data channel early
+                conn.voidresp()
+            except (ftplib.error_temp, ftplib.error_perm):
+                pass
+            except Exception:
+                broken = True
+        except BaseException as e:
+            broken = broken or is_connection_error(e)
+            raise
+        finally:
+            pool.release(conn, broken)
+
+    with ThreadPoolExecutor(max_workers=len(ranges)) as ex:
+        for fut in [ex.submit(fetch, off, length) for off, length in ranges]:
+            fut.result()
+
+
+def chain_meters(*meters: Optional[Callable[[int], None]]) -> Optional[Callable[[int], None]]:
+    """One per-block meter calling every given one (None when there are none)."""
+    meters = tuple(m for m in meters if m is not None)
+    if len(meters) <= 1:
+        return meters[0] if meters else None
+
+    def meter(n: int):
+        for m in meters:
+            m(n)
+    return meter
+
+
+def block_sink(write: Callable[[bytes], int], hasher=None,
+               meter: Optional[Callable[[int], None]] = None) -> Callable[[bytes], None]:
+    """RETR callback for one download: ``write`` plus hashing and metering, with no wrapper when unused."""
+    if hasher is None and meter is None:
+        return write
+    if hasher is None:
+        def sink(data: bytes):
+            write(data)
+            meter(len(data))
+    elif meter is None:
+        def sink(data: bytes):
+            write(data)
+            hasher.update(data)
+    else:
+        def sink(data: bytes):
+            write(data)
+            hasher.update(data)
+            meter(len(data))
+    return sink
+
+
+def download_file(pool: FTPConnectionPool, t: Dict, progress: Optional[ProgressReporter] = None,
+                  manifest: Optional[SyncManifest] = None,
+                  meter: Optional[Callable[[int], None]] = None,
+                  verifier: Optional[DownloadVerifier] = None):
+    """Download one task into a .part file, resuming with REST when possible, then
+    rename it into place. Large files may be fetched as parallel byte ranges.
+    ``meter`` is called with the length of every received block (it should
+    include ``progress.advance`` when progress is shown); with a ``verifier``
+    the blocks are hashed on the way through and checked before the rename.
+    """
+    rel_dir = os.path.dirname(t['rel_path'])
+    local_target = os.path.join(LOCAL_FILES_PATH, t['rel_path'])
+    os.makedirs(os.path.dirname(local_target), exist_ok=True)
+    started = time.monotonic()
+    size = t['size']
+    part = part_path(local_target, size, t['mdtm'])
+    remove_stale_parts(local_target, part)
+
+    segmented = False
+    if FTP_SEGMENTED_MIN_SIZE and size and size >= FTP_SEGMENTED_MIN_SIZE and FTP_SEGMENTS > 1:
+        try:
+            fetch_segmented(pool, t, part, size, meter)
+            segmented = True
+        except Exception as e:
+            # Typically 421/425 when the server refuses extra data connections
+            logging.warning('Segmented download of %s failed (%s); retrying as a single stream', t['rel_path'], e)
+            METRICS.incr('ftp_retries')
+            os.remove(part)
+
+    with pool.connection() as conn:
+        pool.chdir(conn, rel_dir)
+        hasher = None
+        if segmented and verifier is not None:
+            # Ranges arrive out of order, so the assembled file is hashed once
+            hasher = verifier.start(part, size)
+        if not segmented:
+            offset = resume_offset(part, size, t['mdtm'])
+            logging.debug('Downloading %s -> %s (%s bytes)', t['rel_path'], local_target,
+                          size if size is not None else 'unknown')
+            if offset:
+                logging.info('Resuming %s at byte %d', t['rel_path'], offset)
+                METRICS.incr('ftp_resumed')
+                METRICS.incr('ftp_resumed_bytes_saved', offset)
+                if progress is not None:
+                    progress.skip(offset)
+            if verifier is not None:
+                hasher = verifier.start(part, offset)
+            with open(part, 'ab' if offset else 'wb', buffering=FTP_WRITE_BUFFER) as f:
+                conn.retrbinary(f"RETR {t['name']}", block_sink(f.write, hasher, meter),
+                                blocksize=FTP_BLOCK_SIZE, rest=offset or None)
+        if verifier is not None:
+            reply = None
+            cmd = verifier.remote_command(t['name'])
+            if cmd:
                 try:
-                    conn.quit()
-                except Exception:
+                    reply = conn.sendcmd(cmd)
+                except ftplib.error_perm:
                     pass
+            finish_verify(verifier, hasher, reply, t, part)
+        os.replace(part, local_target)
+        mdtm_dt = preserve_mtime(conn, local_target, t['name'], t['mdtm'])
+    record_download(t, local_target, mdtm_dt, time.monotonic() - started, manifest)
+    if progress is not None:
+        progress.file_done()
+
+def make_progress() -> ProgressReporter:
+    return ProgressReporter(resolve_mode(FTP_PROGRESS), FTP_PROGRESS_INTERVAL)
+
+
+def make_mirror(submit: Callable[[Dict], None], manifest: Optional[SyncManifest]) -> Optional[FileMirror]:
+    if not FTP_MIRROR:
+        return None
+    return FileMirror(LOCAL_FILES_PATH, in_mirror_scope, submit, manifest,
+                      dry_run=FTP_MIRROR_DRY_RUN, max_delete_percent=FTP_MIRROR_MAX_DELETE_PERCENT)
+
+
+def log_sync_result(downloaded: int, failed: int, total: int) -> Dict:
+    METRICS.incr('ftp_files_failed', failed)
+    if not total:
+        logging.info('No files to download.')
+    else:
+        logging.info('FTP sync finished: downloaded=%d, failed=%d, total=%d', downloaded, failed, total)
+    return {'downloaded': downloaded, 'failed': failed, 'total': total}
+
+
+def log_verify_result(verifier: DownloadVerifier):
+    METRICS.incr('ftp_hash_checked', verifier.checked)
+    METRICS.incr('ftp_hash_mismatches', verifier.mismatches)
+    if verifier.remote:
+        logging.info('Server digests: %d checked, %d mismatched', verifier.checked, verifier.mismatches)
+
+
+def sync_files_async() -> Dict:
+    """FTP_ENGINE=asyncio: same filters, .part/resume handling and manifest as
+    the thread engine, driven by AsyncSyncEngine. Raises AsyncEngineUnsupported
+    before downloading anything when the server cannot be used this way.
+    """
+    recent_cutoff = datetime.now(timezone.utc)
+    state: Dict[str, Optional[SyncManifest]] = {'manifest': None}
+
+    def on_root(root: str):
+        if FTP_MANIFEST:
+            state['manifest'] = SyncManifest(FTP_MANIFEST_PATH, LOCAL_FILES_PATH, f"{REMOTE_FTP['host']}:{root}")
+            logging.info('Sync manifest: %d known files', len(state['manifest']))
+
+    def select(remote_dir, rel_dir, name, size, mdtm_dt):
+        return select_file(None, remote_dir, rel_dir, name, size, mdtm_dt, recent_cutoff, state['manifest'])
+
+    def prepare(t: Dict):
+        local_target = os.path.join(LOCAL_FILES_PATH, t['rel_path'])
+        os.makedirs(os.path.dirname(local_target), exist_ok=True)
+        part = part_path(local_target, t['size'], t['mdtm'])
+        remove_stale_parts(local_target, part)
+        return part, resume_offset(part, t['size'], t['mdtm'])
+
+    def complete(t: Dict, part: str, seconds: float):
+        local_target = os.path.join(LOCAL_FILES_PATH, t['rel_path'])
+        os.replace(part, local_target)
+        preserve_mtime(None, local_target, t['name'], t['mdtm'])
+        record_download(t, local_target, t['mdtm'], seconds, state['manifest'])
+
+    if FTP_LISTING_CACHE:
+        logging.warning('FTP_LISTING_CACHE is only used by the thread engine; the asyncio engine lists every directory')
+    if FTP_SEGMENTED_MIN_SIZE and FTP_SEGMENTS > 1:
+        logging.warning('Segmented downloads are only used by the thread engine; the asyncio engine fetches files whole')
+    logging.info('Connecting to FTP %s (asyncio engine, %d connections)', REMOTE_FTP['host'], FTP_ASYNC_CONNECTIONS)
+    try:
+        with make_progress() as progress:
+            engine = AsyncSyncEngine(select, prepare, complete, on_root, verify=FTP_VERIFY, progress=progress).run()
+    finally:
+        if state['manifest'] is not None:
+            state['manifest'].close()
+    if engine.verifier is not None:
+        log_verify_result(engine.verifier)
+    for t, e in engine.failures:
+        logging.error('Failed to download %s: %s', t['rel_path'], e)
+    result = log_sync_result(engine.completed, len(engine.failures), engine.submitted)
+    result['list_errors'] = engine.list_errors
+    return result
+
+
+def check_local_files_path() -> bool:
+    if not os.path.exists(LOCAL_FILES_PATH):
+        try:
+            os.makedirs(LOCAL_FILES_PATH, exist_ok=True)
+        except PermissionError:
+            logging.error('No write permission to create LOCAL_FILES_PATH: %s', LOCAL_FILES_PATH)
+            logging.error('Change LOCAL_FILES_PATH in .env to a path you own (e.g. ~/lotus-cp/synced_files) or fix permissions.')
+            return False
+    if not os.access(LOCAL_FILES_PATH, os.W_OK):
+        logging.error('LOCAL_FILES_PATH is not writable: %s', LOCAL_FILES_PATH)
+        logging.error('Change LOCAL_FILES_PATH in .env or adjust directory permissions (chown/chmod).')
+        return False
+    return True
+
+
+def open_manifest(pool: FTPConnectionPool) -> Optional[SyncManifest]:
+    if not FTP_MANIFEST:
+        return None
+    manifest = SyncManifest(FTP_MANIFEST_PATH, LOCAL_FILES_PATH, f"{REMOTE_FTP['host']}:{pool.root}")
+    logging.info('Sync manifest: %d known files', len(manifest))
+    return manifest
+
+
+def open_listing_cache(pool: FTPConnectionPool) -> Optional[ListingCache]:
+    if not FTP_LISTING_CACHE:
+        return None
+    with pool.connection() as conn:
+        supported = FTP_USE_MLSD and DirectoryWatch.supported(conn)
+    if not supported:
+        logging.warning('FTP_LISTING_CACHE needs MLSD and MLST support; listing every directory')
+        return None
+    listing = ListingCache(FTP_LISTING_CACHE_PATH, f"{REMOTE_FTP['host']}:{pool.root}", FTP_LISTING_CACHE_MAX_AGE)
+    logging.info('Listing cache: %d known directories', len(listing))
+    return listing
+
+
+def close_pool(pool: FTPConnectionPool):
+    pool.close()
+    pool.log_stats()
+    for key, value in pool.stats.items():
+        METRICS.incr(f'ftp_pool_{key}', value)
 
-        with ThreadPoolExecutor(max_workers=FTP_MAX_WORKERS) as ex:
-            futures = {ex.submit(worker, t): t for t in tasks}
-            for fut in as_completed(futures):
-                t = futures[fut]
+
+def sync_files():
+    if not REMOTE_FTP['host']:
+        logging.warning('REMOTE_FTP_HOST not set; skipping file sync')
+        return
+    if not check_local_files_path():
+        return
+
+    if FTP_ENGINE == 'asyncio' and FTP_MIRROR:
+        logging.info('FTP_MIRROR is handled by the thread engine; not using the asyncio engine')
+    elif FTP_ENGINE == 'asyncio':
+        try:
+            return sync_files_async()
+        except AsyncEngineUnsupported as e:
+            logging.warning('asyncio FTP engine not usable (%s); using the thread engine', e)
+
+    logging.info('Connecting to FTP %s', REMOTE_FTP['host'])
+    pool = FTPConnectionPool(FTP_POOL_SIZE)
+    manifest = listing = None
+    try:
+        # Resolve the remote root before the crawler starts building absolute paths
+        pool.release(pool.acquire())
+        manifest = open_manifest(pool)
+        listing = open_listing_cache(pool)
+        return transfer_files(pool, manifest, listing=listing)
+    finally:
+        if manifest is not None:
+            manifest.close()
+        if listing is not None:
+            listing.close()
+        close_pool(pool)
+
+
+def transfer_files(pool: FTPConnectionPool, manifest: Optional[SyncManifest],
+                   crawl: Optional[Callable] = None, allow_mirror: bool = True,
+                   listing: Optional[ListingCache] = None) -> Dict:
+    """List and download with the thread engine over an open pool.
+
+    ``crawl(on_file, on_listed)`` lists the remote side and returns its error
+    count (default: crawl_remote over the whole tree, with the ``listing``
+    cache). Mirror mode needs the whole tree, so partial crawls pass
+    ``allow_mirror=False``.
+    """
+    if crawl is None:
+        def crawl(on_file, on_listed):
+            return crawl_remote(pool, on_file, manifest, on_listed, listing=listing)
+
+    def new_mirror(submit: Callable[[Dict], None]) -> Optional[FileMirror]:
+        return make_mirror(submit, manifest) if allow_mirror else None
+
+    verifier = None
+    if FTP_VERIFY:
+        with pool.connection() as conn:
+            verifier = make_verifier(conn)
+    downloaded = failed = total = 0
+    progress = make_progress()
+    advance = progress.advance if progress.enabled else None
+
+    if FTP_MAX_WORKERS <= 1:
+        # Sequential: list everything first, then download one file at a time
+        limiter = RateLimiter(FTP_BANDWIDTH_LIMIT) if FTP_BANDWIDTH_LIMIT > 0 else None
+        meter = chain_meters(limiter.consume if limiter else None, advance)
+        tasks: List[Dict] = []
+        mirror = new_mirror(tasks.append)
+        errors = crawl(mirror.on_file if mirror else tasks.append, mirror.listed if mirror else None)
+        if mirror is not None:
+            mirror.finish(errors)
+        total = len(tasks)
+        for t in tasks:
+            progress.add(t['size'])
+        progress.listing_done()
+        with progress:
+            for t in tasks:
                 try:
-                    ok = fut.result()
-                    if ok:
-                        downloaded += 1
-                except Exception as e:
+                    download_file(pool, t, progress, manifest, meter, verifier)
+                    downloaded += 1
+                except PermissionError:
+                    logging.error('Permission denied writing file: %s (skipping)', os.path.join(LOCAL_FILES_PATH, t['rel_path']))
                     failed += 1
+                except Exception as e:
                     logging.error('Failed to download %s: %s', t['rel_path'], e)
+                    failed += 1
+    else:
+        # Parallel: downloads start while the crawler is still listing, largest first
+        def run(t: Dict):
+            # Throttling replies are handled by the scheduler, which lowers its concurrency
+            download_file(pool, t, progress, manifest, meter, verifier)
 
-    logging.info('FTP sync finished: downloaded=%d, failed=%d, total=%d', downloaded, failed, len(tasks))
+        def submit(t: Dict):
+            progress.add(t['size'])
+            scheduler.submit(t)
+
+        scheduler = DownloadScheduler(
+            run,
+            workers=FTP_MAX_WORKERS,
+            max_workers=FTP_MAX_WORKERS_LIMIT,
+            bandwidth=FTP_BANDWIDTH_LIMIT,
+        )
+        meter = chain_meters(scheduler.meter, advance)
+        progress.start()
+        try:
+            mirror = new_mirror(submit)
+            errors = crawl(mirror.on_file if mirror else submit, mirror.listed if mirror else None)
+            if mirror is not None:
+                mirror.finish(errors)
+            progress.listing_done()
+        finally:
+            failures = scheduler.finish()
+            progress.stop()
+        total = scheduler.submitted
+        downloaded = scheduler.completed
+        failed = len(failures)
+        METRICS.incr('ftp_retries', scheduler.retries_done)
+        for t, e in failures:
+            logging.error('Failed to download %s: %s', t['rel_path'], e)
 
-def main():
-    dump_file = run_mysqldump()
-    restore_local_mysql(dump_file)
-    sync_files()
-    logging.info('All tasks complete.')
+    if verifier is not None:
+        log_verify_result(verifier)
+    result = log_sync_result(downloaded, failed, total)
+    result['list_errors'] = errors
+    return result
+
+def binlog_copy():
+    """DB_BINLOG: apply the remote binlog since the checkpoint; take a full dump
+    (recording its binlog coordinates as the new checkpoint) when that is not possible.
+    """
+    check_source()
+    position = load_checkpoint()
+    if position is not None:
+        try:
+            catch_up(position)
+            return
+        except BinlogResyncNeeded as e:
+            logging.warning('Binlog replication needs a full copy: %s', e)
+    else:
+        logging.info('Binlog replication: no checkpoint yet; taking a full copy')
+    coords = DumpCoordinates()
+    if DB_STREAM_RESTORE:
+        stream_dump_to_local(coords)
+    else:
+        restore_local_mysql(run_mysqldump(coords))
+    if coords.position is None:
+        raise RuntimeError('the dump has no binlog coordinates; check that binary logging is on and the user has RELOAD')
+    save_checkpoint(coords.position)
+    logging.info('Binlog replication starts at %s:%d', *coords.position)
+
+
+def copy_database():
+    if DB_STREAM_ARCHIVE_DIR:
+        logging.warning('DB_STREAM_ARCHIVE_DIR is deprecated; dumps are kept with DB_ARCHIVE in %s', DB_ARCHIVE_DIR)
+    if not DB_BINLOG and (DB_INCREMENTAL or DB_PARALLEL):
+        ignored = [name for name, on in (('DB_BULK_LOAD', DB_BULK_LOAD), ('DB_ARCHIVE', DB_ARCHIVE)) if on]
+        if ignored:
+            logging.warning('%s copies tables without a dump; ignoring %s',
+                            'DB_INCREMENTAL' if DB_INCREMENTAL else 'DB_PARALLEL', ' and '.join(ignored))
+    if DB_BINLOG:
+        binlog_copy()
+    elif DB_INCREMENTAL:
+        incremental_copy()
+    elif DB_PARALLEL:
+        parallel_copy()
+    elif DB_STREAM_RESTORE:
+        stream_dump_to_local()
+    else:
+        dump_file = run_mysqldump()
+        restore_local_mysql(dump_file)
+
+def run_phases(phases: List[tuple], concurrent: bool) -> List[Dict]:
+    """Run (name, func, timeout) phases and return one result dict per phase.
+
+    Concurrently, every phase runs in its own thread and a failure in one does
+    not stop the others; sequentially, the run stops at the first failure. A
+    phase that exceeds its timeout (seconds, 0 = none) is reported as 'timeout'
+    and its mysqldump/mysql children are killed. A phase returning a dict with
+    a non-zero 'failed' or 'list_errors' count is reported as 'partial'.
+    """
+    results = [{'phase': name, 'status': 'skipped', 'seconds': 0.0} for name, _, _ in phases]
+
+    def run(res: Dict, func: Callable):
+        started = time.monotonic()
+        res['status'] = 'running'
+        try:
+            out = func()
+            incomplete = isinstance(out, dict) and (out.get('failed') or out.get('list_errors'))
+            res['status'] = 'partial' if incomplete else 'ok'
+        except Exception as e:
+            logging.error('Phase %s failed: %s', res['phase'], e)
+            res['status'] = 'failed'
+            res['error'] = str(e)
+        finally:
+            res['seconds'] = round(time.monotonic() - started, 3)
+
+    def wait(res: Dict, thread: threading.Thread, deadline: Optional[float]):
+        thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if thread.is_alive():
+            logging.error('Phase %s timed out', res['phase'])
+            res['status'] = 'timeout'
+            res['seconds'] = round(time.monotonic() - res['started'], 3)
+            if res['phase'] == 'database':
+                kill_children()
+
+    started = []
+    for res, (name, func, timeout) in zip(results, phases):
+        thread = threading.Thread(target=run, args=(res, func), name=f'phase-{name}', daemon=True)
+        res['started'] = time.monotonic()
+        thread.start()
+        deadline = res['started'] + timeout if timeout else None
+        if concurrent:
+            started.append((res, thread, deadline))
+            continue
+        wait(res, thread, deadline)
+        if res['status'] in ('failed', 'timeout'):
+            break
+    for res, thread, deadline in started:
+        wait(res, thread, deadline)
+    for res in results:
+        res.pop('started', None)
+    return results
+
+
+def watch_files_open(state: Dict):
+    """Connect the long-lived FTP pool, manifest and directory cache for watch mode."""
+    if not check_local_files_path():
+        raise RuntimeError(f'LOCAL_FILES_PATH is not usable: {LOCAL_FILES_PATH}')
+    logging.info('Connecting to FTP %s', REMOTE_FTP['host'])
+    pool = FTPConnectionPool(FTP_POOL_SIZE)
+    try:
+        pool.release(pool.acquire())
+        with pool.connection() as conn:
+            probes = FTP_USE_MLSD and DirectoryWatch.supported(conn)
+        manifest = open_manifest(pool)
+    except Exception:
+        pool.close()
+        raise
+    if not probes:
+        logging.warning('Watch: no MLST support (or FTP_USE_MLSD=false); every cycle lists the whole tree')
+    state.update(pool=pool, manifest=manifest, dirs=DirectoryWatch(pool, FTP_LIST_WORKERS) if probes else None)
+
+
+def watch_files_close(state: Dict):
+    if state.get('manifest') is not None:
+        state['manifest'].close()
+    if state.get('pool') is not None:
+        close_pool(state['pool'])
+    state.clear()
+
+
+def watch_files_plan(state: Dict, full: bool) -> Optional[Callable[[], Dict]]:
+    """Probe the FTP side; returns the file phase to run, or None when nothing changed."""
+    if not state:
+        watch_files_open(state)
+    pool, manifest, dirs = state['pool'], state['manifest'], state['dirs']
+    if dirs is None:
+        return lambda: transfer_files(pool, manifest)
+    if full or not dirs.complete:
+        def full_sync() -> Dict:
+            dirs.begin(full=True)
+            dirs.stage_root()
+            result = transfer_files(pool, manifest, lambda on_file, on_listed: crawl_remote(
+                pool, on_file, manifest, on_listed, on_dir=dirs.seen))
+            dirs.commit(ok=not result['list_errors'])
+            logging.info('Watch: %d remote directories cached', len(dirs.dirs))
+            return result
+        return full_sync
+
+    dirs.begin(full=False)
+    roots, probe_errors = dirs.probe()
+    if not roots:
+        dirs.commit(ok=not probe_errors)
+        return None
+    logging.info('Watch: %d changed remote director(ies)', len(roots))
+
+    def delta_sync() -> Dict:
+        # Mirror deletions need the whole tree; they happen on full resyncs
+        result = transfer_files(pool, manifest, lambda on_file, on_listed: crawl_remote(
+            pool, on_file, manifest, on_listed, roots=roots, on_dir=dirs.discovered), allow_mirror=False)
+        dirs.commit(ok=not probe_errors and not result['list_errors'])
+        return result
+    return delta_sync
+
+
+def watch() -> int:
+    """--watch: keep running and apply remote changes every SYNC_WATCH_INTERVAL seconds.
+
+    The FTP pool, the sync manifest, the remote directory cache and the
+    database probe connection stay open between cycles. A cycle first probes
+    both sides (see sync_watch) and runs only the phases with changes; the
+    first cycle and one every SYNC_WATCH_FULL_EVERY seconds are full syncs.
+    Each cycle that ran a phase writes its own run report. Stops on SIGINT/SIGTERM.
+    """
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    use_db = bool(REMOTE_DB['host'])
+    use_files = bool(REMOTE_FTP['host'])
+    db_watch = DatabaseWatch(SYNC_WATCH_DB_PROBE) if use_db and SYNC_WATCH_DB_PROBE != 'off' else None
+    files: Dict = {}
+    last_full: Optional[float] = None
+    db_retry = False
+    logging.info('Watch mode: probing every %ds, full resync every %s', SYNC_WATCH_INTERVAL,
+                 f'{SYNC_WATCH_FULL_EVERY}s' if SYNC_WATCH_FULL_EVERY else 'start only')
+    try:
+        while not stop.is_set():
+            started = time.monotonic()
+            full = last_full is None or bool(SYNC_WATCH_FULL_EVERY and started - last_full >= SYNC_WATCH_FULL_EVERY)
+            if full:
+                last_full = started
+            phases = []
+            db_sig = None
+            if use_db:
+                if db_watch is not None:
+                    changed, db_sig = db_watch.changed()
+                else:
+                    changed = db_retry
+                if full or changed:
+                    phases.append(('database', copy_database, DB_PHASE_TIMEOUT))
+            if use_files:
+                try:
+                    file_phase = watch_files_plan(files, full)
+                except Exception as e:
+                    logging.error('Watch: FTP probe failed: %s', e)
+                    watch_files_close(files)
+                    file_phase = None
+                if file_phase is not None:
+                    phases.append(('files', file_phase, FTP_PHASE_TIMEOUT))
+
+            if phases:
+                results = run_phases(phases, concurrent=SYNC_CONCURRENT)
+                logging.info('Watch cycle (%s): %s', 'full' if full else 'changes', ', '.join(
+                    f"{r['phase']}={r['status']} ({r['seconds']:.1f}s)" for r in results))
+                write_reports(METRICS, results)
+                METRICS.reset()
+                status = {r['phase']: r['status'] for r in results}
+                if 'database' in status:
+                    # Failed copies are retried: the signature is only recorded after a good one
+                    db_retry = status['database'] != 'ok'
+                    if db_watch is not None and not db_retry:
+                        db_watch.commit(db_sig)
+                if 'timeout' in status.values():
+                    # A timed-out phase thread cannot be stopped; let the supervisor restart us
+                    logging.error('Watch: a phase timed out; exiting')
+                    logging.shutdown()
+                    os._exit(1)
+            stop.wait(max(0.0, SYNC_WATCH_INTERVAL - (time.monotonic() - started)))
+    finally:
+        watch_files_close(files)
+        if db_watch is not None:
+            db_watch.close()
+    logging.info('Watch mode stopped.')
+    return 0
+
+
+def verify_local_files() -> int:
+    """--verify: re-hash LOCAL_FILES_PATH against the sync manifest."""
+    if not os.path.exists(FTP_MANIFEST_PATH):
+        logging.error('No sync manifest at %s; nothing to verify', FTP_MANIFEST_PATH)
+        return 1
+    manifest = SyncManifest(FTP_MANIFEST_PATH, LOCAL_FILES_PATH, None)
+    try:
+        logging.info('Verifying %d files in %s with %d processes', len(manifest), LOCAL_FILES_PATH, FTP_VERIFY_WORKERS)
+        with METRICS.timer('ftp_verify'):
+            problems = verify_tree(manifest, LOCAL_FILES_PATH, FTP_VERIFY_WORKERS)
+    finally:
+        manifest.close()
+    for rel_path, problem in sorted(problems.items()):
+        logging.warning('Verify: %s: %s', rel_path, problem)
+    if problems:
+        logging.warning('Verify: %d file(s) failed and will be downloaded again on the next sync', len(problems))
+    else:
+        logging.info('Verify: all files match')
+    return 1 if problems else 0
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description='Copy the remote database and files to this machine.')
+    parser.add_argument('--verify', action='store_true',
+                        help='re-hash the local files against the sync manifest instead of syncing')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running and apply remote changes every SYNC_WATCH_INTERVAL seconds')
+    args = parser.parse_args(argv)
+    if args.verify:
+        return verify_local_files()
+    if args.watch:
+        return watch()
+
+    phases = [
+        ('database', copy_database, DB_PHASE_TIMEOUT),
+        ('files', sync_files, FTP_PHASE_TIMEOUT),
+    ]
+    results = run_phases(phases, concurrent=SYNC_CONCURRENT)
+    logging.info('Phase summary: %s', ', '.join(
+        f"{r['phase']}={r['status']} ({r['seconds']:.1f}s)" for r in results))
+    write_reports(METRICS, results)
+    exit_code = 0 if all(r['status'] == 'ok' for r in results) else 1
+    if exit_code == 0:
+        logging.info('All tasks complete.')
+    if any(r['status'] == 'timeout' for r in results):
+        # A timed-out phase thread cannot be stopped; exit without joining it
+        logging.shutdown()
+        os._exit(exit_code)
+    return exit_code
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
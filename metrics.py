@@ -0,0 +1,177 @@
+"""Per-run performance metrics, written as a JSON report and a Prometheus textfile.
+
+All instrumentation goes through the module-level ``METRICS`` object:
+counters (bytes, files, retries, skips), timings (count/total/min/max seconds
+per operation) and per-phase results. ``write_reports()`` is called once at
+the end of a run.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from config import SYNC_REPORT_DIR, SYNC_REPORT_KEEP, SYNC_PROMETHEUS_TEXTFILE
+
+PROM_PREFIX = 'lotus_sync'
+# Slowest downloads kept in the JSON report
+SLOWEST_DOWNLOADS = 20
+
+
+class RunMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+        self.counters: Dict[str, float] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self.phases: List[Dict] = []
+        self.slowest: List[Dict] = []
+
+    def reset(self):
+        """Start a new run (watch mode reports every cycle separately)."""
+        with self._lock:
+            self.started_at = datetime.now(timezone.utc)
+            self.counters = {}
+            self.timings = {}
+            self.phases = []
+            self.slowest = []
+
+    def incr(self, name: str, n: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            t = self.timings.get(name)
+            if t is None:
+                self.timings[name] = {'count': 1, 'total': seconds, 'min': seconds, 'max': seconds}
+            else:
+                t['count'] += 1
+                t['total'] += seconds
+                t['min'] = min(t['min'], seconds)
+                t['max'] = max(t['max'], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started)
+
+    def record_download(self, rel_path: str, nbytes: int, seconds: float):
+        self.incr('ftp_files_downloaded')
+        self.incr('ftp_bytes_downloaded', nbytes)
+        self.observe('ftp_download', seconds)
+        with self._lock:
+            self.slowest.append({
+                'rel_path': rel_path,
+                'bytes': nbytes,
+                'seconds': round(seconds, 3),
+                'bytes_per_second': round(nbytes / seconds) if seconds > 0 else None,
+            })
+            if len(self.slowest) > SLOWEST_DOWNLOADS * 4:
+                self._trim()
+
+    def _trim(self):
+        self.slowest.sort(key=lambda d: d['seconds'], reverse=True)
+        del self.slowest[SLOWEST_DOWNLOADS:]
+
+    def report(self) -> Dict:
+        with self._lock:
+            self._trim()
+            timings = {
+                k: {**v, 'avg': v['total'] / v['count']} for k, v in sorted(self.timings.items())
+            }
+            downloaded = self.counters.get('ftp_bytes_downloaded', 0)
+            dl_seconds = sum(p['seconds'] for p in self.phases if p['phase'] == 'files')
+            return {
+                'started_at': self.started_at.isoformat(),
+                'finished_at': datetime.now(timezone.utc).isoformat(),
+                'phases': list(self.phases),
+                'counters': dict(sorted(self.counters.items())),
+                'timings': timings,
+                'ftp_throughput_bytes_per_second': round(downloaded / dl_seconds) if dl_seconds else None,
+                'slowest_downloads': list(self.slowest),
+            }
+
+    def prometheus(self, report: Dict) -> str:
+        def name(s: str) -> str:
+            return PROM_PREFIX + '_' + re.sub(r'[^a-zA-Z0-9_]', '_', s)
+
+        lines = [
+            f'# HELP {PROM_PREFIX}_last_run_timestamp_seconds Unix time the last sync run finished.',
+            f'# TYPE {PROM_PREFIX}_last_run_timestamp_seconds gauge',
+            f'{PROM_PREFIX}_last_run_timestamp_seconds {time.time():.0f}',
+            f'# HELP {PROM_PREFIX}_phase_duration_seconds Duration of each phase of the last run.',
+            f'# TYPE {PROM_PREFIX}_phase_duration_seconds gauge',
+        ]
+        for p in report['phases']:
+            lines.append(f'{PROM_PREFIX}_phase_duration_seconds{{phase="{p["phase"]}"}} {p["seconds"]}')
+        lines += [
+            f'# HELP {PROM_PREFIX}_phase_success Whether each phase of the last run succeeded (1) or not (0).',
+            f'# TYPE {PROM_PREFIX}_phase_success gauge',
+        ]
+        for p in report['phases']:
+            lines.append(f'{PROM_PREFIX}_phase_success{{phase="{p["phase"]}"}} {1 if p["status"] == "ok" else 0}')
+        for key, value in report['counters'].items():
+            text = f'{value:.0f}' if float(value).is_integer() else f'{value:.6f}'
+            lines += [f'# TYPE {name(key)} gauge', f'{name(key)} {text}']
+        lines += [
+            f'# HELP {PROM_PREFIX}_operation_seconds_total Total time spent per operation in the last run.',
+            f'# TYPE {PROM_PREFIX}_operation_seconds_total gauge',
+        ]
+        for key, t in report['timings'].items():
+            lines.append(f'{PROM_PREFIX}_operation_seconds_total{{operation="{key}"}} {t["total"]:.6f}')
+        lines += [f'# TYPE {PROM_PREFIX}_operation_count gauge']
+        for key, t in report['timings'].items():
+            lines.append(f'{PROM_PREFIX}_operation_count{{operation="{key}"}} {t["count"]}')
+        lines += [f'# TYPE {PROM_PREFIX}_operation_max_seconds gauge']
+        for key, t in report['timings'].items():
+            lines.append(f'{PROM_PREFIX}_operation_max_seconds{{operation="{key}"}} {t["max"]:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+def _atomic_write(path: str, text: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        fh.write(text)
+    os.replace(tmp, path)
+
+
+def _prune_reports(directory: str, keep: int):
+    """Delete all but the newest ``keep`` run reports (their names sort by time)."""
+    if keep <= 0:
+        return
+    reports = sorted(n for n in os.listdir(directory) if n.startswith('run_') and n.endswith('.json'))
+    for name in reports[:-keep]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError as e:
+            logging.warning('Could not delete old run report %s: %s', name, e)
+
+
+def write_reports(metrics: 'RunMetrics', phases: List[Dict]) -> Optional[str]:
+    """Write the JSON run report (and the Prometheus textfile when configured)."""
+    metrics.phases = phases
+    report = metrics.report()
+    path = None
+    try:
+        if SYNC_REPORT_DIR:
+            path = os.path.join(SYNC_REPORT_DIR, f"run_{metrics.started_at.strftime('%Y%m%d_%H%M%S')}.json")
+            _atomic_write(path, json.dumps(report, indent=2))
+            logging.info('Run report written to %s', path)
+            _prune_reports(SYNC_REPORT_DIR, SYNC_REPORT_KEEP)
+        if SYNC_PROMETHEUS_TEXTFILE:
+            _atomic_write(SYNC_PROMETHEUS_TEXTFILE, metrics.prometheus(report))
+    except OSError as e:
+        logging.error('Failed to write run report: %s', e)
+    return path
+
+
+METRICS = RunMetrics()
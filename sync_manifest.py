@@ -0,0 +1,103 @@
+"""Persistent record of what has been synced into LOCAL_FILES_PATH.
+
+Maps rel_path -> (size, remote modify time, local mtime, optional hash) in a
+SQLite database. The whole table is loaded into memory when opened, so the
+skip check during listing is a dict lookup with no filesystem stat. Every
+successful download is written in its own transaction, so an interrupted run
+never leaves an entry for a file that was not fully written.
+"""
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, NamedTuple, Optional, Tuple
+
+
+class ManifestEntry(NamedTuple):
+    size: Optional[int]
+    remote_mtime: Optional[int]  # epoch seconds, UTC
+    local_mtime: Optional[float]
+    hash: Optional[str]
+
+
+def epoch(dt: Optional[datetime]) -> Optional[int]:
+    return int(dt.timestamp()) if dt is not None else None
+
+
+class SyncManifest:
+    """``remote_root=None`` opens an existing manifest as-is (no scope check)."""
+
+    def __init__(self, path: str, local_root: str, remote_root: Optional[str]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'rel_path TEXT PRIMARY KEY, size INTEGER, remote_mtime INTEGER, local_mtime REAL, hash TEXT)'
+        )
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        # A manifest only describes one local tree / remote root pair
+        scope = f'{os.path.abspath(local_root)}|{remote_root}'
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'scope'").fetchone()
+        if remote_root is not None and (row is None or row[0] != scope):
+            if row is not None:
+                logging.info('Sync manifest scope changed (%s -> %s); starting a new manifest', row[0], scope)
+            self._db.execute('BEGIN')
+            self._db.execute('DELETE FROM files')
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('scope', ?)", (scope,))
+            self._db.execute('COMMIT')
+        self._entries: Dict[str, ManifestEntry] = {
+            r[0]: ManifestEntry(*r[1:])
+            for r in self._db.execute('SELECT rel_path, size, remote_mtime, local_mtime, hash FROM files')
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, rel_path: str) -> Optional[ManifestEntry]:
+        return self._entries.get(rel_path)
+
+    def items(self) -> Iterator[Tuple[str, ManifestEntry]]:
+        return iter(list(self._entries.items()))
+
+    def unchanged(self, rel_path: str, size: Optional[int], remote_mtime: Optional[int]) -> Optional[bool]:
+        """True/False when the manifest knows ``rel_path``, None when it does not."""
+        entry = self._entries.get(rel_path)
+        if entry is None:
+            return None
+        if size is None or entry.size != size:
+            return False
+        if remote_mtime is not None and entry.remote_mtime is not None:
+            return entry.remote_mtime == remote_mtime
+        return True
+
+    def record(self, rel_path: str, size: Optional[int], remote_mtime: Optional[int],
+               local_mtime: Optional[float], hash: Optional[str] = None):
+        entry = ManifestEntry(size, remote_mtime, local_mtime, hash)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO files (rel_path, size, remote_mtime, local_mtime, hash) VALUES (?, ?, ?, ?, ?)',
+                (rel_path, *entry),
+            )
+            self._entries[rel_path] = entry
+
+    def invalidate(self, rel_path: str):
+        """Keep the entry but make ``unchanged()`` false, so the file is fetched again."""
+        entry = self._entries.get(rel_path)
+        if entry is not None:
+            self.record(rel_path, None, entry.remote_mtime, entry.local_mtime, None)
+
+    def remove(self, rel_path: str):
+        with self._lock:
+            self._db.execute('DELETE FROM files WHERE rel_path = ?', (rel_path,))
+            self._entries.pop(rel_path, None)
+
+    def close(self):
+        with self._lock:
+            try:
+                self._db.close()
+            except Exception:
+                pass
@@ -0,0 +1,263 @@
+"""Cheap change probes for watch mode (``python main.py --watch``).
+
+FTP: every directory seen by a listing is remembered with its MLSD ``modify``
+fact. A probe sends one MLST per known directory over the pooled control
+connections (no data connections, no listings) and returns the directories
+whose modify time changed or that disappeared; only those are listed again.
+A directory's modify time changes when entries are added, removed or renamed
+in it, but usually not when an existing file is overwritten in place, so
+watch mode still runs a full resync every SYNC_WATCH_FULL_EVERY seconds.
+
+Database: the binary log position (SHOW BINARY LOG STATUS, or SHOW MASTER
+STATUS on older servers) moves with every committed write on the server, in
+any database. That is only a cheap signal when the copy itself is cheap
+(DB_INCREMENTAL or DB_BINLOG); for a plain full dump the signature is taken
+from information_schema.TABLES (UPDATE_TIME, CREATE_TIME and the table count
+of REMOTE_DB), which only moves with REMOTE_DB.
+"""
+import ftplib
+import logging
+import os
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from config import DB_BINLOG, DB_INCREMENTAL, REMOTE_DB
+from db_common import connect_mysql
+from ftp_pool import FTPConnectionPool, is_connection_error
+from metrics import METRICS
+
+_MODIFY_RE = re.compile(r'(?:^|;)modify=(\d{14})', re.IGNORECASE)
+
+
+def parse_mlst_modify(reply: str) -> Optional[int]:
+    """Epoch seconds of the ``modify`` fact in an MLST reply, or None."""
+    for line in reply.splitlines()[1:-1]:
+        facts = line.strip().split(' ', 1)[0]
+        m = _MODIFY_RE.search(facts)
+        if m:
+            dt = datetime.strptime(m.group(1), '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+            return int(dt.timestamp())
+    return None
+
+
+def _depth(rel_dir: str) -> int:
+    return rel_dir.count(os.sep) + 1 if rel_dir else 0
+
+
+class DirectoryWatch:
+    """rel_dir -> modify time (epoch) cache for the remote tree, with MLST probes.
+
+    A sync pass calls ``begin()``, reports directories through ``seen`` (full
+    listing) or ``discovered`` (delta listing) and ends with ``commit(ok)``;
+    nothing learned in a pass with listing errors is kept, so the affected
+    directories are probed as changed again next time.
+    """
+
+    def __init__(self, pool: FTPConnectionPool, workers: int = 4):
+        self.pool = pool
+        self.workers = max(1, workers)
+        self.dirs: Dict[str, Optional[int]] = {}
+        self.complete = False  # the cache covers the whole tree
+        self._staged: Dict[str, Optional[int]] = {}
+        self._gone: List[str] = []
+        self._full = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def supported(conn: ftplib.FTP) -> bool:
+        try:
+            feat = conn.sendcmd('FEAT')
+        except ftplib.Error:
+            return False
+        return any(line.strip().upper().startswith('MLST') for line in feat.splitlines()[1:-1])
+
+    # -- one sync pass -----------------------------------------------------------
+    def begin(self, full: bool):
+        self._staged = {}
+        self._gone = []
+        self._full = full
+
+    def seen(self, rel_dir: str, mdtm_dt) -> bool:
+        """Full listing: remember every directory and descend into all of them."""
+        with self._lock:
+            self._staged[rel_dir] = int(mdtm_dt.timestamp()) if mdtm_dt is not None else None
+        return True
+
+    def discovered(self, rel_dir: str, mdtm_dt) -> bool:
+        """Delta listing: descend only into directories the cache does not know yet."""
+        if rel_dir in self.dirs:
+            return False
+        return self.seen(rel_dir, mdtm_dt)
+
+    def commit(self, ok: bool):
+        if not ok:
+            if self._full:
+                self.complete = False
+            return
+        if self._full:
+            self.dirs = {}
+            self.complete = True
+        for gone in self._gone:
+            prefix = gone + os.sep
+            for rel_dir in [d for d in self.dirs if d == gone or d.startswith(prefix)]:
+                del self.dirs[rel_dir]
+        self.dirs.update(self._staged)
+
+    # -- probing -----------------------------------------------------------------
+    def stage_root(self):
+        """Full listing: the root's own modify time (listings only show those of subdirectories)."""
+        modify = self._probe_one('')
+        with self._lock:
+            self._staged[''] = modify
+
+    def _mlst(self, conn: ftplib.FTP, rel_dir: str) -> Optional[int]:
+        return parse_mlst_modify(conn.sendcmd(f'MLST {self.pool.remote_dir(rel_dir)}'))
+
+    def _probe_one(self, rel_dir: str) -> Optional[int]:
+        for attempt in (1, 2):
+            try:
+                with self.pool.connection() as conn:
+                    return self._mlst(conn, rel_dir)
+            except Exception as e:
+                if attempt == 2 or not is_connection_error(e):
+                    raise
+        return None
+
+    def probe(self) -> Tuple[List[Tuple[str, int]], int]:
+        """MLST every known directory. Returns ([(changed rel_dir, depth)], probe errors).
+
+        Changed directories are staged with their new modify time; vanished
+        ones are staged for removal from the cache.
+        """
+        todo = sorted(self.dirs)
+        changed: List[str] = []
+        errors = 0
+        lock = threading.Lock()
+
+        def run(chunk: List[str]):
+            nonlocal errors
+            for rel_dir in chunk:
+                try:
+                    modify = self._probe_one(rel_dir)
+                except ftplib.error_perm:
+                    # 550: the directory is gone
+                    with lock:
+                        self._gone.append(rel_dir)
+                    continue
+                except Exception as e:
+                    logging.warning('Watch: cannot probe %s: %s', self.pool.remote_dir(rel_dir), e)
+                    with lock:
+                        errors += 1
+                    continue
+                if modify is None or modify != self.dirs.get(rel_dir):
+                    with lock:
+                        changed.append(rel_dir)
+                        self._staged[rel_dir] = modify
+
+        chunks = [todo[i::self.workers] for i in range(min(self.workers, len(todo)))]
+        threads = [threading.Thread(target=run, args=(c,), name=f'ftp-probe-{i}', daemon=True)
+                   for i, c in enumerate(chunks)]
+        with METRICS.timer('watch_ftp_probe'):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        METRICS.incr('watch_dirs_probed', len(todo))
+        METRICS.incr('watch_dirs_changed', len(changed))
+        # A parent that is gone takes its children with it
+        gone = set(self._gone)
+        changed = [d for d in changed if not any(d.startswith(g + os.sep) for g in gone)]
+        return [(d, _depth(d)) for d in sorted(changed)], errors
+
+
+class DatabaseWatch:
+    """Change signature for REMOTE_DB over one long-lived connection.
+
+    ``method`` is 'auto' (binlog position when readable and the copy is
+    incremental, else table metadata), 'binlog' or 'tables'.
+    """
+
+    def __init__(self, method: str = 'auto'):
+        self.method = method
+        self.last: Optional[Tuple] = None
+        self._conn = None
+        # The binlog position is server-wide: with a full dump per change, writes to
+        # any other database on the server would trigger a dump every cycle
+        cheap_copy = DB_INCREMENTAL or DB_BINLOG
+        self._use_binlog = method == 'binlog' or (method == 'auto' and cheap_copy)
+        if method == 'binlog' and not cheap_copy:
+            logging.warning('Watch: SYNC_WATCH_DB_PROBE=binlog without DB_INCREMENTAL or DB_BINLOG; '
+                            'a write to any database on the server triggers a full dump')
+
+    def _cursor(self):
+        if self._conn is None:
+            self._conn = connect_mysql(REMOTE_DB, 'REMOTE_DB', autocommit=True)
+            cur = self._conn.cursor()
+            try:
+                # MySQL 8 caches information_schema statistics for 24h by default
+                cur.execute('SET SESSION information_schema_stats_expiry = 0')
+            except Exception:
+                pass
+            cur.close()
+        return self._conn.cursor()
+
+    def _binlog(self, cur) -> Optional[Tuple]:
+        for stmt in ('SHOW BINARY LOG STATUS', 'SHOW MASTER STATUS'):
+            try:
+                cur.execute(stmt)
+                row = cur.fetchone()
+            except Exception:
+                continue
+            if row:
+                return ('binlog', row[0], int(row[1]))
+        return None
+
+    def _tables(self, cur) -> Tuple:
+        cur.execute(
+            'SELECT COUNT(*), MAX(UPDATE_TIME), MAX(CREATE_TIME) FROM information_schema.TABLES '
+            'WHERE TABLE_SCHEMA = %s', (REMOTE_DB['database'],))
+        count, updated, created = cur.fetchone()
+        return ('tables', int(count), str(updated), str(created))
+
+    def signature(self) -> Optional[Tuple]:
+        """Current signature, or None when the server could not be asked."""
+        for attempt in (1, 2):
+            try:
+                cur = self._cursor()
+                try:
+                    sig = self._binlog(cur) if self._use_binlog else None
+                    if sig is None:
+                        if self.method == 'binlog':
+                            raise RuntimeError('binary log position not readable (binlog off or missing REPLICATION CLIENT)')
+                        if self._use_binlog:
+                            logging.info('Watch: binary log position not readable; using information_schema UPDATE_TIME')
+                            self._use_binlog = False
+                        sig = self._tables(cur)
+                    return sig
+                finally:
+                    cur.close()
+            except Exception as e:
+                self.close()
+                if attempt == 2:
+                    logging.warning('Watch: database probe failed: %s', e)
+        return None
+
+    def changed(self) -> Tuple[bool, Optional[Tuple]]:
+        """(changed since the last commit, current signature). Unknown counts as changed."""
+        with METRICS.timer('watch_db_probe'):
+            sig = self.signature()
+        return sig is None or sig != self.last, sig
+
+    def commit(self, sig: Optional[Tuple]):
+        """Record the signature taken before a successful copy."""
+        self.last = sig
+
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None